@@ -1,22 +1,34 @@
 '''
 Add Binary Ratings in Bechdel Dataset
   Running this script will result in loading a dataset of movies including sentiment scores from IMDb reviews. For further analysis, simplify the 'rating' column into binary 
-  classification: 1 for pass (rating == 3), 0 for fail (rating != 3). Additionally, the updated dataset is saved to the same CSV file, 'bechdel_movies.csv'. You can also check the 
-  distribution of the new binary 'rating_binary' column dataset to confirm that the proper changes were made.
+  classification: 1 for pass (rating == 3), 0 for fail (rating != 3). You can also check the distribution of the new binary 'rating_binary' column dataset to confirm that
+  the proper changes were made.
 
-  This script only requires the pandas library.
+  The dataset lives in the versioned table './DATA/bechdel_table/' (ColumnTable.py, opened through BechdelData.py). Only the 'rating' column is read and
+  only the 'rating_binary' column is written, as a new table version; the previous version can be restored with open_table().rollback(). Pipeline.py runs
+  add_binary_rating() as the 'binary' task.
+
+  This script only requires the pandas and numpy libraries.
 '''
-import pandas as pd
+import numpy as np
+from BechdelData import open_table, type_movies
+
+
+# Function to add 'rating_binary' (and the other derived columns) to a frame in the dataset's typed schema
+def add_binary_rating(df):
+    return type_movies(df.copy())
 
-df = pd.read_csv('./DATA/bechdel_movies.csv')
 
-# Simplify the 'rating' column into binary classification: 1 for pass (rating == 3), 0 for fail (rating != 3)
-df['rating_binary'] = df['rating'].apply(lambda x: 1 if x == 3 else 0)
+if __name__ == '__main__':
+    table = open_table()
 
-# Drop rows with missing sentiment values
-df_clean = df.dropna(subset=['sentiment'])
+    # 'rating_binary' is 1 for pass (rating == 3), 0 for fail (rating != 3)
+    df = table.read(['rating', 'sentiment'])
+    rating_binary = (df['rating'] == 3).astype(np.int8)
 
-# Check the distribution of the new binary 'rating_binary' column
-df_clean['rating_binary'].value_counts()
+    # Check the distribution of the new binary 'rating_binary' column (rows with a sentiment score)
+    print(rating_binary[df['sentiment'].notna()].value_counts())
 
-df.to_csv('./DATA/bechdel_movies.csv', index=False)
+    # Write only the new column
+    version = table.write_column('rating_binary', rating_binary, message='add rating_binary')
+    print(f"Dataset table at version {version}")
@@ -0,0 +1,150 @@
+'''
+Aggregate Cube
+    The plots and hypothesis tests keep asking the same questions of the dataset: how many movies per year or decade, what share of them pass, how is the
+    sentiment distributed per group. Answering each one with a groupby over every row gets slower as the dataset grows, so this module materializes a small
+    cube with one cell per (year, rating, rating_binary) holding:
+
+    - count:    number of movies
+    - scored:   number of movies with a sentiment score
+    - sum, sumsq, min, max: of the sentiment scores
+
+    Every breakdown the scripts use (by year, by decade, by rating, by pass/fail, and any combination) is a sum over cells, so queries cost O(cells) - a few
+    hundred - instead of O(rows). Decades are always binned with BechdelData.decade_of.
+
+    The cube is saved to './DATA/cache/aggregate_cube.pkl' together with a hash of each movie's row. load_cube() compares those hashes with the current
+    dataset: movies that were merged in since the last build (e.g. by ScrapeNewBechdel.py) are folded into the existing cube, and the cube is only rebuilt
+    from scratch when a stored movie changed or was removed.
+
+    Usage:
+        from AggregateCube import load_cube
+        cube = load_cube()                   # every movie
+        cube.scored().pass_rate('decade')    # only movies with a sentiment score
+
+    This module requires the pandas and numpy libraries.
+'''
+
+import os
+
+import numpy as np
+import pandas as pd
+from BechdelData import load_movies, decade_of, CACHE_DIR
+
+CUBE_PATH = os.path.join(CACHE_DIR, 'aggregate_cube.pkl')
+
+# Dimensions of the cube and the columns that feed its cells
+KEYS = ['year', 'rating', 'rating_binary']
+ROW_COLUMNS = ['year', 'rating', 'sentiment']
+
+# How each measure is combined when cells are merged
+MERGE = {'count': 'sum', 'scored': 'sum', 'sum': 'sum', 'sumsq': 'sum', 'min': 'min', 'max': 'max'}
+
+
+class AggregateCube:
+    '''
+    Per-(year, rating, rating_binary) counts and sentiment moments, with O(cells) queries.
+    '''
+
+    def __init__(self, cells):
+        self.cells = cells # DataFrame indexed by KEYS with the MERGE columns
+
+    @classmethod
+    def build(cls, df):
+        sentiment = df['sentiment'].astype(np.float64) if 'sentiment' in df else pd.Series(np.nan, index=df.index)
+        frame = pd.DataFrame({
+            'year': df['year'].astype(np.int16),
+            'rating': df['rating'].astype(np.int8),
+            'rating_binary': (df['rating'] == 3).astype(np.int8),
+            'sentiment': sentiment,
+            'sentiment_sq': sentiment * sentiment,
+        })
+        grouped = frame.groupby(KEYS)
+        cells = pd.DataFrame({
+            'count': grouped.size(),
+            'scored': grouped['sentiment'].count(),
+            'sum': grouped['sentiment'].sum(),
+            'sumsq': grouped['sentiment_sq'].sum(),
+            'min': grouped['sentiment'].min(),
+            'max': grouped['sentiment'].max(),
+        })
+        return cls(cells)
+
+    # Function to combine this cube with another one (e.g. built from newly merged movies)
+    def merge(self, other):
+        return AggregateCube(pd.concat([self.cells, other.cells]).groupby(level=KEYS).agg(MERGE))
+
+    # Function to fold new movies into the cube
+    def update(self, new_rows):
+        return self.merge(AggregateCube.build(new_rows))
+
+    # The same cube restricted to movies with a sentiment score (what the analysis scripts work on)
+    def scored(self):
+        cells = self.cells.loc[self.cells['scored'] > 0].copy()
+        cells['count'] = cells['scored']
+        return AggregateCube(cells)
+
+    # Function to group the cells by any of 'year', 'decade', 'rating' and 'rating_binary'
+    def _group(self, by):
+        cells = self.cells.reset_index()
+        if 'decade' in by:
+            cells['decade'] = decade_of(cells['year'])
+        cells['passing'] = cells['count'] * cells['rating_binary']
+        return cells.groupby(by)
+
+    # Number of movies per group
+    def counts(self, by):
+        return self._group(by)['count'].sum()
+
+    # Share of movies passing the Bechdel test per group
+    def pass_rate(self, by='decade'):
+        grouped = self._group(by)
+        return grouped['passing'].sum() / grouped['count'].sum()
+
+    # Contingency table of movies failing (column 0) and passing (column 1) per group
+    def contingency(self, by='decade'):
+        return self.counts([by, 'rating_binary']).unstack(fill_value=0)
+
+    # Count, mean, variance, min and max of the sentiment scores per group
+    def sentiment_stats(self, by):
+        grouped = self._group(by)
+        n = grouped['scored'].sum()
+        total = grouped['sum'].sum()
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = total / n
+            var = (grouped['sumsq'].sum() - total * mean) / (n - 1)
+        return pd.DataFrame({'count': n, 'mean': mean, 'var': var.clip(lower=0), 'min': grouped['min'].min(), 'max': grouped['max'].max()})
+
+
+# Function to hash each movie's row, keyed by its Bechdel id, so changes to stored movies can be detected
+def row_hashes(df):
+    key = df['id'] if 'id' in df else df['imdbid']
+    columns = [col for col in ROW_COLUMNS if col in df]
+    return pd.Series(pd.util.hash_pandas_object(df[columns], index=False).to_numpy(), index=key.to_numpy())
+
+
+def _save(cube, hashes, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    pd.to_pickle({'cells': cube.cells, 'hashes': hashes}, path + '.tmp')
+    os.replace(path + '.tmp', path)
+
+
+# Function to load the cube for a dataset (every movie of the Bechdel dataset by default), updating the saved cube with new movies
+def load_cube(df=None, path=CUBE_PATH):
+    if df is None:
+        df = load_movies(clean=False)
+    hashes = row_hashes(df)
+
+    saved = pd.read_pickle(path) if os.path.exists(path) else None
+    if saved is not None and hashes.index.is_unique:
+        old = saved['hashes']
+        known = hashes.index.isin(old.index)
+        if known.sum() == len(old) and (hashes[known].reindex(old.index) == old).all():
+            cube = AggregateCube(saved['cells'])
+            if known.all():
+                return cube # nothing changed
+            cube = cube.update(df.loc[~known])
+            _save(cube, hashes, path)
+            return cube
+
+    cube = AggregateCube.build(df) # first build, or stored movies changed
+    _save(cube, hashes, path)
+    return cube
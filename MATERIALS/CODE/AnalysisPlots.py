@@ -2,70 +2,110 @@
 Generating Analysis Plots
 This script loads the data from bechdel_movies.csv and cleans it. Then subsets of the data are created to ease the process of generating plots.
 
-Running this script requires the pandas and matplotlib.pyplot libraries.
+The dataset is loaded with BechdelData.py, which already provides typed 'year', 'rating_binary' and 'decade' columns. The pass rates per decade and
+movie counts per year are read from the aggregate cube (AggregateCube.py).
+
+The plots are registered with PlotRegistry.py and saved as PNGs in './OUTPUT/Analysis/' instead of being shown interactively, so the script can run
+headless. The boxplot statistics, KDE curves and correlation matrix are computed once and shared with the plots, and plots whose inputs haven't changed
+since the last run are skipped.
+
+The sentiment boxplot and KDE are drawn from the mergeable sentiment sketches of SentimentSketch.py (quantile sketches and fixed-bin histograms per
+decade and pass/fail group) instead of the raw sentiment column, so they take the same memory for a million reviews as for a thousand movies. Set
+'SENTIMENT_LEVEL' to 'review' to draw them from the score of every review in the review store instead of the mean score of every movie.
+
+matplotlib and seaborn are imported inside the drawing functions, which run in the rendering processes, so importing this script (and starting
+'bechdel.py plots') doesn't pay for them.
+
+Running this script requires the pandas, matplotlib.pyplot and seaborn libraries.
 '''
 
-import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
+from BechdelData import load_movies, clean_movies
+from AggregateCube import load_cube
+from PlotRegistry import plot, render_plots
+from SentimentSketch import load_sketches, load_review_sketches
 
-# Load the dataset again and clean as before
-file_path = './data/bechdel_movies.csv'
-df = pd.read_csv(file_path)
+# Directory to save the plots
+output_folder = './OUTPUT/Analysis/'
 
-# Drop rows with missing sentiment values
-df_clean = df.dropna(subset=['sentiment'])
+# Sentiment scores summarized by the sketches: 'movie' (the mean score of each movie) or 'review' (every review in the review store)
+SENTIMENT_LEVEL = 'movie'
 
-# Load and prepare data (assuming df_clean is already cleaned)
-df_clean['year'] = pd.to_numeric(df_clean['year'], errors='coerce')
 
 # 1. Proportion of Movies Passing the Bechdel Test by Decade
-df_clean['decade'] = (df_clean['year'] // 10) * 10
-bechdel_by_decade = df_clean.groupby('decade')['rating_binary'].mean()
-
-plt.figure(figsize=(10, 6))
-bechdel_by_decade.plot(kind='bar', color='skyblue')
-plt.title('Proportion of Movies Passing the Bechdel Test by Decade', fontsize=14)
-plt.xlabel('Decade', fontsize=12)
-plt.ylabel('Proportion Passing', fontsize=12)
-plt.grid(axis='y', linestyle='--')
-plt.xticks(rotation=45)
-plt.show()
+@plot('analysis', 'PassByDecade.png', columns=['decade', 'rating_binary'], aggregates=['pass_rate_by_decade'],
+      title='Proportion of Movies Passing the Bechdel Test by Decade')
+def pass_by_decade(data, shared, spec):
+    import matplotlib.pyplot as plt
+    shared['pass_rate_by_decade'].plot(kind='bar', color='skyblue')
+    plt.title(spec['title'], fontsize=14)
+    plt.xlabel('Decade', fontsize=12)
+    plt.ylabel('Proportion Passing', fontsize=12)
+    plt.grid(axis='y', linestyle='--')
+    plt.xticks(rotation=45)
+
+
 # 2. Distribution of Sentiment Scores (KDE plot)
-plt.figure(figsize=(10, 6))
-df_clean[df_clean['rating_binary'] == 1]['sentiment'].plot(kind='kde', color='green', label='Passing', linewidth=2)
-df_clean[df_clean['rating_binary'] == 0]['sentiment'].plot(kind='kde', color='red', label='Failing', linewidth=2)
-plt.title('Distribution of Sentiment Scores for Movies Passing vs Failing', fontsize=14)
-plt.xlabel('Sentiment Score', fontsize=12)
-plt.ylabel('Density', fontsize=12)
-plt.legend()
-plt.grid(True)
-plt.show()
+@plot('analysis', 'PassFailvsSentimentScore.png', columns=['sentiment', 'rating_binary'], aggregates=['sentiment_kde_by_result'], raw=False,
+      title='Distribution of Sentiment Scores for Movies Passing vs Failing')
+def sentiment_kde(data, shared, spec):
+    import matplotlib.pyplot as plt
+    colors = {'Passing': 'green', 'Failing': 'red'}
+    for label, (x, density) in shared['sentiment_kde_by_result'].items():
+        plt.plot(x, density, color=colors[label], label=label, linewidth=2)
+    plt.title(spec['title'], fontsize=14)
+    plt.xlabel('Sentiment Score', fontsize=12)
+    plt.ylabel('Density', fontsize=12)
+    plt.legend()
+    plt.grid(True)
+
 
 # 3. Boxplots of Sentiment Scores Over Time
-df_clean['decade'] = pd.cut(df_clean['year'], bins=range(1870, 2030, 10), right=False, labels=[f"{x}s" for x in range(1870, 2020, 10)])
-
-plt.figure(figsize=(12, 8))
-df_clean.boxplot(column='sentiment', by='decade', grid=False, patch_artist=True, boxprops=dict(facecolor='lightblue'))
-plt.title('Boxplot of Sentiment Scores Over Time', fontsize=14)
-plt.suptitle('')
-plt.xlabel('Decade', fontsize=12)
-plt.ylabel('Sentiment Score', fontsize=12)
-plt.xticks(rotation=45)
-plt.grid(axis='y')
-plt.show()
+@plot('analysis', 'SentimentOverTimeBoxplot.png', columns=['decade', 'sentiment'], aggregates=['sentiment_boxplot_by_decade'], raw=False,
+      figsize=(12, 8), title='Boxplot of Sentiment Scores Over Time')
+def sentiment_boxplot(data, shared, spec):
+    import matplotlib.pyplot as plt
+    plt.gca().bxp(shared['sentiment_boxplot_by_decade'], patch_artist=True, boxprops=dict(facecolor='lightblue'))
+    plt.title(spec['title'], fontsize=14)
+    plt.xlabel('Decade', fontsize=12)
+    plt.ylabel('Sentiment Score', fontsize=12)
+    plt.xticks(rotation=45)
+    plt.grid(axis='y')
+
 
 # 4. Movie Count per Year
-plt.figure(figsize=(10, 6))
-df_clean.groupby('year')['title'].count().plot(kind='line', color='purple', linewidth=2)
-plt.title('Number of Movies Evaluated for Bechdel Test Per Year', fontsize=14)
-plt.xlabel('Year', fontsize=12)
-plt.ylabel('Number of Movies', fontsize=12)
-plt.grid(True)
-plt.show()
+@plot('analysis', 'MoviesEvaluatedPerYear.png', columns=['year', 'title'], aggregates=['count_by_year'],
+      title='Number of Movies Evaluated for Bechdel Test Per Year')
+def movies_per_year(data, shared, spec):
+    import matplotlib.pyplot as plt
+    shared['count_by_year'].plot(kind='line', color='purple', linewidth=2)
+    plt.title(spec['title'], fontsize=14)
+    plt.xlabel('Year', fontsize=12)
+    plt.ylabel('Number of Movies', fontsize=12)
+    plt.grid(True)
+
+
 # 5. Correlation Heatmap
-plt.figure(figsize=(8, 6))
-correlation_matrix = df_clean[['year', 'sentiment', 'rating_binary']].corr()
-sns.heatmap(correlation_matrix, annot=True, cmap='coolwarm', linewidths=0.5)
-plt.title('Correlation Heatmap for Year, Sentiment, and Bechdel Test Score', fontsize=14)
-plt.show()
+@plot('analysis', 'HeatmapNumericalFeatures.png', columns=['year', 'sentiment', 'rating_binary'], aggregates=['correlation_matrix'], figsize=(8, 6),
+      title='Correlation Heatmap for Year, Sentiment, and Bechdel Test Score')
+def correlation_heatmap(data, shared, spec):
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    sns.heatmap(shared['correlation_matrix'], annot=True, cmap='coolwarm', linewidths=0.5)
+    plt.title(spec['title'], fontsize=14)
+
+
+# Function to render the analysis plots that changed since the last run (the 'plots' command of bechdel.py)
+def main(force=False):
+    # Load the dataset, keeping only rows with a sentiment score; counts and pass rates come from the aggregate cube of the same rows
+    movies = load_movies(clean=False)
+    df_clean = clean_movies(movies)
+    cube = load_cube(movies).scored()
+    sketches = load_review_sketches(movies) if SENTIMENT_LEVEL == 'review' else load_sketches(movies)
+
+    # Render the plots that changed since the last run
+    result = render_plots(df_clean, 'analysis', output_folder, force=force, cube=cube, sketches=sketches)
+    print(f"Rendered {len(result['rendered'])} plots, skipped {len(result['skipped'])} unchanged plots")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,247 @@
+'''
+Hypothesis Test Runner
+    This script loads the Bechdel dataset once and runs every registered statistical test on it, instead of each hypothesis script reloading and
+    recleaning the data and recomputing the same group splits. Intermediates that several tests share (the pass/fail groups, ranks, the decade
+    contingency table, ...) live on an AnalysisContext and are computed the first time a test asks for them. Count-based intermediates such as the decade
+    contingency table are read from the aggregate cube (AggregateCube.py) instead of grouping every row.
+
+    Adding a hypothesis is a registration:
+
+        @hypothesis('my_test', 'What the test checks')
+        def my_test(ctx):
+            stat, p = some_test(ctx.pass_sentiment, ctx.fail_sentiment)
+            return {'statistic': stat, 'p_value': p}
+
+    The permutation/bootstrap tests ('sentiment_permutation', 'year_sentiment_spearman_permutation') don't rely on the normal approximations of the
+    t-test and Spearman p-values; they use the vectorized resampling engine in Resampling.py ('RESAMPLES' replicates, seeded with 'RESAMPLING_SEED',
+    spread over 'RESAMPLING_WORKERS' processes - one per CPU by default; the results don't depend on the number of processes).
+
+    scipy.stats is imported inside the tests that use it rather than at the top of the module, so importing the runner (and starting 'bechdel.py tests')
+    doesn't pay for it.
+
+    When run, the results of all tests are printed and written as a JSON report ('./OUTPUT/hypothesis_results.json') with the time taken by each test and
+    by each shared intermediate. HypothesisTesting.py and HypothesisTestingTime.py run subsets of these tests.
+
+    Running this script requires the numpy, scipy.stats and pandas libraries.
+'''
+
+import json
+import os
+import time
+
+import numpy as np
+from BechdelData import load_movies, clean_movies, TABLE_DIR
+from AggregateCube import AggregateCube, load_cube
+from Resampling import permutation_mean_diff, bootstrap_mean_diff, permutation_correlation, bootstrap_correlation
+
+REPORT_PATH = './OUTPUT/hypothesis_results.json'
+
+# Resampling settings for the permutation/bootstrap tests (Resampling.py); the seed makes the reported p-values and intervals reproducible
+RESAMPLES = 10000
+RESAMPLING_SEED = 3
+RESAMPLING_WORKERS = os.cpu_count() or 1 # worker processes; results do not depend on the number of workers
+
+# Registry of hypothesis tests: name -> (description, function taking an AnalysisContext and returning a dict of results)
+HYPOTHESES = {}
+
+
+# Decorator to register a hypothesis test
+def hypothesis(name, description):
+    def register(func):
+        HYPOTHESES[name] = (description, func)
+        return func
+    return register
+
+
+class AnalysisContext:
+    '''
+    The cleaned dataset plus lazily computed intermediates shared between tests. Each intermediate is computed once, on first use, and timed.
+    '''
+
+    def __init__(self, df, cube=None, executor=None):
+        self.df = df
+        self.executor = executor # process pool for the resampling tests (None: start 'RESAMPLING_WORKERS' processes per test)
+        self.timings = {} # intermediate name -> seconds spent computing it
+        self._cache = {} if cube is None else {'cube': cube}
+
+    def shared(self, name, compute):
+        if name not in self._cache:
+            start = time.perf_counter()
+            self._cache[name] = compute()
+            self.timings[name] = time.perf_counter() - start
+        return self._cache[name]
+
+    @property
+    def passes(self):
+        return self.shared('passes', lambda: self.df['rating_binary'].to_numpy() == 1)
+
+    @property
+    def sentiment(self):
+        return self.shared('sentiment', lambda: self.df['sentiment'].to_numpy(dtype=np.float64))
+
+    @property
+    def year(self):
+        return self.shared('year', lambda: self.df['year'].to_numpy(dtype=np.float64))
+
+    # Sorted sentiment scores of the movies that pass / fail the Bechdel test
+    @property
+    def pass_sentiment(self):
+        return self.shared('pass_sentiment', lambda: np.sort(self.sentiment[self.passes]))
+
+    @property
+    def fail_sentiment(self):
+        return self.shared('fail_sentiment', lambda: np.sort(self.sentiment[~self.passes]))
+
+    @property
+    def pass_years(self):
+        return self.shared('pass_years', lambda: self.year[self.passes])
+
+    @property
+    def fail_years(self):
+        return self.shared('fail_years', lambda: self.year[~self.passes])
+
+    # Average ranks (ties share a rank), used by the rank-based tests
+    @property
+    def year_ranks(self):
+        from scipy import stats
+        return self.shared('year_ranks', lambda: stats.rankdata(self.year))
+
+    @property
+    def sentiment_ranks(self):
+        from scipy import stats
+        return self.shared('sentiment_ranks', lambda: stats.rankdata(self.sentiment))
+
+    # Aggregate cube of the movies in df (AggregateCube.py); the saved cube is passed in when df is the standard dataset
+    @property
+    def cube(self):
+        return self.shared('cube', lambda: AggregateCube.build(self.df))
+
+    # Number of movies failing (column 0) and passing (column 1) in each decade
+    @property
+    def decade_table(self):
+        return self.shared('decade_table', lambda: self.cube.contingency('decade'))
+
+
+# Function to turn numpy scalars into plain Python numbers so results can be written as JSON
+def _plain(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, dict):
+        return {k: _plain(v) for k, v in value.items()}
+    return value
+
+
+# 1. Sentiment of movies that pass vs fail (two-sample t-test)
+@hypothesis('sentiment_ttest', 'Sentiment score of movies that pass vs fail the Bechdel test (two-sample t-test)')
+def sentiment_ttest(ctx):
+    from scipy import stats
+    t_stat, p_value = stats.ttest_ind(ctx.pass_sentiment, ctx.fail_sentiment)
+    return {'statistic': t_stat, 'p_value': p_value}
+
+
+# 2. Sentiment distributions of movies that pass vs fail (Mann-Whitney U, non-parametric)
+@hypothesis('sentiment_mannwhitney', 'Sentiment distribution of movies that pass vs fail the Bechdel test (Mann-Whitney U test)')
+def sentiment_mannwhitney(ctx):
+    from scipy import stats
+    u_stat, p_value = stats.mannwhitneyu(ctx.pass_sentiment, ctx.fail_sentiment, alternative='two-sided')
+    return {'statistic': u_stat, 'p_value': p_value}
+
+
+# 3. Release year of movies that pass vs fail (two-sample t-test)
+@hypothesis('year_ttest', 'Year and passing the Bechdel test (two-sample t-test)')
+def year_ttest(ctx):
+    from scipy import stats
+    t_stat, p_value = stats.ttest_ind(ctx.pass_years, ctx.fail_years)
+    return {'statistic': t_stat, 'p_value': p_value}
+
+
+# 4. Proportion passing over time (chi-square test on the decade contingency table)
+@hypothesis('decade_chi2', 'Proportion passing the Bechdel test over time (chi-square test)')
+def decade_chi2(ctx):
+    from scipy import stats
+    chi2_stat, p_value, dof, _ = stats.chi2_contingency(ctx.decade_table)
+    return {'statistic': chi2_stat, 'p_value': p_value, 'dof': dof}
+
+
+# 5. Year vs sentiment (Pearson correlation, assumes normality)
+@hypothesis('year_sentiment_pearson', 'Year vs sentiment score (Pearson correlation)')
+def year_sentiment_pearson(ctx):
+    from scipy import stats
+    corr, p_value = stats.pearsonr(ctx.year, ctx.sentiment)
+    return {'statistic': corr, 'p_value': p_value}
+
+
+# 6. Year vs sentiment (Spearman correlation) - the Pearson correlation of the shared ranks, with the same t-based p-value as scipy's spearmanr
+@hypothesis('year_sentiment_spearman', 'Year vs sentiment score (Spearman correlation)')
+def year_sentiment_spearman(ctx):
+    from scipy import stats
+    n = len(ctx.year_ranks)
+    rho = np.corrcoef(ctx.year_ranks, ctx.sentiment_ranks)[0, 1]
+    t_stat = rho * np.sqrt((n - 2) / ((1.0 - rho) * (1.0 + rho)))
+    p_value = 2 * stats.t.sf(abs(t_stat), n - 2)
+    return {'statistic': rho, 'p_value': p_value}
+
+
+# 7. Sentiment of movies that pass vs fail (permutation test of the difference in means, with a bootstrap confidence interval)
+@hypothesis('sentiment_permutation', 'Mean sentiment of movies that pass minus movies that fail the Bechdel test (permutation test, bootstrap CI)')
+def sentiment_permutation(ctx):
+    settings = {'n_resamples': RESAMPLES, 'seed': RESAMPLING_SEED, 'workers': RESAMPLING_WORKERS, 'executor': ctx.executor}
+    test = permutation_mean_diff(ctx.pass_sentiment, ctx.fail_sentiment, **settings)
+    interval = bootstrap_mean_diff(ctx.pass_sentiment, ctx.fail_sentiment, **settings)
+    return {'statistic': test['statistic'], 'p_value': test['p_value'], 'ci_low': interval['ci_low'], 'ci_high': interval['ci_high'],
+            'n_resamples': RESAMPLES}
+
+
+# 8. Year vs sentiment (permutation test of the Spearman correlation - the Pearson correlation of the shared ranks - with a bootstrap confidence interval)
+@hypothesis('year_sentiment_spearman_permutation', 'Year vs sentiment score (Spearman correlation, permutation test, bootstrap CI)')
+def year_sentiment_spearman_permutation(ctx):
+    settings = {'n_resamples': RESAMPLES, 'seed': RESAMPLING_SEED, 'workers': RESAMPLING_WORKERS, 'executor': ctx.executor}
+    test = permutation_correlation(ctx.year_ranks, ctx.sentiment_ranks, method='pearson', **settings)
+    interval = bootstrap_correlation(ctx.year, ctx.sentiment, method='spearman', **settings) # ranks are recomputed within each resample
+    return {'statistic': test['statistic'], 'p_value': test['p_value'], 'ci_low': interval['ci_low'], 'ci_high': interval['ci_high'],
+            'n_resamples': RESAMPLES}
+
+
+# Function to run the registered tests (all of them, or the ones named) on one shared context and build the report. The resampling tests run on
+# 'executor' when one is given (a process pool shared with other work) instead of starting their own.
+def run_hypotheses(names=None, df=None, report_path=None, executor=None):
+    start = time.perf_counter()
+    if df is None:
+        movies = load_movies(clean=False)
+        ctx = AnalysisContext(clean_movies(movies), cube=load_cube(movies).scored(), executor=executor)
+    else:
+        ctx = AnalysisContext(df, executor=executor)
+    load_seconds = time.perf_counter() - start
+
+    results = {}
+    for name in names or HYPOTHESES:
+        description, test = HYPOTHESES[name]
+        test_start = time.perf_counter()
+        result = test(ctx)
+        results[name] = {'description': description, **_plain(result), 'seconds': time.perf_counter() - test_start}
+
+    report = {
+        'dataset': TABLE_DIR if df is None else 'dataframe',
+        'rows': len(ctx.df),
+        'load_seconds': load_seconds,
+        'shared_seconds': ctx.timings,
+        'tests': results,
+        'total_seconds': time.perf_counter() - start,
+    }
+    if report_path:
+        os.makedirs(os.path.dirname(report_path), exist_ok=True)
+        with open(report_path, 'w') as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+# Function to run the named tests (all by default), print the results and write the report (the 'tests' command of bechdel.py)
+def main(names=None):
+    report = run_hypotheses(names, report_path=REPORT_PATH)
+    for name, result in report['tests'].items():
+        print(f"{result['description']} p-value: {result['p_value']} ({result['seconds'] * 1000:.1f} ms)")
+    print(f"Ran {len(report['tests'])} tests on {report['rows']} movies in {report['total_seconds']:.3f} s; report written to {REPORT_PATH}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,191 @@
+'''
+Bechdel Dataset Loader
+    This module is the one place where the analysis scripts load 'bechdel_movies.csv'. Instead of every script calling pd.read_csv with default dtypes,
+    recomputing 'rating_binary' with a row-by-row .apply(lambda ...) and re-running dropna, the dataset is read once into an explicit compact schema:
+
+    - year int16, rating int8, imdbid int64, id/submitterid int32, sentiment float32, date parsed as datetime
+    - the 'dubious' and 'visible' flags as categoricals
+    - derived columns computed with vectorized operations: rating_binary (int8, 1 = pass when rating == 3), decade (int16) and test_result
+      (categorical 'Pass'/'Fail')
+
+    The working copy of the dataset is the versioned columnar table './DATA/bechdel_table/' (ColumnTable.py), created from 'bechdel_movies.csv' the
+    first time it is opened. After that the table is the only source of truth: changing a column (AddBinaryRating.py, the pipeline) writes only that
+    column and can be rolled back, and the CSV is never read again implicitly. Moving data between the two is an explicit step - 'python CODE/bechdel.py
+    import' commits the CSV as a new table version, and 'python CODE/bechdel.py export' writes the current version to the CSV. Every import and export
+    records the CSV's hash, and opening the table prints a warning when the CSV matches none of the hashes in the table's history (it was edited since),
+    so edits to the CSV aren't silently ignored, but they don't overwrite the table (or a rollback) either.
+
+    Other CSVs can be loaded by path. Their typed frame is cached as a Feather file in './DATA/cache/' whose name includes a hash of the CSV, so the cache
+    is invalidated automatically whenever the CSV changes. If pyarrow isn't installed, the cache falls back to a pickle file.
+
+    Usage:
+        from BechdelData import load_movies
+        df_clean = load_movies()             # rows with a sentiment score (the old df.dropna(subset=['sentiment']))
+        df = load_movies(clean=False)        # every row
+        df = load_movies('other.csv')        # a CSV with the same columns
+
+    This module requires the pandas and numpy libraries (and optionally pyarrow for the Feather cache).
+'''
+
+import glob
+import hashlib
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+from ColumnTable import ColumnTable
+
+DATA_PATH = './DATA/bechdel_movies.csv'
+TABLE_DIR = './DATA/bechdel_table/'
+CACHE_DIR = './DATA/cache/'
+
+# Explicit dtypes for the columns stored in the CSV
+CSV_DTYPES = {
+    'title': 'string',
+    'year': 'int16',
+    'rating': 'int8',
+    'dubious': 'float32',
+    'imdbid': 'int64',
+    'id': 'int32',
+    'submitterid': 'int32',
+    'visible': 'int8',
+    'sentiment': 'float32',
+    'rating_binary': 'int8',
+}
+CATEGORICAL_COLUMNS = ['dubious', 'visible']
+DERIVED_COLUMNS = ['rating_binary', 'decade', 'test_result']
+VIEW_COLUMNS = ['decade', 'test_result'] # derived columns that are recomputed on load instead of being stored
+
+_warned_sources = set() # (table directory, CSV hash) pairs open_table() has already warned about
+
+
+# Function to hash the contents of a file (used to name and invalidate the cache)
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()[:16]
+
+
+# Function to bin release years into decades (1994 -> 1990). Every decade breakdown (plots, tests, the aggregate cube) uses these bins.
+def decade_of(year):
+    return ((year // 10) * 10).astype(np.int16)
+
+
+# Function to add the derived columns with vectorized operations
+def add_derived_columns(df):
+    passes = (df['rating'] == 3).to_numpy()
+    df['rating_binary'] = passes.astype(np.int8)
+    df['decade'] = decade_of(df['year'])
+    df['test_result'] = pd.Categorical.from_codes(passes.astype(np.int8), categories=['Fail', 'Pass'])
+    return df
+
+
+# Function to convert a raw frame (as read from a CSV with default dtypes) to the compact schema and add the derived columns
+def type_movies(df):
+    df = df.astype({col: dtype for col, dtype in CSV_DTYPES.items() if col in df and col != 'rating_binary'})
+    if 'date' in df:
+        df['date'] = pd.to_datetime(df['date'])
+    for col in CATEGORICAL_COLUMNS:
+        if col in df:
+            df[col] = df[col].astype('category')
+    return add_derived_columns(df)
+
+
+# Function to read the CSV into the compact schema
+def read_movies_csv(path=DATA_PATH):
+    header = pd.read_csv(path, nrows=0).columns
+    df = pd.read_csv(path, dtype={col: dtype for col, dtype in CSV_DTYPES.items() if col in header},
+                     parse_dates=['date'] if 'date' in header else False)
+    for col in CATEGORICAL_COLUMNS:
+        if col in df:
+            df[col] = df[col].astype('category')
+    return add_derived_columns(df)
+
+
+def _cache_path(path, digest, ext):
+    name = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(CACHE_DIR, f'{name}.{digest}.{ext}')
+
+
+def _read_cache(cache_file):
+    if cache_file.endswith('.feather'):
+        return pd.read_feather(cache_file)
+    return pd.read_pickle(cache_file)
+
+
+# Function to write the cache, removing caches of older versions of the same CSV
+def _write_cache(df, path, digest):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    name = os.path.splitext(os.path.basename(path))[0]
+    for stale in glob.glob(os.path.join(CACHE_DIR, f'{name}.*')):
+        os.remove(stale)
+    try:
+        cache_file = _cache_path(path, digest, 'feather')
+        df.to_feather(cache_file + '.tmp')
+    except ImportError: # pyarrow not installed
+        cache_file = _cache_path(path, digest, 'pkl')
+        df.to_pickle(cache_file + '.tmp')
+    os.replace(cache_file + '.tmp', cache_file)
+
+
+# Function to keep only the rows with a sentiment score
+def clean_movies(df):
+    return df.loc[df['sentiment'].notna()].copy() if 'sentiment' in df else df
+
+
+# Function to open the versioned table of the dataset, importing 'bechdel_movies.csv' into it the first time. Later edits to the CSV are not imported;
+# a warning (once per process) points at the 'import' command instead.
+def open_table(directory=TABLE_DIR, csv_path=DATA_PATH):
+    table = ColumnTable(directory)
+    if not os.path.exists(csv_path): # nothing to import from; the table is the only copy
+        return table
+    if not table.exists():
+        import_movies(directory, csv_path)
+        return table
+    digest = file_hash(csv_path)
+    if (directory, digest) not in _warned_sources and digest not in table.source_hashes():
+        _warned_sources.add((directory, digest))
+        print(f"warning: '{csv_path}' changed since it was last imported into or exported from {directory}; the table is used as it is. "
+              f"Run 'python CODE/bechdel.py import' to import the CSV as a new table version.", file=sys.stderr)
+    return table
+
+
+# Function to import 'bechdel_movies.csv' into the table as a new version (the 'import' command of bechdel.py); returns the table's version
+def import_movies(directory=TABLE_DIR, csv_path=DATA_PATH):
+    return ColumnTable(directory).write_frame(read_movies_csv(csv_path).drop(columns=VIEW_COLUMNS), message=f'import {os.path.basename(csv_path)}',
+                                              source_hash=file_hash(csv_path))
+
+
+# Function to write the table's current version to 'bechdel_movies.csv' (the 'export' command of bechdel.py) and record the CSV's hash, so the export
+# isn't taken for an edit; returns the table's version
+def export_movies(directory=TABLE_DIR, csv_path=DATA_PATH):
+    table = ColumnTable(directory)
+    df = table.read()
+    df.to_csv(csv_path + '.tmp', index=False)
+    os.replace(csv_path + '.tmp', csv_path)
+    return table.write_frame(df, message=f'export {os.path.basename(csv_path)}', source_hash=file_hash(csv_path))
+
+
+# Function to load the typed dataset: from the versioned table by default, or from a CSV (through the cache when the CSV hasn't changed).
+# With clean=True (the default) rows without a sentiment score are dropped, like the old df.dropna(subset=['sentiment']).
+def load_movies(path=None, clean=True, use_cache=True):
+    df = None
+    if path is None:
+        df = add_derived_columns(open_table().read())
+    elif use_cache:
+        digest = file_hash(path)
+        for ext in ('feather', 'pkl'):
+            cache_file = _cache_path(path, digest, ext)
+            if os.path.exists(cache_file):
+                df = _read_cache(cache_file)
+                break
+        if df is None:
+            df = read_movies_csv(path)
+            _write_cache(df, path, digest)
+    else:
+        df = read_movies_csv(path)
+
+    return clean_movies(df) if clean else df
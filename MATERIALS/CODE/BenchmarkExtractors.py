@@ -0,0 +1,51 @@
+'''
+Benchmark the IMDb Review Extractors
+    This script runs every extractor in ReviewExtractor.py over the saved IMDb reviews pages in './FIXTURES/imdb/'. It first checks that each extractor
+    returns exactly the same reviews and continuation key as the original full-BeautifulSoup approach ('soup'), then times each one and measures the peak memory it allocates
+    while parsing. The results are printed as a small table.
+
+    Running this script requires the BeautifulSoup library (for the 'soup' and 'strainer' extractors).
+'''
+
+import glob
+import os
+import time
+import tracemalloc
+
+from ReviewExtractor import EXTRACTORS
+
+FIXTURE_DIR = './FIXTURES/imdb/'
+REPEATS = 50 # parses per page per extractor
+
+# Load the saved pages
+pages = {}
+for path in sorted(glob.glob(os.path.join(FIXTURE_DIR, '*.html'))):
+    with open(path, encoding='utf-8') as f:
+        pages[os.path.basename(path)] = f.read()
+print(f"Loaded {len(pages)} fixture pages ({sum(len(html) for html in pages.values()) / 1024:.0f} KiB)")
+
+# 1. Check every extractor against the original parser
+for name, html in pages.items():
+    expected = EXTRACTORS['soup'](html)
+    for method, extract in EXTRACTORS.items():
+        assert extract(html) == expected, f"'{method}' extractor output differs from 'soup' on {name}"
+print('All extractors return identical reviews and continuation keys')
+
+# 2. Time each extractor and measure the peak memory of one pass over the pages
+print(f"{'extractor':<10} {'ms/page':>10} {'speedup':>8} {'peak KiB':>10}")
+baseline = None
+for method, extract in EXTRACTORS.items():
+    start = time.perf_counter()
+    for _ in range(REPEATS):
+        for html in pages.values():
+            extract(html)
+    per_page = (time.perf_counter() - start) * 1000 / (REPEATS * len(pages))
+
+    tracemalloc.start()
+    for html in pages.values():
+        extract(html)
+    peak = tracemalloc.get_traced_memory()[1] / 1024
+    tracemalloc.stop()
+
+    baseline = baseline or per_page # 'soup' runs first
+    print(f"{method:<10} {per_page:>10.3f} {baseline / per_page:>7.1f}x {peak:>10.0f}")
@@ -0,0 +1,408 @@
+'''
+Benchmark Suite
+    Every run of the scrapers depends on live IMDb and bechdeltest.com, so there was no way to tell whether a change made them faster or slower. This script
+    benchmarks each stage offline and compares the results with a stored baseline:
+
+    - fetch:    fetch_imdb_reviews for 'movies' IMDb IDs through a FetchEngine against the stub server (Fixtures.StubServer), which replays the recorded
+                pages in './FIXTURES/imdb/' with the configured latency, error rate and throttle rate
+    - api:      the bechdeltest.com sync path (listing_imdbids and fetch_movie in ScrapeNewBechdel.py) against API records served from the dataset
+    - parse:    extract_page over every fixture page
+    - score:    calculate_average_sentiment over the reviews of every fixture page, with FastVader's caches cleared before each pass so every pass
+                scores the reviews from scratch
+    - process:  process_movies end to end (fetch, paginate, score in worker processes, write checkpoint shards and the review store) into temporary directories
+    - load, analysis, regress: reading the dataset, building the aggregate cube and running every hypothesis test (AnalysisRunner.py), and the baseline
+                regression (StreamingLogistic.py), on datasets of 10k, 100k and 1M movies synthesized from 'bechdel_movies.csv'
+
+    Synthesized datasets resample rows of 'bechdel_movies.csv' (so the joint distribution of year, rating and sentiment is kept), give every row a new IMDb
+    ID and Bechdel id, and add a little noise to the sentiment scores. They are seeded and saved in './DATA/benchmark/', so every run uses the same data.
+
+    Each stage runs 'repeats' times, every time in a fresh process, and reports the median throughput (items per second), operation latency (p50, p90, p99)
+    and the peak resident memory of its process. Results are written to './OUTPUT/benchmarks/results.json' and compared with
+    './FIXTURES/benchmark_baseline.json': a stage regresses when its throughput drops, or its p99 latency or peak memory grows, by more than the tolerance in
+    'THRESHOLDS'. Regressions are printed and make the script exit with status 1. Baselines only make sense on the machine that recorded them; run with
+    --update-baseline to record a new one.
+
+    Usage (from the MATERIALS folder):
+        python CODE/BenchmarkSuite.py                                  # every stage and size
+        python CODE/BenchmarkSuite.py --stages parse score --repeats 5
+        python CODE/BenchmarkSuite.py --sizes 10000 --update-baseline
+
+    This script requires the numpy, pandas, requests, BeautifulSoup, nltk, scipy and scikit-learn libraries.
+'''
+
+import argparse
+import glob
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from multiprocessing import get_context
+
+import numpy as np
+import pandas as pd
+from BechdelData import DATA_PATH, read_movies_csv, clean_movies
+from Checkpoint import atomic_write
+from FetchEngine import FetchEngine, TokenBucket
+from Fixtures import StubServer, StubSession, LISTING_PAGE_SIZE
+from Metrics import peak_rss_bytes
+
+FIXTURE_DIR = './FIXTURES/imdb/'
+DATASET_DIR = './DATA/benchmark/'
+RESULTS_PATH = './OUTPUT/benchmarks/results.json'
+BASELINE_PATH = './FIXTURES/benchmark_baseline.json'
+
+SIZES = [10_000, 100_000, 1_000_000] # movies in the synthesized datasets
+REPEATS = 3
+SEED = 18
+SYNTHETIC_IMDBID = 90_000_000 # synthesized movies get IMDb IDs from here up, so they never collide with real ones
+SENTIMENT_NOISE = 0.05 # standard deviation of the noise added to synthesized sentiment scores
+
+# Stage settings; a baseline is only comparable with results recorded under the same settings
+SETTINGS = {
+    'movies': 500,         # movies fetched by the fetch, api and process stages
+    'latency': 0.05,       # stub server latency in seconds, plus up to 'jitter' more
+    'jitter': 0.02,
+    'error_rate': 0.01,    # share of stub responses answering 500
+    'throttle_rate': 0.0,  # share of stub responses answering 429
+    'in_flight': 10,       # FetchEngine.max_in_flight
+    'parse_repeats': 20,   # passes over the fixture pages in the parse stage
+    'score_repeats': 20,   # passes over the fixture reviews in the score stage
+    'workers': 2,          # scoring processes in the process stage
+    'resamples': 1000,     # replicates of the resampling tests in the analysis stage
+}
+
+# Relative change that counts as a regression, per metric
+THRESHOLDS = {'throughput': 0.10, 'latency_p99': 0.25, 'peak_rss_mib': 0.20}
+HIGHER_IS_BETTER = {'throughput'}
+
+STAGES = {}
+
+
+# Decorator to register a benchmark stage; 'scaled' stages run once per synthesized dataset size
+def stage(name, unit, scaled=False):
+    def register(func):
+        STAGES[name] = {'func': func, 'unit': unit, 'scaled': scaled}
+        return func
+    return register
+
+
+class StageRecorder:
+    '''
+    Collects what one run of a stage did: the wall time of its measured part, the latency of each operation and the number of items processed.
+    '''
+
+    def __init__(self):
+        self.seconds = 0.0
+        self.latencies = []
+        self.items = 0
+        self.errors = 0
+
+    # Time the part of the stage that counts (setup such as loading fixtures stays outside)
+    @contextmanager
+    def measure(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds += time.perf_counter() - start
+
+    # Time one operation that processes 'items' items
+    @contextmanager
+    def operation(self, items=1):
+        start = time.perf_counter()
+        yield
+        self.add(time.perf_counter() - start, items)
+
+    # Record an operation that was timed elsewhere (e.g. on an engine thread)
+    def add(self, seconds, items=1):
+        self.latencies.append(seconds)
+        self.items += items
+
+    def summary(self, unit):
+        latencies = sorted(self.latencies)
+        return {'unit': unit, 'items': self.items, 'operations': len(latencies), 'errors': self.errors, 'seconds': self.seconds,
+                'throughput': self.items / self.seconds if self.seconds else None,
+                'latency_p50': _quantile(latencies, 0.5), 'latency_p90': _quantile(latencies, 0.9), 'latency_p99': _quantile(latencies, 0.99)}
+
+
+# Nearest-rank quantile of a sorted list (None when empty)
+def _quantile(values, q):
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+# Function to synthesize a dataset of n movies from 'bechdel_movies.csv', keeping its joint distribution
+def synthesize(df, n, seed=SEED):
+    rng = np.random.default_rng(seed)
+    rows = df.iloc[rng.integers(0, len(df), n)].reset_index(drop=True)
+    rows['imdbid'] = SYNTHETIC_IMDBID + np.arange(n)
+    rows['id'] = np.arange(1, n + 1)
+    scored = rows['sentiment'].notna()
+    noise = rng.normal(0.0, SENTIMENT_NOISE, int(scored.sum()))
+    rows.loc[scored, 'sentiment'] = np.clip(rows.loc[scored, 'sentiment'] + noise, -1.0, 1.0).round(2)
+    return rows
+
+
+# Function to return the path of the synthesized dataset of n movies, creating it the first time
+def dataset_path(n):
+    path = os.path.join(DATASET_DIR, f'bechdel_movies_{n}.csv')
+    if not os.path.exists(path):
+        os.makedirs(DATASET_DIR, exist_ok=True)
+        synthesize(pd.read_csv(DATA_PATH), n).to_csv(path + '.tmp', index=False)
+        os.replace(path + '.tmp', path)
+    return path
+
+
+def fixture_pages():
+    pages = []
+    for path in sorted(glob.glob(os.path.join(FIXTURE_DIR, '*.html'))):
+        with open(path, encoding='utf-8') as f:
+            pages.append(f.read())
+    return pages
+
+
+# Function to start a stub server with the stage settings
+def stub_server(settings, movies=None):
+    return StubServer(FIXTURE_DIR, movies=movies, latency=settings['latency'], jitter=settings['jitter'], error_rate=settings['error_rate'],
+                      throttle_rate=settings['throttle_rate'], seed=SEED)
+
+
+# Function to build an engine that talks to the stub. The limiter starts wide open so the benchmark measures the code rather than the politeness
+# setting, but it still backs off on throttled responses.
+def stub_engine(stub, settings):
+    in_flight = settings['in_flight']
+    limiter = TokenBucket(rate=1000.0, capacity=in_flight, max_rate=1000.0)
+    return FetchEngine(max_in_flight=in_flight, session=StubSession(stub.url, in_flight), limiter=limiter)
+
+
+# Function to wrap func so it returns (result, seconds); used to time operations that run on engine threads
+def _timed_call(func):
+    def call(item):
+        start = time.perf_counter()
+        result = func(item)
+        return result, time.perf_counter() - start
+    return call
+
+
+def _record_map(recorder, results, items=lambda result: 1):
+    for _, value, error in results:
+        if error is not None:
+            recorder.errors += 1
+        else:
+            result, seconds = value
+            recorder.add(seconds, items(result))
+
+
+@stage('fetch', unit='movies')
+def fetch_stage(recorder, size, settings):
+    from IMDbReviewSentiment import fetch_imdb_reviews
+    imdbids = [str(SYNTHETIC_IMDBID + i) for i in range(settings['movies'])]
+    with stub_server(settings) as stub, stub_engine(stub, settings) as engine:
+        fetch = _timed_call(lambda imdbid: fetch_imdb_reviews(imdbid, engine=engine, base_url=stub.url, raise_errors=True))
+        with recorder.measure():
+            _record_map(recorder, engine.map(fetch, imdbids))
+
+
+@stage('api', unit='movies')
+def api_stage(recorder, size, settings):
+    import ScrapeNewBechdel
+    movies = pd.read_csv(DATA_PATH)
+    pages = -(-settings['movies'] // LISTING_PAGE_SIZE) # enough listing pages for 'movies' IMDb IDs
+    with stub_server(settings, movies=movies) as stub, stub_engine(stub, settings) as engine:
+        ScrapeNewBechdel.engine = engine # fetch_movie and listing_imdbids use the module's engine
+        with recorder.measure():
+            listing = {}
+            for page, imdbids, error in engine.map(ScrapeNewBechdel.listing_imdbids, range(pages)):
+                if error is not None:
+                    recorder.errors += 1 # an injected error drops that listing page, like a failed movie fetch
+                else:
+                    listing[page] = imdbids
+            imdbids = [imdbid for page in sorted(listing) for imdbid in listing[page]][:settings['movies']]
+            _record_map(recorder, engine.map(_timed_call(ScrapeNewBechdel.fetch_movie), imdbids))
+
+
+@stage('parse', unit='pages')
+def parse_stage(recorder, size, settings):
+    from ReviewExtractor import extract_page
+    pages = fixture_pages()
+    with recorder.measure():
+        for _ in range(settings['parse_repeats']):
+            for html in pages:
+                with recorder.operation():
+                    extract_page(html)
+
+
+@stage('score', unit='reviews')
+def score_stage(recorder, size, settings):
+    from IMDbReviewSentiment import calculate_average_sentiment, get_analyzer
+    from ReviewExtractor import extract_page
+    reviews = [extract_page(html)[0] for html in fixture_pages()]
+    with recorder.measure():
+        for _ in range(settings['score_repeats']):
+            get_analyzer().clear_cache() # otherwise every pass after the first only measures the review cache
+            for page in reviews:
+                with recorder.operation(len(page)):
+                    calculate_average_sentiment(page)
+
+
+@stage('process', unit='movies')
+def process_stage(recorder, size, settings):
+    from Checkpoint import CheckpointStore
+    from IMDbReviewSentiment import process_movies
+    from ReviewStore import ReviewStore
+    df = pd.DataFrame({'imdbid': [str(SYNTHETIC_IMDBID + i) for i in range(settings['movies'])]})
+    with tempfile.TemporaryDirectory() as directory, stub_server(settings) as stub, stub_engine(stub, settings) as engine:
+        checkpoint = CheckpointStore(os.path.join(directory, 'checkpoint'))
+        store = ReviewStore(os.path.join(directory, 'review_store'))
+        with recorder.measure():
+            scores = process_movies(df, checkpoint, store, engine=engine, workers=settings['workers'])
+        recorder.items = len(scores)
+        recorder.errors = len(df) - len(scores)
+
+
+@stage('load', unit='rows', scaled=True)
+def load_stage(recorder, size, settings):
+    path = dataset_path(size)
+    with recorder.measure(), recorder.operation(size):
+        read_movies_csv(path)
+
+
+@stage('analysis', unit='rows', scaled=True)
+def analysis_stage(recorder, size, settings):
+    import AnalysisRunner
+    from AggregateCube import AggregateCube
+    df = read_movies_csv(dataset_path(size))
+    AnalysisRunner.RESAMPLES = settings['resamples']
+    with recorder.measure():
+        with recorder.operation(0):
+            AggregateCube.build(df)
+        report = AnalysisRunner.run_hypotheses(df=clean_movies(df))
+    for result in report['tests'].values():
+        recorder.add(result['seconds'], 0)
+    recorder.items = size
+
+
+@stage('regress', unit='rows', scaled=True)
+def regress_stage(recorder, size, settings):
+    from StreamingLogistic import run_config
+    df = clean_movies(read_movies_csv(dataset_path(size)))
+    with recorder.measure(), recorder.operation(len(df)):
+        run_config('baseline', df=df)
+
+
+# Function to run one stage in the current process (the benchmark runs it in a fresh process each time)
+def run_stage(name, size, settings):
+    spec = STAGES[name]
+    recorder = StageRecorder()
+    spec['func'](recorder, size, settings)
+    summary = recorder.summary(spec['unit'])
+    summary['peak_rss_mib'] = peak_rss_bytes().get('self', 0) / 2 ** 20 or None
+    return summary
+
+
+# Function to run a stage 'repeats' times, each in a fresh process, and keep the median of every metric
+def benchmark_stage(name, size, settings, repeats=REPEATS):
+    runs = []
+    for _ in range(repeats):
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+            runs.append(executor.submit(run_stage, name, size, settings).result())
+    result = {'stage': name, 'size': size, 'unit': runs[0]['unit'], 'repeats': repeats}
+    for metric, value in runs[0].items():
+        if metric != 'unit':
+            values = [run[metric] for run in runs if run[metric] is not None]
+            result[metric] = statistics.median(values) if values else None
+    return result
+
+
+# Function to run the selected stages (every registered stage by default); returns results keyed 'stage' or 'stage@size'
+def run_benchmarks(stages=None, sizes=SIZES, repeats=REPEATS, settings=SETTINGS):
+    results = {}
+    for name in stages or STAGES:
+        for size in (sizes if STAGES[name]['scaled'] else [None]):
+            key = name if size is None else f'{name}@{size}'
+            print(f"Running {key} ...", flush=True)
+            results[key] = benchmark_stage(name, size, settings, repeats)
+    return results
+
+
+# Function to compare results with a baseline; returns one entry per metric that got worse by more than its threshold
+def compare(results, baseline, thresholds=THRESHOLDS):
+    regressions = []
+    for key, result in results.items():
+        reference = baseline['results'].get(key)
+        if reference is None:
+            continue
+        for metric, tolerance in thresholds.items():
+            new, old = result.get(metric), reference.get(metric)
+            if new is None or not old:
+                continue
+            change = new / old - 1
+            worse = -change if metric in HIGHER_IS_BETTER else change
+            if worse > tolerance:
+                regressions.append({'benchmark': key, 'metric': metric, 'baseline': old, 'result': new, 'change': change, 'tolerance': tolerance})
+    return regressions
+
+
+def environment():
+    return {'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count(), 'recorded': time.strftime('%Y-%m-%d %H:%M:%S')}
+
+
+def print_results(results, baseline=None):
+    print(f"{'benchmark':<20} {'throughput':>14} {'p50 ms':>9} {'p99 ms':>9} {'peak MiB':>9} {'vs baseline':>12}")
+    for key, result in results.items():
+        reference = (baseline or {}).get('results', {}).get(key)
+        delta = f"{result['throughput'] / reference['throughput'] - 1:+.1%}" if reference and reference.get('throughput') and result['throughput'] else ''
+        throughput = f"{result['throughput']:.1f}/s" if result['throughput'] else '-'
+        p50 = f"{result['latency_p50'] * 1000:.2f}" if result['latency_p50'] is not None else '-'
+        p99 = f"{result['latency_p99'] * 1000:.2f}" if result['latency_p99'] is not None else '-'
+        peak = f"{result['peak_rss_mib']:.0f}" if result['peak_rss_mib'] else '-'
+        print(f"{key:<20} {throughput:>14} {p50:>9} {p99:>9} {peak:>9} {delta:>12}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the scraping, parsing, scoring and analysis stages against recorded fixtures.')
+    parser.add_argument('--stages', nargs='+', choices=list(STAGES), help='stages to run (default: all)')
+    parser.add_argument('--sizes', nargs='+', type=int, default=SIZES, help='synthesized dataset sizes for the scaled stages')
+    parser.add_argument('--repeats', type=int, default=REPEATS)
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--update-baseline', action='store_true', help='store these results as the new baseline')
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.stages, args.sizes, args.repeats)
+    report = {'environment': environment(), 'settings': SETTINGS, 'results': results}
+    os.makedirs(os.path.dirname(RESULTS_PATH), exist_ok=True)
+    atomic_write(RESULTS_PATH, json.dumps(report, indent=2))
+
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+
+    if args.update_baseline:
+        if baseline is not None: # keep the benchmarks that weren't run this time
+            report['results'] = {**baseline['results'], **results}
+        atomic_write(args.baseline, json.dumps(report, indent=2))
+        print(f"Baseline written to {args.baseline}")
+        return 0
+    if baseline is None:
+        print(f"No baseline at {args.baseline}; run with --update-baseline to record one")
+        return 0
+    if baseline['settings'] != SETTINGS:
+        print('Warning: the baseline was recorded with different settings, so the comparison is not meaningful')
+
+    regressions = compare(results, baseline)
+    for r in regressions:
+        print(f"REGRESSION {r['benchmark']} {r['metric']}: {r['baseline']:.4g} -> {r['result']:.4g} ({r['change']:+.1%}, tolerance {r['tolerance']:.0%})")
+    print(f"{len(regressions)} regression(s) against {args.baseline}")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
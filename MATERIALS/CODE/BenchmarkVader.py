@@ -0,0 +1,59 @@
+'''
+Benchmark the VADER Scorers
+    This script scores the reviews in the saved IMDb reviews pages in './FIXTURES/imdb/' with the stock NLTK SentimentIntensityAnalyzer and with FastVader
+    (FastVader.py). It first checks that FastVader returns exactly the same neg/neu/pos/compound scores for every review, then measures reviews per second:
+
+    - stock: SentimentIntensityAnalyzer.polarity_scores, one call per review
+    - cold:  FastVader.score_many with empty caches, every review scored once
+    - warm:  FastVader.score_many on reviews it has already seen (a re-scored movie, or a review repeated across pages)
+
+    The results are printed as a small table. Running this script requires the nltk library (with the 'vader_lexicon' resource) and BeautifulSoup.
+'''
+
+import glob
+import os
+import time
+
+from nltk.sentiment.vader import SentimentIntensityAnalyzer
+from FastVader import FastVader
+from ReviewExtractor import extract_page
+
+FIXTURE_DIR = './FIXTURES/imdb/'
+REPEATS = 20 # passes over the fixture reviews per scorer
+
+# Load the reviews of every saved page
+reviews = []
+for path in sorted(glob.glob(os.path.join(FIXTURE_DIR, '*.html'))):
+    with open(path, encoding='utf-8') as f:
+        reviews.extend(extract_page(f.read())[0])
+print(f"Loaded {len(reviews)} reviews ({sum(len(review) for review in reviews) / 1024:.0f} KiB of text)")
+
+analyzer = SentimentIntensityAnalyzer()
+scorer = FastVader() # vendored lexicon, so this also checks the pickle against the installed NLTK lexicon
+
+# 1. Check FastVader against the stock analyzer
+for review in reviews:
+    assert scorer.polarity_scores(review) == analyzer.polarity_scores(review), f"FastVader scores differ on: {review[:80]!r}"
+print('FastVader returns identical scores for every review')
+
+
+# Function to time REPEATS passes of score(reviews); 'before' runs ahead of every pass (e.g. to clear the caches)
+def reviews_per_second(score, before=lambda: None):
+    seconds = 0.0
+    for _ in range(REPEATS):
+        before()
+        start = time.perf_counter()
+        score(reviews)
+        seconds += time.perf_counter() - start
+    return REPEATS * len(reviews) / seconds
+
+
+# 2. Reviews per second
+results = {
+    'stock': reviews_per_second(lambda texts: [analyzer.polarity_scores(text) for text in texts]),
+    'cold': reviews_per_second(scorer.score_many, before=scorer.clear_cache),
+    'warm': reviews_per_second(scorer.score_many),
+}
+print(f"{'scorer':<8} {'reviews/s':>12} {'speedup':>8}")
+for name, rate in results.items():
+    print(f"{name:<8} {rate:>12.0f} {rate / results['stock']:>7.1f}x")
@@ -0,0 +1,69 @@
+'''
+Checkpoint Store
+    This module stores results of long-running jobs (such as the IMDb sentiment scraper) as they are produced, so a crash only loses the batch that was in
+    progress. Each completed batch is written as its own append-only JSON Lines shard, and a small manifest lists the shards and the IMDb IDs each one
+    contains. On restart, the IDs in the manifest are skipped, and the final dataset is built by merging all of the shards.
+
+    Shards and the manifest are written to a temporary file first and then renamed into place, so an interrupted write never leaves a half-written file
+    behind. A shard that was written but never recorded in the manifest is simply overwritten by the next batch.
+
+    This module only uses the Python standard library.
+'''
+
+import json
+import os
+
+MANIFEST_NAME = 'manifest.json'
+
+
+# Function to write a file atomically: write to a temporary file, flush it to disk, then rename it over the target
+def atomic_write(path, text):
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class CheckpointStore:
+    '''
+    Directory of JSONL shards plus a manifest. Every record must have an 'imdbid' key.
+    '''
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.manifest_path = os.path.join(directory, MANIFEST_NAME)
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, encoding='utf-8') as f:
+                self.manifest = json.load(f)
+        else:
+            self.manifest = {'shards': []}
+        self.completed = {imdbid for shard in self.manifest['shards'] for imdbid in shard['imdbids']}
+
+    def is_done(self, imdbid):
+        return imdbid in self.completed
+
+    # Write one batch of records as a new shard, then record it in the manifest
+    def write_shard(self, records):
+        if not records:
+            return None
+        name = f"shard-{len(self.manifest['shards']):05d}.jsonl"
+        atomic_write(os.path.join(self.directory, name), ''.join(json.dumps(record) + '\n' for record in records))
+
+        imdbids = [record['imdbid'] for record in records]
+        self.manifest['shards'].append({'file': name, 'imdbids': imdbids})
+        atomic_write(self.manifest_path, json.dumps(self.manifest))
+        self.completed.update(imdbids)
+        return name
+
+    # Read every record from the shards in the manifest; later shards win if an ID appears twice
+    def records(self):
+        merged = {}
+        for shard in self.manifest['shards']:
+            with open(os.path.join(self.directory, shard['file']), encoding='utf-8') as f:
+                for line in f:
+                    record = json.loads(line)
+                    merged[record['imdbid']] = record
+        return list(merged.values())
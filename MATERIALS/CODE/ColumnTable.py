@@ -0,0 +1,173 @@
+'''
+Versioned Columnar Table
+    Changing one column of the dataset used to mean loading the whole CSV and overwriting it in place, which costs a full rewrite for every one-column change
+    and leaves a corrupted file if the script is interrupted halfway. This module stores a table as a directory of per-column files plus versioned manifests:
+
+    - columns/<name>.<digest>.parquet: one file per column version, named by a hash of its contents (a pickle file if pyarrow isn't installed)
+    - versions/NNNNN.json: a manifest listing the file of every column, the row count, the parent version, a message and the hash of the file the table
+      was last imported from or exported to ('source_hash', carried over to every later version)
+    - HEAD: the number of the current version
+
+    Adding or replacing a column only writes that column's file and a new manifest; columns whose contents didn't change keep pointing at their existing
+    files. A change becomes visible in one step, when HEAD is atomically replaced, so an interrupted write leaves the previous version intact. Rolling back
+    only rewrites HEAD, since older manifests and their column files are kept.
+
+    Usage:
+        table = ColumnTable('./DATA/bechdel_table/')
+        df = table.read(['year', 'rating'])
+        table.write_column('rating_binary', (df['rating'] == 3).astype('int8'), message='add rating_binary')
+        table.rollback()                     # back to the previous version
+
+    This module requires the pandas library (and optionally pyarrow for the Parquet column files).
+'''
+
+import hashlib
+import json
+import os
+import time
+
+import pandas as pd
+from Checkpoint import atomic_write
+
+
+class ColumnTable:
+    '''
+    A table stored column by column, with a manifest per version and an atomically updated HEAD.
+    '''
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.columns_dir = os.path.join(directory, 'columns')
+        self.versions_dir = os.path.join(directory, 'versions')
+        self.head_path = os.path.join(directory, 'HEAD')
+
+    def exists(self):
+        return os.path.exists(self.head_path)
+
+    @property
+    def version(self):
+        with open(self.head_path) as f:
+            return int(f.read().strip())
+
+    def manifest(self, version=None):
+        version = self.version if version is None else version
+        with open(os.path.join(self.versions_dir, f'{version:05d}.json')) as f:
+            return json.load(f)
+
+    @property
+    def columns(self):
+        return list(self.manifest()['columns'])
+
+    def __len__(self):
+        return self.manifest()['rows']
+
+    # Function to read some or all columns of a version (the current one by default) into a DataFrame
+    def read(self, columns=None, version=None):
+        manifest = self.manifest(version)
+        names = columns or list(manifest['columns'])
+        return pd.DataFrame({name: self._read_column(manifest['columns'][name]) for name in names})
+
+    def _read_column(self, filename):
+        path = os.path.join(self.columns_dir, filename)
+        if filename.endswith('.parquet'):
+            return pd.read_parquet(path).iloc[:, 0]
+        return pd.read_pickle(path)
+
+    # Function to write one column file, named by its contents (nothing is written if an identical column is already stored)
+    def _write_column(self, name, values):
+        series = pd.Series(values, name=name).reset_index(drop=True)
+        digest = hashlib.sha256(f'{name}:{series.dtype}'.encode())
+        digest.update(pd.util.hash_pandas_object(series, index=False).to_numpy().tobytes())
+        stem = f'{name}.{digest.hexdigest()[:16]}'
+        for ext in ('parquet', 'pkl'):
+            if os.path.exists(os.path.join(self.columns_dir, f'{stem}.{ext}')):
+                return f'{stem}.{ext}'
+
+        os.makedirs(self.columns_dir, exist_ok=True)
+        try:
+            filename = f'{stem}.parquet'
+            series.to_frame().to_parquet(os.path.join(self.columns_dir, filename + '.tmp'), index=False)
+        except ImportError: # pyarrow not installed
+            filename = f'{stem}.pkl'
+            series.to_pickle(os.path.join(self.columns_dir, filename + '.tmp'))
+        os.replace(os.path.join(self.columns_dir, filename + '.tmp'), os.path.join(self.columns_dir, filename))
+        return filename
+
+    # Function to commit a new version from a manifest's column map; HEAD moves only after the manifest is on disk. The source hash is inherited from the
+    # parent unless a new one is given.
+    def _commit(self, columns, rows, message, source_hash=None):
+        os.makedirs(self.versions_dir, exist_ok=True)
+        parent = self.version if self.exists() else None
+        if source_hash is None and parent is not None:
+            source_hash = self.manifest(parent).get('source_hash')
+        existing = [int(name.split('.')[0]) for name in os.listdir(self.versions_dir) if name.endswith('.json')]
+        version = max(existing, default=-1) + 1
+        manifest = {'version': version, 'parent': parent, 'rows': rows, 'columns': columns, 'message': message, 'created': time.time(),
+                    'source_hash': source_hash}
+        atomic_write(os.path.join(self.versions_dir, f'{version:05d}.json'), json.dumps(manifest, indent=2))
+        atomic_write(self.head_path, str(version))
+        return version
+
+    # Function to add or replace columns; only the columns whose contents changed are written. Returns the new version.
+    def write_columns(self, columns, message=''):
+        current = self.manifest() if self.exists() else {'columns': {}, 'rows': None}
+        rows = current['rows']
+        files = dict(current['columns'])
+        for name, values in columns.items():
+            if rows is not None and len(values) != rows:
+                raise ValueError(f"column '{name}' has {len(values)} rows, the table has {rows}")
+            rows = len(values)
+            files[name] = self._write_column(name, values)
+        if files == current['columns']:
+            return self.version # nothing changed
+        return self._commit(files, rows, message)
+
+    def write_column(self, name, values, message=''):
+        return self.write_columns({name: values}, message)
+
+    # Function to commit a whole frame as the new version: columns missing from the frame are dropped, unchanged columns are not rewritten.
+    # 'source_hash' records the hash of the file the frame was imported from.
+    def write_frame(self, df, message='', source_hash=None):
+        files = {name: self._write_column(name, df[name]) for name in df.columns}
+        if self.exists() and files == self.manifest()['columns'] and source_hash in (None, self.manifest().get('source_hash')):
+            return self.version
+        return self._commit(files, len(df), message, source_hash)
+
+    def drop_column(self, name, message=''):
+        manifest = self.manifest()
+        files = {col: filename for col, filename in manifest['columns'].items() if col != name}
+        return self._commit(files, manifest['rows'], message or f'drop {name}')
+
+    # Function to make an earlier version current again (the parent of the current version by default)
+    def rollback(self, version=None):
+        target = self.manifest()['parent'] if version is None else version
+        if target is None:
+            raise ValueError('the current version has no parent to roll back to')
+        self.manifest(target) # raises if the version doesn't exist
+        atomic_write(self.head_path, str(target))
+        return target
+
+    # Hashes of every file the table was ever imported from (or exported to), across all versions - not only the current one's ancestors
+    def source_hashes(self):
+        if not os.path.isdir(self.versions_dir):
+            return set()
+        hashes = set()
+        for name in os.listdir(self.versions_dir):
+            if name.endswith('.json'):
+                with open(os.path.join(self.versions_dir, name)) as f:
+                    hashes.add(json.load(f).get('source_hash'))
+        return hashes - {None}
+
+    # Versions from the current one back to the first, newest first
+    def history(self):
+        entries, version = [], self.version if self.exists() else None
+        while version is not None:
+            manifest = self.manifest(version)
+            entries.append({key: manifest[key] for key in ('version', 'message', 'created', 'rows')})
+            version = manifest['parent']
+        return entries
+
+    # Function to export the current version as a CSV (for sharing; the table itself is the working copy)
+    def export_csv(self, path, columns=None):
+        self.read(columns).to_csv(path + '.tmp', index=False)
+        os.replace(path + '.tmp', path)
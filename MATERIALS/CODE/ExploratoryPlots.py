@@ -6,115 +6,167 @@ Exploratory Plots
 
     Ensure the dataset 'bechdel_movies.csv' is available in your chosen directory. When the script is executed, the directory './OUTPUT/Exploratory/' will be 
     created to save the visualizations. This script utilizes the following libraries: pandas, matplotlib, seaborn, and os.
-'''
 
-import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
+    The dataset is loaded with BechdelData.py, which already provides the typed columns and the 'test_result' (Pass/Fail) column.
+
+    Each plot is registered with PlotRegistry.py and rendered headless on a pool of worker processes. Plots whose input columns and code haven't changed
+    since the last run are skipped, and counts shared by several plots are computed once. The scatter-style plots (the joint plot and the pair plot) can
+    be drawn from a random sample of the rows by setting 'MAX_POINTS'. The sentiment histogram and its KDE are drawn from the fixed-bin histograms of the
+    sentiment sketches (SentimentSketch.py) instead of the raw sentiment column; set 'SENTIMENT_LEVEL' to 'review' to draw them from every review in the
+    review store.
 
-# Load the dataset from a CSV into dataframe
-df = pd.read_csv('./DATA/bechdel_movies.csv')
+    matplotlib and seaborn are imported inside the drawing functions, which run in the rendering processes, so importing this script (and starting
+    'bechdel.py plots') doesn't pay for them.
+'''
 
-# Set Seaborn style - aesthetic purposes
-sns.set(style="whitegrid")
+from BechdelData import load_movies
+from AggregateCube import load_cube
+from PlotRegistry import plot, render_plots
+from SentimentSketch import load_sketches, load_review_sketches
 
-# Create a directory to save the plots
+# Directory to save the plots
 output_folder = './OUTPUT/Exploratory/'
-import os
-if not os.path.exists(output_folder):
-    os.makedirs(output_folder)
+
+# Maximum number of rows drawn by the scatter-style plots (None = all rows)
+MAX_POINTS = None
+
+# Sentiment scores summarized by the sketches: 'movie' (the mean score of each movie) or 'review' (every review in the review store)
+SENTIMENT_LEVEL = 'movie'
+
 
 # 1. Distribution of movie release years with histogram and KDE
-plt.figure(figsize=(10, 6))
-sns.histplot(df['year'], bins=30, kde=True, color='blue')
-plt.title('Distribution of Movie Release Years', fontsize=16)
-plt.xlabel('Year', fontsize=12)
-plt.ylabel('Number of Movies', fontsize=12)
-plt.savefig(f'{output_folder}DistributionofMovieReleaseYears.png')
-plt.close()
+@plot('exploratory', 'DistributionofMovieReleaseYears.png', columns=['year'], style='whitegrid', title='Distribution of Movie Release Years')
+def release_years(data, shared, spec):
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    sns.histplot(data['year'], bins=30, kde=True, color='blue')
+    plt.title(spec['title'], fontsize=16)
+    plt.xlabel('Year', fontsize=12)
+    plt.ylabel('Number of Movies', fontsize=12)
+
 
 # 2. Distribution of Bechdel test ratings using a count plot
-plt.figure(figsize=(10, 6))
-sns.countplot(x='rating', data=df, palette='coolwarm')
-plt.title('Distribution of Bechdel Test Ratings', fontsize=16)
-plt.xlabel('Bechdel Test Rating', fontsize=12)
-plt.ylabel('Count', fontsize=12)
-plt.savefig(f'{output_folder}DistributionofBechdelRatings.png')
-plt.close()
+@plot('exploratory', 'DistributionofBechdelRatings.png', columns=['rating'], aggregates=['rating_counts'], style='whitegrid',
+      title='Distribution of Bechdel Test Ratings')
+def rating_distribution(data, shared, spec):
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    counts = shared['rating_counts']
+    sns.barplot(x=counts.index, y=counts.values, palette='coolwarm')
+    plt.title(spec['title'], fontsize=16)
+    plt.xlabel('Bechdel Test Rating', fontsize=12)
+    plt.ylabel('Count', fontsize=12)
+
 
 # 3. Distribution of sentiment scores with histogram and KDE
-plt.figure(figsize=(10, 6))
-sns.histplot(df['sentiment'], bins=30, kde=True, color='green')
-plt.title('Distribution of Sentiment Scores', fontsize=16)
-plt.xlabel('Sentiment Score', fontsize=12)
-plt.ylabel('Number of Movies', fontsize=12)
-plt.savefig(f'{output_folder}DistributionofSentimentScores.png')
-plt.close()
+@plot('exploratory', 'DistributionofSentimentScores.png', columns=['sentiment'], aggregates=['sentiment_histogram'], raw=False, style='whitegrid',
+      title='Distribution of Sentiment Scores')
+def sentiment_distribution(data, shared, spec):
+    import matplotlib.pyplot as plt
+    histogram = shared['sentiment_histogram']
+    edges = histogram['edges']
+    plt.bar(edges[:-1], histogram['counts'], width=edges[1:] - edges[:-1], align='edge', color='green', alpha=0.5, edgecolor='white')
+    if histogram['kde'] is not None:
+        plt.plot(histogram['x'], histogram['kde'], color='green')
+    plt.title(spec['title'], fontsize=16)
+    plt.xlabel('Sentiment Score', fontsize=12)
+    plt.ylabel(f"Number of {histogram['unit'].title()}", fontsize=12)
+
 
 # 4. Joint plot of Year vs Sentiment Score - results in a scatterplot
-plt.figure(figsize=(8, 8))
-sns.jointplot(x='year', y='sentiment', data=df, kind='scatter', color='purple', height=8)
-plt.savefig(f'{output_folder}YearvsSentimentScore.png')
-plt.close()
+@plot('exploratory', 'YearvsSentimentScore.png', columns=['year', 'sentiment'], sample=True, style='whitegrid', figsize=(8, 8))
+def year_vs_sentiment(data, shared, spec):
+    import seaborn as sns
+    return sns.jointplot(x='year', y='sentiment', data=data, kind='scatter', color='purple', height=8).fig
+
 
 # 5. Count of movies by visibility status; 1 = visible, 0 = not visible
-plt.figure(figsize=(10, 6))
-sns.countplot(x='visible', data=df, palette='viridis')
-plt.title('Count of Movies by Visibility Status', fontsize=16)
-plt.xlabel('Visible (1 = Yes, 0 = No)', fontsize=12)
-plt.ylabel('Number of Movies', fontsize=12)
-plt.savefig(f'{output_folder}CountofMoviesbyVisibility.png')
-plt.close()
+@plot('exploratory', 'CountofMoviesbyVisibility.png', columns=['visible'], aggregates=['visible_counts'], style='whitegrid',
+      title='Count of Movies by Visibility Status')
+def visibility_counts(data, shared, spec):
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    counts = shared['visible_counts']
+    sns.barplot(x=counts.index, y=counts.values, palette='viridis')
+    plt.title(spec['title'], fontsize=16)
+    plt.xlabel('Visible (1 = Yes, 0 = No)', fontsize=12)
+    plt.ylabel('Number of Movies', fontsize=12)
+
 
 # 6. Movies that pass (rating == 3) vs those that fail (rating < 3)
+# 'test_result' indicates whether movies pass or fail the Bechdel test (added by the loader)
+@plot('exploratory', 'PassOrFailBechdel.png', columns=['test_result'], aggregates=['test_result_counts'], style='whitegrid',
+      title='Movies That Pass vs Fail the Bechdel Test')
+def pass_or_fail(data, shared, spec):
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    counts = shared['test_result_counts']
+    sns.barplot(x=counts.index.astype(str), y=counts.values, palette='coolwarm')
+    plt.title(spec['title'], fontsize=16)
+    plt.xlabel('Test Result', fontsize=12)
+    plt.ylabel('Number of Movies', fontsize=12)
 
-# Create a new column to indicate whether movies pass or fail the Bechdel test
-df['test_result'] = df['rating'].apply(lambda x: 'Pass' if x == 3 else 'Fail')
-# count plot of passing or failing the Bechdel test
-plt.figure(figsize=(10, 6))
-sns.countplot(x='test_result', data=df, palette='coolwarm')
-plt.title('Movies That Pass vs Fail the Bechdel Test', fontsize=16)
-plt.xlabel('Test Result', fontsize=12)
-plt.ylabel('Number of Movies', fontsize=12)
-plt.savefig(f'{output_folder}PassOrFailBechdel.png')
-plt.close()
 
 # 7. Movies that pass the Bechdel test over time (entire dataset)
-plt.figure(figsize=(12, 6))
-df_pass = df[df['rating'] == 3]
-sns.histplot(df_pass['year'], bins=40, kde=False, color='green')
-plt.title('Movies That Pass the Bechdel Test (All Years)', fontsize=16)
-plt.xlabel('Year', fontsize=12)
-plt.ylabel('Number of Movies', fontsize=12)
-plt.savefig(f'{output_folder}MoviesThatPassBechdel.png')
-plt.close()
+@plot('exploratory', 'MoviesThatPassBechdel.png', columns=['year', 'rating'], style='whitegrid', figsize=(12, 6),
+      title='Movies That Pass the Bechdel Test (All Years)')
+def passing_over_time(data, shared, spec):
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    df_pass = data[data['rating'] == 3]
+    sns.histplot(df_pass['year'], bins=40, kde=False, color='green')
+    plt.title(spec['title'], fontsize=16)
+    plt.xlabel('Year', fontsize=12)
+    plt.ylabel('Number of Movies', fontsize=12)
+
 
 # 8. Colorful pair plot with title - examine relationship between year, rating, and sentiment
-plt.figure(figsize=(12, 10))
-pair_plot = sns.pairplot(df[['year', 'rating', 'sentiment']], hue='rating', palette='coolwarm', diag_kind="kde", markers=["o", "s", "D", "P"])
-plt.suptitle('Relationships Between Year, Rating, and Sentiment', y=1.02, fontsize=16)
-pair_plot.savefig(f'{output_folder}PairPlotYearSentimentRating.png')
-plt.close()
+@plot('exploratory', 'PairPlotYearSentimentRating.png', columns=['year', 'rating', 'sentiment'], sample=True, style='whitegrid', figsize=(12, 10),
+      title='Relationships Between Year, Rating, and Sentiment')
+def pair_plot(data, shared, spec):
+    import seaborn as sns
+    grid = sns.pairplot(data, hue='rating', palette='coolwarm', diag_kind="kde", markers=["o", "s", "D", "P"])
+    grid.fig.suptitle(spec['title'], y=1.02, fontsize=16)
+    return grid.fig
+
 
 # 9. Count of Bechdel test ratings (0, 1, 2, 3) - see annotations below
-plt.figure(figsize=(10, 6))
-sns.countplot(x='rating', data=df, palette='coolwarm')
-plt.title('Distribution of Bechdel Test Ratings', fontsize=16)
-plt.xlabel('Bechdel Test Rating', fontsize=12)
-plt.ylabel('Number of Movies', fontsize=12)
-
-# Annotate the plot with the meaning of each rating
-annotations = {
-    0: "Does not have at least two named women",
-    1: "Has at least two named women",
-    2: "Women talk to each other",
-    3: "Women talk to each other about something besides a man"
-}
-
-for rating, explanation in annotations.items():
-    plt.text(rating, df['rating'].value_counts().loc[rating] + 10, explanation,
-             ha='center', fontsize=10)
-
-plt.tight_layout() # adjust for better fit
-plt.savefig(f'{output_folder}AnnotatedBechdelTestRatings.png')
-plt.close()
+@plot('exploratory', 'AnnotatedBechdelTestRatings.png', columns=['rating'], aggregates=['rating_counts'], style='whitegrid',
+      title='Distribution of Bechdel Test Ratings')
+def annotated_ratings(data, shared, spec):
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    counts = shared['rating_counts']
+    sns.barplot(x=counts.index, y=counts.values, palette='coolwarm')
+    plt.title(spec['title'], fontsize=16)
+    plt.xlabel('Bechdel Test Rating', fontsize=12)
+    plt.ylabel('Number of Movies', fontsize=12)
+
+    # Annotate the plot with the meaning of each rating
+    annotations = {
+        0: "Does not have at least two named women",
+        1: "Has at least two named women",
+        2: "Women talk to each other",
+        3: "Women talk to each other about something besides a man"
+    }
+
+    for rating, explanation in annotations.items():
+        plt.text(rating, counts.loc[rating] + 10, explanation,
+                 ha='center', fontsize=10)
+
+    plt.tight_layout() # adjust for better fit
+
+
+# Function to render the exploratory plots that changed since the last run (the 'plots' command of bechdel.py)
+def main(force=False):
+    # Load the whole dataset (including movies without a sentiment score)
+    df = load_movies(clean=False)
+    sketches = load_review_sketches(df) if SENTIMENT_LEVEL == 'review' else load_sketches(df)
+
+    # Render the plots that changed since the last run
+    result = render_plots(df, 'exploratory', output_folder, max_points=MAX_POINTS, force=force, cube=load_cube(df), sketches=sketches)
+    print(f"Rendered {len(result['rendered'])} plots, skipped {len(result['skipped'])} unchanged plots")
+
+
+if __name__ == '__main__':
+    main()
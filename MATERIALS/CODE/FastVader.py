@@ -0,0 +1,287 @@
+'''
+Fast VADER Scorer
+    NLTK's SentimentIntensityAnalyzer.polarity_scores rebuilds a lookup table of every word of the review combined with every punctuation mark (about 35
+    string joins per word) just to strip punctuation from the tokens, then looks every token up in the lexicon, the booster and the negation lists again
+    for every occurrence and every rule. FastVader gives the same scores with less work:
+
+    - tokens are stripped of leading/trailing punctuation with str.lstrip/rstrip instead of the word x punctuation table
+    - every distinct token is compiled once into its lexicon valence, booster scalar, negation flag and case, and kept in a bounded LRU shared by all reviews
+    - the valence rules (boosters, ALL CAPS, negation, 'never so', 'least', idioms, 'but') run on the compiled tokens; the idiom check is only done near
+      words that appear in an idiom
+    - whole-review results are kept in a bounded LRU keyed by a hash of the whitespace-normalized review, so repeated reviews (the same review on several
+      pages, re-scored movies) are not scored again
+
+    VADER's rules are not sentence-local: the 'but' rule scales every word of the review, '!' and '?' are counted over the whole review, ALL CAPS emphasis
+    depends on whether the whole review is in capitals, and a repeated word is scored at its first occurrence. Caching per sentence would therefore change
+    the scores, so results are cached per review; whitespace is the only thing normalized, because VADER ignores it as well.
+
+    The lexicon and rule constants are vendored in './DATA/vader_lexicon.pkl', which is checked in, so FastVader() starts without importing nltk and
+    without downloading anything. If the file is missing FastVader() raises FileNotFoundError; 'python CODE/bechdel.py lexicon' (vendor_lexicon())
+    writes it again from an installed NLTK. Passing an NLTK analyzer uses its lexicon instead.
+
+    Usage:
+        scorer = FastVader()                      # or FastVader(SentimentIntensityAnalyzer())
+        scorer.polarity_scores(text)              # same dict as SentimentIntensityAnalyzer.polarity_scores
+        scorer.score_many(texts)                  # one dict per text
+
+    BenchmarkVader.py checks that the scores match the stock analyzer on the fixture reviews and compares reviews per second.
+    This module only needs the nltk library (with the 'vader_lexicon' resource) to write the vendored lexicon.
+'''
+
+import functools
+import hashlib
+import math
+import os
+import pickle
+import string
+from collections import OrderedDict
+
+LEXICON_PATH = './DATA/vader_lexicon.pkl' # vendored lexicon and rule constants (see vendor_lexicon)
+REVIEW_CACHE_SIZE = 50_000 # reviews whose scores are kept
+TOKEN_CACHE_SIZE = 200_000 # distinct tokens whose compiled form is kept
+
+PUNCTUATION = string.punctuation
+DELETE_PUNCTUATION = str.maketrans('', '', PUNCTUATION)
+CONSTANTS = ['NEGATE', 'BOOSTER_DICT', 'SPECIAL_CASE_IDIOMS', 'PUNC_LIST', 'B_INCR', 'B_DECR', 'C_INCR', 'N_SCALAR']
+
+
+# Function to read the lexicon and rule constants out of an NLTK analyzer
+def vader_resources(analyzer):
+    return {'lexicon': dict(analyzer.lexicon), **{name: getattr(analyzer.constants, name) for name in CONSTANTS}}
+
+
+# Function to pickle NLTK's VADER lexicon and rule constants to 'path', so scoring never has to import nltk or download the lexicon.
+# The lexicon is downloaded only if it isn't installed locally. Returns the path written.
+def vendor_lexicon(path=LEXICON_PATH):
+    import nltk
+    from nltk.sentiment.vader import SentimentIntensityAnalyzer
+    try:
+        analyzer = SentimentIntensityAnalyzer()
+    except LookupError:
+        nltk.download('vader_lexicon')
+        analyzer = SentimentIntensityAnalyzer()
+    resources = {**vader_resources(analyzer), 'nltk_version': nltk.__version__}
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path + '.tmp', 'wb') as f:
+        pickle.dump(resources, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(path + '.tmp', path)
+    return path
+
+
+# Function to load the vendored lexicon. A missing lexicon is an error rather than a download, so scoring never goes to the network.
+def load_lexicon(path=LEXICON_PATH):
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"VADER lexicon not found at '{path}'; run 'python CODE/bechdel.py lexicon' (from the MATERIALS folder) to vendor it")
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+class FastVader:
+    '''
+    Drop-in replacement for SentimentIntensityAnalyzer.polarity_scores with a compiled token table and a review-level LRU cache. Without an analyzer, the
+    lexicon is loaded from the vendored pickle and nltk is never imported.
+    '''
+
+    def __init__(self, analyzer=None, cache_size=REVIEW_CACHE_SIZE, token_cache_size=TOKEN_CACHE_SIZE, lexicon_path=LEXICON_PATH):
+        resources = vader_resources(analyzer) if analyzer is not None else load_lexicon(lexicon_path)
+        self.lexicon = resources['lexicon']
+        self.punc_list = set(resources['PUNC_LIST'])
+        self.negate = set(resources['NEGATE'])
+        self.boosters = resources['BOOSTER_DICT']
+        self.idioms = resources['SPECIAL_CASE_IDIOMS']
+        self.b_decr, self.c_incr, self.n_scalar = resources['B_DECR'], resources['C_INCR'], resources['N_SCALAR']
+        # every word of a multi-word idiom or booster: the idiom check can only change a valence when one of them is nearby
+        phrases = list(self.idioms) + [phrase for phrase in self.boosters if ' ' in phrase]
+        self.idiom_words = {word for phrase in phrases for word in phrase.split()}
+
+        self.cache_size = cache_size
+        self.cache = OrderedDict() # review digest -> scores
+        self.hits = 0
+        self.misses = 0
+        self.compile_token = functools.lru_cache(maxsize=token_cache_size)(self._compile_token)
+
+    # Function to compile one token: (lowercase form, lexicon valence or None, is upper case, booster scalar or None, is a negation)
+    def _compile_token(self, token):
+        lower = token.lower()
+        return lower, self.lexicon.get(lower), token.isupper(), self.boosters.get(lower), lower in self.negate or "n't" in lower
+
+    def polarity_scores(self, text):
+        if not isinstance(text, str): # same conversion as NLTK's SentiText
+            text = str(text.encode('utf-8'))
+        normalized = ' '.join(text.split())
+        key = hashlib.blake2b(normalized.encode('utf-8', 'surrogatepass'), digest_size=16).digest()
+        scores = self.cache.get(key)
+        if scores is not None:
+            self.hits += 1
+            self.cache.move_to_end(key)
+            return dict(scores)
+
+        self.misses += 1
+        scores = self._score(normalized)
+        self.cache[key] = scores
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return dict(scores)
+
+    # Function to score many reviews; repeated reviews are scored once
+    def score_many(self, texts):
+        return [self.polarity_scores(text) for text in texts]
+
+    def cache_info(self):
+        return {'hits': self.hits, 'misses': self.misses, 'reviews_cached': len(self.cache), 'tokens': self.compile_token.cache_info()._asdict()}
+
+    def clear_cache(self):
+        self.cache.clear()
+        self.compile_token.cache_clear()
+        self.hits = self.misses = 0
+
+    # Function to split a review into VADER's words and emoticons: whitespace tokens longer than one character, with leading or trailing punctuation
+    # removed when the rest is a word of the review (the same result as SentiText._words_and_emoticons)
+    def _tokens(self, text):
+        raw = text.split()
+        words_only = {word for word in (token.translate(DELETE_PUNCTUATION) for token in raw) if len(word) > 1}
+        tokens = []
+        for token in raw:
+            if len(token) < 2:
+                continue
+            stripped = token.rstrip(PUNCTUATION)
+            if stripped != token:
+                if token[len(stripped):] in self.punc_list and stripped in words_only:
+                    token = stripped
+            else:
+                stripped = token.lstrip(PUNCTUATION)
+                if stripped != token and token[:len(token) - len(stripped)] in self.punc_list and stripped in words_only:
+                    token = stripped
+            tokens.append(token)
+        return tokens
+
+    def _score(self, text):
+        tokens = self._tokens(text)
+        compiled = [self.compile_token(token) for token in tokens]
+        upper = sum(1 for c in compiled if c[2])
+        is_cap_diff = 0 < len(tokens) - upper < len(tokens)
+
+        # a repeated token gets the valence computed at its first occurrence, like the stock analyzer
+        first = {}
+        for i, token in enumerate(tokens):
+            first.setdefault(token, i)
+        valences = {token: self._valence(tokens, compiled, i, is_cap_diff) for token, i in first.items()}
+        sentiments = [valences[token] for token in tokens]
+
+        # 'but': halve the words before the first 'but' and scale the words after it by 1.5
+        for bi, c in enumerate(compiled):
+            if c[0] == 'but':
+                sentiments = [s * 0.5 if j < bi else s * 1.5 if j > bi else s for j, s in enumerate(sentiments)]
+                break
+        return self._score_valence(sentiments, text)
+
+    # Function to compute the valence of the token at position i (the rules of SentimentIntensityAnalyzer.sentiment_valence)
+    def _valence(self, tokens, compiled, i, is_cap_diff):
+        lower, valence, is_upper, booster, _ = compiled[i]
+        if booster is not None or (lower == 'kind' and i < len(tokens) - 1 and compiled[i + 1][0] == 'of'):
+            return 0
+        if valence is None:
+            return 0
+
+        if is_upper and is_cap_diff:
+            valence = valence + self.c_incr if valence > 0 else valence - self.c_incr
+
+        near_idiom = any(tokens[j] in self.idiom_words for j in range(max(0, i - 3), min(len(tokens), i + 3)))
+        for start_i in range(3):
+            if i <= start_i:
+                break
+            prev_lower, prev_valence, prev_upper, prev_booster, prev_negated = compiled[i - (start_i + 1)]
+            if prev_valence is not None: # preceding word is itself in the lexicon
+                continue
+            s = 0.0
+            if prev_booster is not None:
+                s = prev_booster
+                if valence < 0:
+                    s *= -1
+                if prev_upper and is_cap_diff:
+                    if valence > 0:
+                        s += self.c_incr
+                    else:
+                        s -= self.c_incr
+            if start_i == 1 and s != 0:
+                s = s * 0.95
+            if start_i == 2 and s != 0:
+                s = s * 0.9
+            valence = valence + s
+
+            # 'never' and other negations, 'never so/this' emphasis
+            if start_i == 0:
+                if prev_negated:
+                    valence = valence * self.n_scalar
+            elif start_i == 1:
+                if tokens[i - 2] == 'never' and (tokens[i - 1] == 'so' or tokens[i - 1] == 'this'):
+                    valence = valence * 1.5
+                elif prev_negated:
+                    valence = valence * self.n_scalar
+            else:
+                if tokens[i - 3] == 'never' and (tokens[i - 2] == 'so' or tokens[i - 2] == 'this') or (tokens[i - 1] == 'so' or tokens[i - 1] == 'this'):
+                    valence = valence * 1.25
+                elif prev_negated:
+                    valence = valence * self.n_scalar
+                if near_idiom:
+                    valence = self._idioms_check(valence, tokens, i)
+
+        # 'least' negates the word after it, except in 'at least' and 'very least'
+        if i > 0 and compiled[i - 1][1] is None and compiled[i - 1][0] == 'least':
+            if i == 1 or compiled[i - 2][0] not in ('at', 'very'):
+                valence = valence * self.n_scalar
+        return valence
+
+    # Function to apply the special-case idioms ('the bomb', 'kiss of death', ...) and booster bigrams ('kind of') around position i (i >= 3)
+    def _idioms_check(self, valence, tokens, i):
+        onezero = f'{tokens[i - 1]} {tokens[i]}'
+        twoonezero = f'{tokens[i - 2]} {tokens[i - 1]} {tokens[i]}'
+        twoone = f'{tokens[i - 2]} {tokens[i - 1]}'
+        threetwoone = f'{tokens[i - 3]} {tokens[i - 2]} {tokens[i - 1]}'
+        threetwo = f'{tokens[i - 3]} {tokens[i - 2]}'
+        for sequence in (onezero, twoonezero, twoone, threetwoone, threetwo):
+            if sequence in self.idioms:
+                valence = self.idioms[sequence]
+                break
+        if len(tokens) - 1 > i:
+            zeroone = f'{tokens[i]} {tokens[i + 1]}'
+            if zeroone in self.idioms:
+                valence = self.idioms[zeroone]
+        if len(tokens) - 1 > i + 1:
+            zeroonetwo = f'{tokens[i]} {tokens[i + 1]} {tokens[i + 2]}'
+            if zeroonetwo in self.idioms:
+                valence = self.idioms[zeroonetwo]
+        if threetwo in self.boosters or twoone in self.boosters:
+            valence = valence + self.b_decr
+        return valence
+
+    # Function to turn the word valences into neg/neu/pos/compound, adding emphasis for '!' and '?' (SentimentIntensityAnalyzer.score_valence)
+    def _score_valence(self, sentiments, text):
+        if not sentiments:
+            return {'neg': 0.0, 'neu': 0.0, 'pos': 0.0, 'compound': 0.0}
+        sum_s = float(sum(sentiments))
+        ep_count = min(text.count('!'), 4)
+        qm_count = text.count('?')
+        qm_amplifier = 0 if qm_count <= 1 else qm_count * 0.18 if qm_count <= 3 else 0.96
+        amplifier = ep_count * 0.292 + qm_amplifier
+        if sum_s > 0:
+            sum_s += amplifier
+        elif sum_s < 0:
+            sum_s -= amplifier
+        compound = sum_s / math.sqrt((sum_s * sum_s) + 15)
+
+        pos_sum, neg_sum, neu_count = 0.0, 0.0, 0
+        for score in sentiments:
+            if score > 0:
+                pos_sum += float(score) + 1 # compensates for neutral words that are counted as 1
+            if score < 0:
+                neg_sum += float(score) - 1
+            if score == 0:
+                neu_count += 1
+        if pos_sum > math.fabs(neg_sum):
+            pos_sum += amplifier
+        elif pos_sum < math.fabs(neg_sum):
+            neg_sum -= amplifier
+        total = pos_sum + math.fabs(neg_sum) + neu_count
+        return {'neg': round(math.fabs(neg_sum / total), 3), 'neu': round(math.fabs(neu_count / total), 3), 'pos': round(math.fabs(pos_sum / total), 3),
+                'compound': round(compound, 4)}
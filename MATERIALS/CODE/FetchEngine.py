@@ -0,0 +1,228 @@
+'''
+Fetch Engine
+    This module provides the shared HTTP fetch engine used by the scrapers. Rather than opening a new connection for every request and sleeping a fixed
+    amount of time after every batch, all requests go through a single pooled requests.Session (keep-alive connections are reused between requests) and a
+    token-bucket rate limiter. The limiter backs off when the server answers with 429 or 503, honoring the Retry-After header when one is sent, and speeds
+    back up gradually while responses are healthy. The number of requests in flight is bounded by a sliding window instead of fixed-size batches.
+
+    When a ResponseCache (ResponseCache.py) is attached, get() serves fresh pages from disk, revalidates stale ones with conditional requests and stores
+    everything it downloads, so both scrapers share one cache.
+
+    Every request is recorded in the Metrics.py registry: total latency and time to first byte per host (requests reports the time until the headers
+    were parsed, which includes DNS and connect on new connections; it doesn't expose them separately), bytes received, responses by status, throttled
+    responses, time spent waiting for the rate limiter, cache hits/revalidations/misses, and the number of requests in flight.
+
+    The engine has no knowledge of IMDb or bechdeltest.com, so it can be pointed at a local stub HTTP server (e.g. http.server on localhost) for testing.
+    This module requires the requests library.
+'''
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.utils import get_encoding_from_headers
+from Metrics import METRICS
+
+# Status codes that mean "slow down" rather than "this page is broken"
+THROTTLE_STATUSES = (429, 503)
+
+
+# Function to turn a Retry-After header (seconds or an HTTP date) into a number of seconds to wait
+def parse_retry_after(value):
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    '''
+    Thread-safe token bucket with an adaptive refill rate (requests per second). Every throttled response multiplies the rate by 'decrease' and empties the
+    bucket, every healthy response adds 'increase' back to the rate, so the limiter settles just under whatever the server tolerates.
+    '''
+
+    def __init__(self, rate=5.0, capacity=10, min_rate=0.5, max_rate=20.0, increase=0.05, decrease=0.5):
+        self.rate = rate
+        self.capacity = capacity
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0  # set from Retry-After; nobody gets a token before this time
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    # Block until a token is available, then take it
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    delay = self.blocked_until - now
+                else:
+                    self._refill(now)
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+
+    def on_success(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def on_throttle(self, retry_after=None):
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            self.tokens = 0.0
+            if retry_after is not None:
+                self.blocked_until = max(self.blocked_until, now + retry_after)
+
+
+# Function to build a session whose connection pool is large enough for every worker to keep its own keep-alive connection
+def make_session(pool_size=10, user_agent='Mozilla/5.0 (compatible; bechdel-sentiment)'):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers['User-Agent'] = user_agent
+    return session
+
+
+# Function to rebuild a requests.Response from a cache entry so callers can't tell cached and live pages apart
+def response_from_cache(entry):
+    response = requests.models.Response()
+    response.status_code = entry.status
+    response._content = entry.body
+    response.url = entry.url
+    if entry.content_type:
+        response.headers['Content-Type'] = entry.content_type
+    response.encoding = get_encoding_from_headers(response.headers)
+    response.from_cache = True
+    return response
+
+
+def _cache_result(result):
+    METRICS.counter('cache_requests_total', 'Engine requests by cache outcome (hit, revalidated, miss, bypass)', result=result).inc()
+
+
+# Function to record the latency, time to first byte, size and status of one response
+def _record_response(host, response, waited, seconds):
+    METRICS.histogram('rate_limit_wait_seconds', 'Time spent waiting for a rate limiter token').observe(waited)
+    METRICS.histogram('http_request_seconds', 'Request latency including the body download', host=host).observe(seconds)
+    METRICS.histogram('http_ttfb_seconds', 'Time until the response headers were parsed', host=host).observe(response.elapsed.total_seconds())
+    METRICS.counter('http_response_bytes_total', 'Response body bytes received', host=host).inc(len(response.content))
+    METRICS.counter('http_responses_total', 'HTTP responses by status', host=host, status=response.status_code).inc()
+
+
+def _record_rate(limiter):
+    METRICS.gauge('rate_limit_per_second', 'Current request rate of the adaptive limiter').set(limiter.rate)
+
+
+class FetchEngine:
+    '''
+    Pooled, rate-limited fetcher. Use get() for single requests and map() to run a function over many items with at most 'max_in_flight' running at once.
+    '''
+
+    def __init__(self, max_in_flight=10, rate=5.0, max_retries=4, timeout=10, session=None, limiter=None, cache=None):
+        self.max_in_flight = max_in_flight
+        self.cache = cache
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.session = session or make_session(max_in_flight)
+        self.limiter = limiter or TokenBucket(rate=rate, capacity=max_in_flight)
+
+    # Fetch a URL through the cache (if any); raises requests.exceptions.RequestException on failure like requests.get + raise_for_status.
+    # Pass use_cache=False for pages that must always be live, such as listing pages.
+    def get(self, url, use_cache=True, **kwargs):
+        cache = self.cache if use_cache else None
+        entry = cache.get(url) if cache is not None else None
+        if entry is not None and cache.is_fresh(entry):
+            _cache_result('hit')
+            return response_from_cache(entry)
+        if entry is not None:
+            kwargs['headers'] = {**kwargs.get('headers', {}), **entry.validators()}
+
+        response = self._request(url, **kwargs)
+        if entry is not None and response.status_code == 304:  # unchanged since we cached it
+            cache.touch(url)
+            _cache_result('revalidated')
+            return response_from_cache(entry)
+        _cache_result('miss' if cache is not None else 'bypass')
+        if cache is not None:
+            cache.put(url, response.content, response.status_code, response.headers.get('Content-Type'),
+                      response.headers.get('ETag'), response.headers.get('Last-Modified'))
+        return response
+
+    # Send one GET, retrying throttled responses
+    def _request(self, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        host = urlsplit(url).hostname or ''
+        for attempt in range(self.max_retries + 1):
+            start = time.perf_counter()
+            self.limiter.acquire()
+            sent = time.perf_counter()
+            response = self.session.get(url, **kwargs)
+            _record_response(host, response, sent - start, time.perf_counter() - sent)
+            if response.status_code not in THROTTLE_STATUSES:
+                self.limiter.on_success()
+                _record_rate(self.limiter)
+                response.raise_for_status()
+                return response
+            retry_after = parse_retry_after(response.headers.get('Retry-After'))
+            if retry_after is None:
+                retry_after = min(60.0, 2.0 ** attempt)  # exponential backoff when the server gives no hint
+            self.limiter.on_throttle(retry_after)
+            _record_rate(self.limiter)
+            METRICS.counter('http_throttled_total', 'Responses that asked the engine to slow down (429/503)', host=host).inc()
+        response.raise_for_status()  # out of retries: surface the last 429/503 as an HTTPError
+        return response
+
+    # Run func(item) for every item with bounded concurrency; yields (item, result, error) in completion order
+    def map(self, func, items):
+        items = iter(items)
+        with ThreadPoolExecutor(max_workers=self.max_in_flight) as executor:
+            pending = {}
+            for item in items:  # fill the window
+                pending[executor.submit(func, item)] = item
+                if len(pending) >= self.max_in_flight:
+                    break
+            # after the loop, pending holds up to max_in_flight futures; each completion pulls in exactly one more item
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                METRICS.gauge('fetch_in_flight', 'Requests in flight in FetchEngine.map').set(len(pending))
+                for future in done:
+                    item = pending.pop(future)
+                    error = future.exception()
+                    yield item, (None if error else future.result()), error
+                    for next_item in items:  # top the window back up with one new item
+                        pending[executor.submit(func, next_item)] = next_item
+                        break
+
+    def close(self):
+        self.session.close()
+        if self.cache is not None:
+            self.cache.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
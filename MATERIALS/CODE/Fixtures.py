@@ -0,0 +1,216 @@
+'''
+Recorded Fixture Replay
+    This module replays the saved pages in './FIXTURES/' in place of the live websites, so the scrapers can be run and checked offline. A ReplaySession can be
+    handed to the FetchEngine instead of a real requests.Session:
+
+        engine = FetchEngine(session=ReplaySession('./FIXTURES/imdb/'))
+
+    IMDb URLs are mapped to fixture files as follows (any other URL answers 404):
+    - /title/tt<id>/reviews                           ->  tt<id>_reviews.html
+    - /title/tt<id>/reviews/_ajax?paginationKey=<key> ->  tt<id>_reviews_<key>.html
+
+    StubServer serves the same pages over real HTTP on localhost, with a configurable latency and rate of errors (500) and throttled responses (429),
+    so the whole network path (connection pool, rate limiter, retries) can be measured without touching the live sites. It also answers the
+    bechdeltest.com API ('/api/v1/getMovieByImdbId') and the 'sort/added' listing from the rows of a dataset. With alias=True, movies without recorded
+    pages are answered with the pages of a recorded movie (chosen by IMDb ID), so any number of movies can be replayed. A StubSession sends every
+    request to the stub whatever host the URL names, so the scrapers' hard-coded URLs can be used unchanged:
+
+        with StubServer('./FIXTURES/imdb/', movies=df, latency=0.05, error_rate=0.01) as stub:
+            engine = FetchEngine(session=StubSession(stub.url))
+
+    This module requires the requests library.
+'''
+
+import json
+import os
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, urlunsplit, parse_qs
+
+import requests
+from requests.adapters import HTTPAdapter
+
+REVIEWS_PATH = re.compile(r'^/title/(tt\d+)/reviews(/_ajax)?/?$')
+API_PATH = '/api/v1/getMovieByImdbId'
+LISTING_PATH = '/sort/added'
+LISTING_PAGE_SIZE = 25 # movies per 'sort/added' page
+
+
+# Function to map a URL to the name of its fixture file, or None if there is no fixture for it
+def fixture_name(url):
+    parts = urlsplit(url)
+    match = REVIEWS_PATH.match(parts.path)
+    if match is None:
+        return None
+    if match.group(2): # "load more" continuation
+        key = parse_qs(parts.query).get('paginationKey', [None])[0]
+        return f'{match.group(1)}_reviews_{key}.html' if key else None
+    return f'{match.group(1)}_reviews.html'
+
+
+# Function to build a requests.Response for a fixture file (404 if the file doesn't exist)
+def fixture_response(directory, url):
+    response = requests.models.Response()
+    response.url = url
+    name = fixture_name(url)
+    path = os.path.join(directory, name) if name else None
+    if path and os.path.exists(path):
+        with open(path, 'rb') as f:
+            response._content = f.read()
+        response.status_code = 200
+        response.headers['Content-Type'] = 'text/html; charset=utf-8'
+        response.encoding = 'utf-8'
+    else:
+        response._content = b''
+        response.status_code = 404
+    return response
+
+
+class ReplaySession:
+    '''Stand-in for requests.Session that answers GET requests from fixture files and records which URLs were requested.'''
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.requested = []
+
+    def get(self, url, **kwargs):
+        self.requested.append(url)
+        return fixture_response(self.directory, url)
+
+    def close(self):
+        pass
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1' # keep-alive, like the real sites
+
+    def do_GET(self):
+        status, content_type, body, headers = self.server.stub.respond(self.path)
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args): # keep the benchmark output readable
+        pass
+
+
+class StubServer:
+    '''
+    Local HTTP server replaying the fixture pages (and API records built from 'movies') with a configurable latency, error rate and throttle rate.
+    Every response is delayed by 'latency' seconds plus up to 'jitter' more; 'error_rate' of the requests answer 500 and 'throttle_rate' answer 429 with
+    a zero Retry-After. The random draws are seeded, so two runs with the same requests see the same failures.
+    '''
+
+    def __init__(self, directory, movies=None, latency=0.0, jitter=0.0, error_rate=0.0, throttle_rate=0.0, alias=True, seed=0, host='127.0.0.1', port=0):
+        self.directory = directory
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.served = {} # status -> number of responses
+        self.recorded = sorted({name.split('_')[0] for name in os.listdir(directory) if name.endswith('_reviews.html')})
+        self.alias = alias and bool(self.recorded)
+
+        # API records keyed by IMDb ID, and the IMDb IDs newest-first for the 'sort/added' listing
+        records = [] if movies is None else movies.to_dict('records')
+        self.movies = {str(int(record['imdbid'])).zfill(7): {key: _plain(value) for key, value in record.items()} for record in records}
+        self.listing = [imdbid for imdbid, record in sorted(self.movies.items(), key=lambda item: -int(item[1].get('id') or 0))]
+
+        self.server = ThreadingHTTPServer((host, port), _StubHandler)
+        self.server.daemon_threads = True
+        self.server.stub = self
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    # Function to answer one request path; returns (status, content type, body, extra headers)
+    def respond(self, path):
+        with self.lock:
+            draw = self.random.random()
+            delay = self.latency + self.jitter * self.random.random()
+        if delay:
+            time.sleep(delay)
+
+        if draw < self.error_rate:
+            response = (500, 'text/plain', b'injected error', {})
+        elif draw < self.error_rate + self.throttle_rate:
+            response = (429, 'text/plain', b'injected throttle', {'Retry-After': '0'})
+        else:
+            response = self._route(path)
+        with self.lock:
+            self.served[response[0]] = self.served.get(response[0], 0) + 1
+        return response
+
+    def _route(self, path):
+        parts = urlsplit(path)
+        query = parse_qs(parts.query)
+        if parts.path == API_PATH:
+            record = self.movies.get(query.get('imdbid', [''])[0].zfill(7), {})
+            return 200, 'application/json', json.dumps(record).encode(), {}
+        if parts.path.rstrip('/') == LISTING_PATH:
+            page = int(query.get('page', ['0'])[0])
+            imdbids = self.listing[page * LISTING_PAGE_SIZE:(page + 1) * LISTING_PAGE_SIZE]
+            links = ''.join(f'<a href="https://www.imdb.com/title/tt{imdbid}/">tt{imdbid}</a>\n' for imdbid in imdbids)
+            return 200, 'text/html; charset=utf-8', f'<html><body>{links}</body></html>'.encode(), {}
+
+        name = fixture_name(path)
+        if name and self.alias:
+            movie = name.split('_')[0]
+            if movie not in self.recorded:
+                name = name.replace(movie, self.recorded[int(movie[2:]) % len(self.recorded)], 1)
+        file_path = os.path.join(self.directory, name) if name else None
+        if file_path and os.path.exists(file_path):
+            with open(file_path, 'rb') as f:
+                return 200, 'text/html; charset=utf-8', f.read(), {}
+        return 404, 'text/plain', b'', {}
+
+
+# Function to turn numpy/pandas scalars into JSON-friendly values (missing values become None)
+def _plain(value):
+    if hasattr(value, 'item'):
+        value = value.item()
+    if isinstance(value, float) and value != value:
+        return None
+    return value if isinstance(value, (str, int, float, bool, type(None))) else str(value)
+
+
+class StubSession(requests.Session):
+    '''requests.Session that sends every request to 'base_url' (a StubServer), keeping only the path and query of the requested URL.'''
+
+    def __init__(self, base_url, pool_size=10):
+        super().__init__()
+        self.base_url = base_url.rstrip('/')
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.mount('http://', adapter)
+        self.mount('https://', adapter)
+
+    def request(self, method, url, *args, **kwargs):
+        parts = urlsplit(url)
+        return super().request(method, self.base_url + urlunsplit(('', '', parts.path, parts.query, '')), *args, **kwargs)
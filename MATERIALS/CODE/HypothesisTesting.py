@@ -7,33 +7,26 @@ Then, 2 statistical tests are executed:
 - A two-sample t-test to compare the average sentiment scores of movies that pass or fail the Bechdel test
 - A Mann-Whitney U test (non-parametric) to compare sentiment distributions between the two groups
 Finally, it prints the p-values from both tests to assess statistical significance.
+A permutation test of the difference in mean sentiment (with a 95% bootstrap confidence interval) is also printed, since it doesn't assume normally
+distributed scores.
 After the tests are done, the p-values from both tests are printed and ready to analyze for statistical significance, p < 0.05.
 
-This script requires the pandas, mannwhitneyu, and ttest_ind libraries.
-'''
-
-# Re-import the necessary data
-import pandas as pd
-from scipy.stats import ttest_ind, mannwhitneyu
-
-# Load the dataset again and clean as before
-file_path = './data/bechdel_movies.csv'
-df = pd.read_csv(file_path)
+The data is loaded with BechdelData.py, which adds 'rating_binary' and drops rows without a sentiment score. Both tests are registered in
+AnalysisRunner.py ('sentiment_ttest' and 'sentiment_mannwhitney'), which shares the pass/fail groups between them.
 
-# Simplify the 'rating' column into binary classification: 1 for pass (rating == 3), 0 for fail (rating != 3)
-df['rating_binary'] = df['rating'].apply(lambda x: 1 if x == 3 else 0)
-
-# Drop rows with missing sentiment values
-df_clean = df.dropna(subset=['sentiment'])
+This script requires the scipy and pandas libraries.
+'''
 
-# Split the data into two groups: movies that pass and movies that fail the Bechdel test
-pass_group = df_clean[df_clean['rating_binary'] == 1]['sentiment']
-fail_group = df_clean[df_clean['rating_binary'] == 0]['sentiment']
-# Perform a two-sample t-test (parametric)
-t_stat, p_value_ttest = ttest_ind(pass_group, fail_group, nan_policy='omit')
+from AnalysisRunner import run_hypotheses
 
-# Perform Mann-Whitney U test (non-parametric)
-u_stat, p_value_mannwhitney = mannwhitneyu(pass_group, fail_group, alternative='two-sided')
+if __name__ == '__main__':
+    # Run the two-sample t-test (parametric) and the Mann-Whitney U test (non-parametric) on the pass/fail groups
+    report = run_hypotheses(['sentiment_ttest', 'sentiment_mannwhitney', 'sentiment_permutation'])
+    p_value_ttest = report['tests']['sentiment_ttest']['p_value']
+    p_value_mannwhitney = report['tests']['sentiment_mannwhitney']['p_value']
 
-# Output results
-print(p_value_ttest, p_value_mannwhitney)
+    # Output results
+    print(p_value_ttest, p_value_mannwhitney)
+    permutation = report['tests']['sentiment_permutation']
+    print(f"Permutation test p-value: {permutation['p_value']}, mean difference {permutation['statistic']:.4f} "
+          f"(95% CI {permutation['ci_low']:.4f} to {permutation['ci_high']:.4f})")
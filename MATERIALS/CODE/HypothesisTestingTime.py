@@ -4,41 +4,30 @@ This script executes multiple methods of statistical hypothesis testing to look
 - Hypothesis test of Year and Bechdel score with a 2 sample t-test
 - Hypothesis test of proportion of movies that pass the Bechdel test over time with a chi-square test
 - Hypothesis test of Year versus Sentiment Score with a Pearson/Spearman Correlation
+- The same Spearman correlation tested by permutation, with a bootstrap confidence interval (no distributional assumptions)
+
+The data is loaded with BechdelData.py, which provides typed 'year', 'rating_binary' and 'decade' columns and drops rows without a sentiment score. The
+tests are registered in AnalysisRunner.py, which loads the data once and computes the shared intermediates (pass/fail groups, ranks, the decade
+contingency table) only once.
 
 Running this script requires the scipy.stats and pandas libraries
 '''
 
-from scipy.stats import chi2_contingency, ttest_ind, pearsonr, spearmanr
-import pandas as pd
-
-# Load the dataset again and clean as before
-file_path = './data/bechdel_movies.csv'
-df = pd.read_csv(file_path)
-
-# Drop rows with missing sentiment values
-df_clean = df.dropna(subset=['sentiment'])
-
-# 1. Hypothesis Test: Year and Passing the Bechdel Test (two-sample t-test)
-pass_years = df_clean[df_clean['rating_binary'] == 1]['year']
-fail_years = df_clean[df_clean['rating_binary'] == 0]['year']
-
-# Perform two-sample t-test
-t_stat_year, p_value_year = ttest_ind(pass_years, fail_years, nan_policy='omit')
-
-# 2. Hypothesis Test: Proportion of Movies Passing the Bechdel Test Over Time (Chi-square test)
-# Group by decade and count the number of movies passing/failing per decade
-df_clean['decade'] = (df_clean['year'] // 10) * 10
-bechdel_by_decade = df_clean.groupby(['decade', 'rating_binary'])['title'].count().unstack()
-
-# Perform Chi-square test
-chi2_stat, p_value_chi2, _, _ = chi2_contingency(bechdel_by_decade.fillna(0))
-# 3. Hypothesis Test: Year vs Sentiment Score (Pearson/Spearman Correlation)
-# Pearson assumes normality, while Spearman does not
-pearson_corr, p_value_pearson = pearsonr(df_clean['year'], df_clean['sentiment'])
-spearman_corr, p_value_spearman = spearmanr(df_clean['year'], df_clean['sentiment'])
-
-# Output the p-values of the tests
-print(f"Year and Passing Bechdel Test (t-test) p-value: {p_value_year}")
-print(f"Proportion Passing Bechdel Test Over Time (Chi-square test) p-value: {p_value_chi2}")
-print(f"Year vs Sentiment Score (Pearson correlation) p-value: {p_value_pearson}")
-print(f"Year vs Sentiment Score (Spearman correlation) p-value: {p_value_spearman}")
+from AnalysisRunner import run_hypotheses
+
+if __name__ == '__main__':
+    # 1. Year and Passing the Bechdel Test (two-sample t-test)
+    # 2. Proportion of Movies Passing the Bechdel Test Over Time (Chi-square test on the decade contingency table)
+    # 3. Year vs Sentiment Score (Pearson/Spearman Correlation) - Pearson assumes normality, while Spearman does not
+    report = run_hypotheses(['year_ttest', 'decade_chi2', 'year_sentiment_pearson', 'year_sentiment_spearman',
+                             'year_sentiment_spearman_permutation'])
+    tests = report['tests']
+
+    # Output the p-values of the tests
+    print(f"Year and Passing Bechdel Test (t-test) p-value: {tests['year_ttest']['p_value']}")
+    print(f"Proportion Passing Bechdel Test Over Time (Chi-square test) p-value: {tests['decade_chi2']['p_value']}")
+    print(f"Year vs Sentiment Score (Pearson correlation) p-value: {tests['year_sentiment_pearson']['p_value']}")
+    print(f"Year vs Sentiment Score (Spearman correlation) p-value: {tests['year_sentiment_spearman']['p_value']}")
+    permutation = tests['year_sentiment_spearman_permutation']
+    print(f"Year vs Sentiment Score (Spearman permutation test) p-value: {permutation['p_value']}, "
+          f"rho {permutation['statistic']:.4f} (95% CI {permutation['ci_low']:.4f} to {permutation['ci_high']:.4f})")
@@ -2,45 +2,133 @@
 IMDb Reviews Sentiment Analysis
     When run, this script performs a sentiment analysis for movie reviews from IMDb for movies contained in the Bechdel test dataset. It scrapes the review data
     from IMDb and analyzes their sentiments using the VADER sentiment analyzer. The resulting sentiment is added as a column to the dataset. Because of the large
-    volume of movie reviews, the script processes movies in batches to efficiently handle the data.
+    volume of movie reviews, all requests go through the shared FetchEngine (FetchEngine.py), which reuses keep-alive connections, keeps a bounded number of
+    requests in flight and adapts its request rate when IMDb answers with 429/503, instead of sleeping a fixed amount of time after every batch. Downloaded
+    pages are kept in the on-disk cache './DATA/http_cache.sqlite' (ResponseCache.py), so re-running the script only refetches pages that changed.
 
-    Ensure that 'bechdel_movies_combined.csv' is in the proper directory with correctly formatted IMDb IDs. Also, this script requires the pandas, requests, 
-    BeautifulSoup, nltk, and concurrent.futures libraries.
+    Scores are checkpointed as they are produced: every completed batch is written as a shard in './DATA/sentiment_checkpoint/' (Checkpoint.py) along with a
+    manifest of finished IMDb IDs. If the script is interrupted, running it again skips the movies that are already done, and the final CSV is built by
+    merging the shards.
+
+    Movies are not all re-scraped on every run. The rescoring scheduler (RescoreScheduler.py) remembers when each movie was last fetched, how many
+    reviews it had and a hash of their content ('./DATA/freshness.json'), estimates how many new reviews each movie has probably gained since, and
+    re-fetches only the most stale movies within 'REQUEST_BUDGET' requests per run. Movies that were never fetched are always fetched, so the first run
+    scores the whole dataset. If more than 'MAX_UNSCORED_SHARE' of the movies still have no score at the end of a run (it was interrupted, or most
+    fetches failed), a warning is printed and './DATA/bechdel_movies_with_sentiment.csv' is not overwritten. The movies that were skipped, and why, are
+    listed in './OUTPUT/rescore_plan.json'.
+
+    Downloading and scoring run as two stages (SentimentPipeline.py): the engine's I/O threads push raw review text into a queue, and a pool of worker
+    processes, each with its own VADER scorer, scores the reviews in chunks. The per-stage throughput is printed at the end of the run. Reviews are scored
+    with FastVader.py, which gives the same scores as NLTK's SentimentIntensityAnalyzer with compiled lexicon lookups and a cache of scored reviews.
+
+    Every review and its neg/neu/pos/compound scores are kept in the review store './DATA/review_store/' (ReviewStore.py). Reviews already in the store are
+    not rescored, and a movie's sentiment is aggregated from all of its stored reviews ('SENTIMENT_AGGREGATE', the mean by default).
+
+    Review texts are pulled out of each page by ReviewExtractor.py. The default 'stream' extractor tokenizes the page without building a BeautifulSoup
+    tree; set 'REVIEW_EXTRACTOR' to 'soup' to use the original full-tree parser (BenchmarkExtractors.py confirms both give identical output).
+
+    Movies with more reviews than fit on the first page are paginated through IMDb's "load more" continuation keys under a per-movie budget
+    ('REVIEW_BUDGET'): more pages are fetched only while the confidence interval of the movie's mean score is still wide, up to a cap on the number of
+    reviews. Set 'REVIEW_BUDGET' to None to read only the first page. The pagination can be replayed offline against the recorded pages in
+    './FIXTURES/imdb/' by passing a Fixtures.ReplaySession to the FetchEngine.
+
+    Every stage is measured (Metrics.py): request latency and time to first byte, bytes, cache hit rates, time spent fetching, parsing, scoring and
+    writing, queue depth and peak memory. The metrics are written to './OUTPUT/metrics/sentiment.json' and '.prom' (Prometheus text format) at the end of
+    the run. Set the environment variable BECHDEL_PROFILE to a comma-separated list of stages (fetch, parse, score, write) to also save cProfile profiles
+    of those stages in './OUTPUT/profiles/'.
+
+    Ensure that 'bechdel_movies_combined.csv' is in './DATA/' with correctly formatted IMDb IDs; the result is saved as
+    './DATA/bechdel_movies_with_sentiment.csv'. Pipeline.py runs this step as the 'score' task, and 'python CODE/bechdel.py score' runs main(). The VADER
+    lexicon is read from the vendored './DATA/vader_lexicon.pkl' instead of being downloaded on every run. Also, this script requires the pandas, requests
+    and BeautifulSoup libraries.
 '''
 
+import sys
 import pandas as pd
 import requests
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from nltk.sentiment.vader import SentimentIntensityAnalyzer
-import nltk
-from bs4 import BeautifulSoup
-import time
-
-# Download VADER lexicon
-nltk.download('vader_lexicon')
-
-# Initialize VADER sentiment analyzer
-analyzer = SentimentIntensityAnalyzer()
-
-# Function to fetch IMDb reviews for specific movie based on IMDb ID
-def fetch_imdb_reviews(imdbid):
-    reviews = []
-    url = f"https://www.imdb.com/title/tt{imdbid}/reviews?ref_=tt_ql_3" # url to access the IMDb reviews page for the movie
-    
+from FetchEngine import FetchEngine
+from ResponseCache import ResponseCache
+from Checkpoint import CheckpointStore
+from SentimentPipeline import SentimentPipeline, ReviewBudget
+from ReviewStore import ReviewStore
+from ReviewExtractor import extract_page
+from Metrics import timed, export
+from FastVader import FastVader
+from RescoreScheduler import FreshnessTracker, plan_refresh, FRESHNESS_PATH
+
+# Input dataset, output dataset, and the local scoring state
+COMBINED_PATH = './DATA/bechdel_movies_combined.csv'
+OUTPUT_PATH = './DATA/bechdel_movies_with_sentiment.csv'
+CHECKPOINT_DIR = './DATA/sentiment_checkpoint'
+REVIEW_STORE_DIR = './DATA/review_store'
+
+# Base URL for IMDb - point this at a local stub server to test the scraper offline
+IMDB_BASE_URL = 'https://www.imdb.com'
+
+# How movie-level sentiment is aggregated from the stored per-review compound scores ('mean', 'median' or 'trimmed_mean')
+SENTIMENT_AGGREGATE = 'mean'
+
+# How review texts are extracted from each page ('stream', 'strainer' or 'soup' - see ReviewExtractor.py)
+REVIEW_EXTRACTOR = 'stream'
+
+# Per-movie review budget for "load more" pagination (None = first page only)
+REVIEW_BUDGET = ReviewBudget(max_reviews=150, min_reviews=20, half_width=0.15)
+
+# Requests per run spent re-fetching the movies most likely to have new reviews (None = every movie the scheduler considers stale); movies that were
+# never fetched are always fetched
+REQUEST_BUDGET = 1000
+
+# main() doesn't overwrite the published CSV when more than this share of the movies has no score yet (an interrupted or mostly failed run)
+MAX_UNSCORED_SHARE = 0.05
+
+# Shared engine and VADER scorer, created on first use (get_engine, get_analyzer) so importing this module doesn't open the response cache or load the
+# lexicon
+engine = None
+analyzer = None
+
+
+# Function to get the shared engine: one pooled session and one rate limiter for every request in this run; pages are cached on disk so re-runs don't
+# refetch them
+def get_engine():
+    global engine
+    if engine is None:
+        engine = FetchEngine(max_in_flight=10, rate=5.0, cache=ResponseCache('./DATA/http_cache.sqlite'))
+    return engine
+
+
+# Function to get the shared VADER scorer (same scores as SentimentIntensityAnalyzer, with compiled tokens and a cache of scored reviews); the lexicon
+# is loaded from the vendored './DATA/vader_lexicon.pkl', so nothing is downloaded
+def get_analyzer():
+    global analyzer
+    if analyzer is None:
+        analyzer = FastVader()
+    return analyzer
+
+# Function to fetch one page of IMDb reviews for a movie: the first page, or the "load more" page for a continuation key.
+# Returns (reviews, next_key); next_key is None on the last page. Raises requests.exceptions.RequestException on failure.
+def fetch_review_page(imdbid, key=None, engine=None, base_url=IMDB_BASE_URL):
+    engine = engine or get_engine()
+    if key is None:
+        url = f"{base_url}/title/tt{imdbid}/reviews?ref_=tt_ql_3" # url to access the IMDb reviews page for the movie
+    else:
+        url = f"{base_url}/title/tt{imdbid}/reviews/_ajax?paginationKey={key}" # url behind the "load more" button
+    with timed('fetch'):
+        response = engine.get(url)  # GET through the pooled, rate-limited engine (raises for bad responses)
+
+    # Extract review texts (and the continuation key) from the IMDb reviews page
+    with timed('parse'):
+        return extract_page(response.text, REVIEW_EXTRACTOR)
+
+# Function to fetch IMDb reviews for specific movie based on IMDb ID (first page only)
+# With raise_errors=True, request failures are raised instead of being reported as "no reviews", so the caller can retry them later
+def fetch_imdb_reviews(imdbid, engine=None, base_url=IMDB_BASE_URL, raise_errors=False):
     try:
-        response = requests.get(url)  # Make a GET request to fetch the reviews page
-        response.raise_for_status() # Error for bad responses
-        soup = BeautifulSoup(response.text, 'html.parser') # Parse the response HTML using BeautifulSoup
-        
-        # Extract review texts from the IMDb reviews page
-        review_texts = soup.find_all('div', class_='text show-more__control')
-        
-        for review in review_texts: # Append text of each review to review list
-            reviews.append(review.get_text())
-        
+        reviews, _ = fetch_review_page(imdbid, engine=engine, base_url=base_url)
         return reviews if reviews else None # return the list of reviews or None if no reviews were found
     
     except requests.exceptions.RequestException as e: # handles any exceptions during http request
+        if raise_errors:
+            raise
         print(f"Error fetching reviews for IMDb ID {imdbid}: {e}")
         return None
 
@@ -49,60 +137,128 @@ def calculate_average_sentiment(reviews):
     if not reviews:
         return None  # if no reviews found
 
-     # Calculate the sentiment score for each review using VADER's polarity_scores method
-    sentiment_scores = [analyzer.polarity_scores(review)['compound'] for review in reviews]
+    # Calculate the sentiment score for each review with VADER, scoring repeated reviews once
+    sentiment_scores = [scores['compound'] for scores in get_analyzer().score_many(reviews)]
+    return average_score(sentiment_scores)
 
-    # Return the average sentiment score if the scores exist - return None if they don't
+# Function to average compound scores - return None if there are none
+def average_score(sentiment_scores):
     return sum(sentiment_scores) / len(sentiment_scores) if sentiment_scores else None
 
-# Load the dataset containing movies and IMDb IDs
-df = pd.read_csv('./data/bechdel_movies_combined.csv')
+# Function to write one checkpoint shard for a batch of finished movies, with sentiment aggregated from the review store
+def write_batch(batch, checkpoint, store):
+    with timed('write'):
+        store.flush() # reviews first, so every checkpointed movie has its reviews on disk
+        sentiment = store.aggregate(SENTIMENT_AGGREGATE, imdbids=batch)
 
-# Ensure IMDb IDs are properly formatted (should be a string with 7 or more digits)
-df['imdbid'] = df['imdbid'].apply(lambda x: str(x).zfill(7))
+        records = []
+        for imdbid in batch:
+            value = sentiment.get(int(imdbid)) # missing when the movie has no reviews at all
+            records.append({'imdbid': imdbid, 'sentiment': None if value is None or pd.isna(value) else float(value)})
+        checkpoint.write_shard(records)
 
-# Function to process a batch of movies concurrently using multithreading
-def process_batch(batch_df, max_workers=10):
-    sentiment_scores = [None] * len(batch_df) # list to store sentiment scores for each movie in batch
-    
-    with ThreadPoolExecutor(max_workers=max_workers) as executor: # fetch reviews and compute sentiment scores
-        futures = {executor.submit(fetch_imdb_reviews, row['imdbid']): idx for idx, (index, row) in enumerate(batch_df.iterrows())}
-
-        # proces each future as it is completed
-        for future in as_completed(futures):
-            idx = futures[future]  # This is now the relative index within the batch
-            try:
-                reviews = future.result() # gets reviews for movie and calculates average sentiment score
-                sentiment_scores[idx] = calculate_average_sentiment(reviews)
-            except Exception as e: # handle any exceptions
-                print(f"Error processing row {idx}: {e}")
-    
-    return sentiment_scores # returns list of scores for the batch processed
-
-# Split the dataset into batches and process each batch
-def process_movies_in_batches(df, batch_size=100, max_workers=10):
-    total_movies = len(df)
-    sentiment_scores = []
-
-    for batch_start in range(0, total_movies, batch_size):
-        batch_df = df.iloc[batch_start:batch_start + batch_size]
-        print(f"Processing batch: {batch_start + 1} to {batch_start + len(batch_df)}")# Process the batch concurrently
-        batch_sentiment_scores = process_batch(batch_df, max_workers)
-        sentiment_scores.extend(batch_sentiment_scores)
-        
-        # Optional: Small delay between batches to avoid overwhelming the server
-        time.sleep(10)  # Adjust as needed to avoid rate-limiting (optional)
-    
-    return sentiment_scores
+# Function to fetch reviews and score every movie that isn't checkpointed yet (or the movies in 'imdbids'), writing a shard every 'batch_size' movies.
+# At most engine.max_in_flight requests are in flight at any time, scoring runs on 'workers' processes, and only reviews missing from the store are scored.
+# With a FreshnessTracker, every fetched page and finished movie is recorded in it and it is saved with every shard.
+# Returns a dict of imdbid -> sentiment merged from all shards.
+def process_movies(df, checkpoint, store, engine=None, batch_size=100, workers=None, imdbids=None, tracker=None):
+    engine = engine or get_engine()
+    if imdbids is None:
+        todo = [imdbid for imdbid in df['imdbid'].drop_duplicates() if not checkpoint.is_done(imdbid)]
+        print(f"{len(checkpoint.completed)} movies already checkpointed, {len(todo)} left to process")
+    else:
+        todo = list(imdbids)
+    batch = [] # movies completed since the last shard was written
+
+    # Fetch one page and keep only the reviews that aren't in the store yet
+    def fetch(imdbid, key=None):
+        reviews, next_key = fetch_review_page(imdbid, key, engine=engine)
+        if tracker is not None:
+            tracker.observe(imdbid, reviews)
+        return store.new_reviews(imdbid, reviews), next_key
+
+    pipeline = SentimentPipeline(engine, fetch, workers=workers, budget=REVIEW_BUDGET, stored=store.compounds)
+    for completed, (imdbid, reviews, scores, error) in enumerate(pipeline.run(todo), start=1):
+        if error is not None: # failed movies are not checkpointed, so they are retried on the next run
+            print(f"Error processing IMDb ID {imdbid}: {error}")
+            if tracker is not None:
+                tracker.discard(imdbid)
+            continue
+        if reviews:
+            store.add(imdbid, reviews, scores)
+        if tracker is not None:
+            tracker.finish(imdbid, len(reviews or []))
+        batch.append(imdbid)
+
+        if len(batch) >= batch_size:
+            write_batch(batch, checkpoint, store)
+            if tracker is not None:
+                tracker.save()
+            batch = []
+            print(f"Processed {completed}/{len(todo)} movies (current rate limit: {engine.limiter.rate:.1f} req/s)")
+
+    write_batch(batch, checkpoint, store) # last partial batch
+    if tracker is not None:
+        tracker.save()
+    print(pipeline.report())
+    return {record['imdbid']: record['sentiment'] for record in checkpoint.records()}
+
+
+# Function to add a 'sentiment' column to the combined dataset. The rescoring scheduler picks the movies to fetch: every movie that was never fetched,
+# and the most stale ones within 'budget' requests; every other movie keeps its checkpointed score.
+def score_dataset(df, checkpoint_dir=CHECKPOINT_DIR, store_dir=REVIEW_STORE_DIR, engine=None, budget=REQUEST_BUDGET, freshness_path=FRESHNESS_PATH):
+    df = df.copy()
+
+    # Ensure IMDb IDs are properly formatted (should be a string with 7 or more digits)
+    df['imdbid'] = df['imdbid'].apply(lambda x: str(x).zfill(7))
+
+    # Plan which movies to fetch this run, and report what is skipped and why
+    checkpoint = CheckpointStore(checkpoint_dir)
+    store = ReviewStore(store_dir)
+    tracker = FreshnessTracker(freshness_path)
+    tracker.seed(checkpoint, store)
+    plan = plan_refresh(df, tracker, budget)
+    print(plan.summary())
+    print(f"Rescore plan written to {plan.save()}")
+
+    # Fetch and score the planned movies
+    sentiment_scores = process_movies(df, checkpoint, store, engine=engine, imdbids=plan.selected, tracker=tracker)
+
+    # Add the sentiment scores to the dataframe
+    df['sentiment'] = df['imdbid'].map(sentiment_scores)
+    unscored = unscored_movies(df, checkpoint)
+    if unscored.any():
+        print(f"WARNING: {unscored.sum()} of {len(df)} movies have no score yet (failed fetches are retried on the next run)", file=sys.stderr)
+    return df
+
+
+# Function to flag the movies of a scored dataset that aren't in the checkpoint yet (their sentiment is missing, not just empty)
+def unscored_movies(df, checkpoint):
+    return ~df['imdbid'].isin(checkpoint.completed)
+
+
+# Function to score the combined dataset, save it and export the run's metrics (the 'score' command of bechdel.py)
+def main(budget=REQUEST_BUDGET):
+    # Load the dataset containing movies and IMDb IDs
+    df = pd.read_csv(COMBINED_PATH)
+
+    with get_engine() as engine:
+        df = score_dataset(df, engine=engine, budget=budget)
+
+    # Save the updated dataframe, unless too many movies are still unscored
+    unscored = unscored_movies(df, CheckpointStore(CHECKPOINT_DIR))
+    if unscored.mean() > MAX_UNSCORED_SHARE:
+        print(f"WARNING: not overwriting {OUTPUT_PATH}: {unscored.mean():.0%} of the movies have no score yet; run the script again to score them",
+              file=sys.stderr)
+    else:
+        df.to_csv(OUTPUT_PATH, index=False)
 
-# Fetch sentiment scores in batches
-sentiment_scores = process_movies_in_batches(df, batch_size=100, max_workers=10)
+    # Preview the updated dataframe
+    print(df.head())
 
-# Add the sentiment scores to the dataframe
-df['sentiment'] = sentiment_scores
+    # Save the run's metrics (and profiles, if BECHDEL_PROFILE named any stages)
+    print(f"Metrics written to {', '.join(export('sentiment'))}")
 
-# Save the updated dataframe
-df.to_csv('.DATA/bechdel_movies_with_sentiment.csv', index=False)
 
-# Preview the updated dataframe
-df.head()
+if __name__ == '__main__':
+    main()
@@ -4,49 +4,21 @@ This script predicts whether or not a movie passes the Bechdel test as a binary
 It converts the rating into a binary for easier analysis, drops rows with missing sentiment values, splits the dataset into a train and test set, and then applies
 logistic regression to the training data. The test set is used to make predictions, and the performance of the model is evaluated with an accuracy score and report.
 
-Running this script requires the numpy, sklearn, and pandas libraries.
-'''
-
-import numpy as np
-from sklearn.model_selection import train_test_split
-from sklearn.linear_model import LogisticRegression
-from sklearn.metrics import accuracy_score, classification_report
-import pandas as pd
-
-df = pd.read_csv('./DATA/bechdel_movies.csv')
-
-# Simplify the 'rating' column into binary classification: 1 for pass (rating == 3), 0 for fail (rating != 3)
-df['rating_binary'] = df['rating'].apply(lambda x: 1 if x == 3 else 0)
-
-# Drop rows with missing sentiment values
-df_clean = df.dropna(subset=['sentiment'])
+The data is loaded with BechdelData.py, which adds 'rating_binary' and drops rows without a sentiment score.
 
-# Check the distribution of the new binary 'rating_binary' column
-df_clean['rating_binary'].value_counts()
+The model is the 'baseline' configuration of StreamingLogistic.py, which also reports its fit time, peak memory and calibration. The other configurations
+there add features and stream mini-batches into an SGD classifier with k-fold cross-validation.
 
-# Define features (X) and target (y)
-X = df_clean[['sentiment']]
-y = df_clean['rating_binary']
-
-# Split the dataset into training and testing sets (80% train, 20% test)
-X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
-
-# Remove rows with NaN or infinite values in the training data
-X_train = X_train.replace([np.inf, -np.inf], np.nan).dropna()
-y_train = y_train[X_train.index]  # Keep only corresponding rows in y_train
-
-# Initialize and train the logistic regression model
-model = LogisticRegression()
-model.fit(X_train, y_train)
+Running this script requires the numpy, sklearn, and pandas libraries.
+'''
 
-# Make predictions on the test set
-y_pred = model.predict(X_test)
+from StreamingLogistic import run_config
 
-# Evaluate the model's performance
-accuracy = accuracy_score(y_test, y_pred)
-report = classification_report(y_test, y_pred)
+# Train the original model: LogisticRegression on the sentiment score with an 80/20 split (random_state=42)
+report = run_config('baseline')
 
 # Output results
-print(f"Accuracy: {accuracy:.2f}")
+print(f"Accuracy: {report['accuracy']:.2f}")
 print("Classification Report:")
-print(report)
+print(report['classification_report'])
+print(f"Fit time: {report['fit_seconds'] * 1000:.1f} ms, peak memory: {report['peak_mib']:.2f} MiB, expected calibration error: {report['ece']:.3f}")
@@ -0,0 +1,330 @@
+'''
+Instrumentation
+    This module is the measuring layer shared by the scrapers and the scoring pipeline. Code records what it does into the process-wide registry 'METRICS':
+
+    - counters (requests, bytes transferred, cache hits/misses/revalidations, reviews scored, ...)
+    - gauges, which also remember their maximum (queue depth, chunks in flight, current request rate, ...)
+    - histograms with fixed buckets (per-request latency and time to first byte, per-stage latency of parsing, scoring and disk writes, ...)
+
+    Stages are timed with 'with timed("parse"):' which records into the 'stage_seconds' histogram, and snapshot() adds the per-stage throughput and the
+    peak resident memory of the process and of its finished worker processes. The registry can be exported as JSON (write_json) or in the Prometheus text
+    exposition format (write_prometheus).
+
+    Profiling is opt-in per stage: enable_profiling(['parse', 'score']) (or the environment variable BECHDEL_PROFILE=parse,score) wraps every timed()
+    block of those stages in cProfile - or pyinstrument, with tool='pyinstrument' - and write_profiles() saves one profile per stage. Worker processes that
+    call profile_worker() dump their own profile files.
+
+    This module only uses the Python standard library (pyinstrument is optional).
+'''
+
+import bisect
+import json
+import math
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError: # not available on Windows
+    resource = None
+
+# Default histogram buckets, in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+PROFILE_DIR = './OUTPUT/profiles/'
+METRICS_DIR = './OUTPUT/metrics/'
+
+
+class Counter:
+    def __init__(self):
+        self.value = 0.0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def snapshot(self):
+        return self.value
+
+
+class Gauge:
+    def __init__(self):
+        self.value = 0.0
+        self.max = -math.inf
+        self.lock = threading.Lock()
+
+    def set(self, value):
+        with self.lock:
+            self.value = value
+            self.max = max(self.max, value)
+
+    def snapshot(self):
+        return {'value': self.value, 'max': self.max if self.max > -math.inf else None}
+
+
+class Histogram:
+    '''Fixed-bucket histogram; counts[i] is the number of observations <= buckets[i] (the last slot counts the rest).'''
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        with self.lock:
+            self.counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.count += 1
+            self.sum += value
+
+    # Estimate a quantile by linear interpolation inside the bucket that holds it
+    def quantile(self, q):
+        if not self.count:
+            return None
+        target = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if seen + n >= target and n:
+                low = self.buckets[i - 1] if i > 0 else 0.0
+                high = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return low + (high - low) * (target - seen) / n
+            seen += n
+        return self.buckets[-1]
+
+    def snapshot(self):
+        return {'count': self.count, 'sum': self.sum, 'mean': self.sum / self.count if self.count else None,
+                'p50': self.quantile(0.5), 'p90': self.quantile(0.9), 'p99': self.quantile(0.99),
+                'buckets': dict(zip([str(b) for b in self.buckets] + ['+Inf'], self.counts))}
+
+
+KINDS = {'counter': Counter, 'gauge': Gauge, 'histogram': Histogram}
+
+
+class MetricsRegistry:
+    '''
+    Named metrics with optional labels, e.g. registry.counter('http_responses_total', 'Responses by status', status=200).inc()
+    '''
+
+    def __init__(self):
+        self.metrics = {} # name -> {'kind', 'help', 'series': {labels tuple -> metric}}
+        self.lock = threading.Lock()
+        self.started = time.time()
+
+    def _get(self, kind, name, help, labels, **kwargs):
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        with self.lock:
+            family = self.metrics.setdefault(name, {'kind': kind, 'help': help, 'series': {}})
+            if key not in family['series']:
+                family['series'][key] = KINDS[kind](**kwargs)
+            return family['series'][key]
+
+    def counter(self, name, help='', **labels):
+        return self._get('counter', name, help, labels)
+
+    def gauge(self, name, help='', **labels):
+        return self._get('gauge', name, help, labels)
+
+    def histogram(self, name, help='', buckets=LATENCY_BUCKETS, **labels):
+        return self._get('histogram', name, help, labels, buckets=buckets)
+
+    def reset(self):
+        with self.lock:
+            self.metrics = {}
+            self.started = time.time()
+
+    # Function to record the derived values: per-stage throughput, uptime and peak memory
+    def _derived(self):
+        elapsed = time.time() - self.started
+        self.gauge('uptime_seconds', 'Seconds since the registry was created or reset').set(elapsed)
+        with self.lock:
+            stages = list(self.metrics.get('stage_seconds', {'series': {}})['series'].items())
+        for key, histogram in stages:
+            self.gauge('stage_throughput_per_second', 'Completed stage operations per second of wall time', **dict(key)).set(
+                histogram.count / elapsed if elapsed > 0 else 0.0)
+        for who, rss in peak_rss_bytes().items():
+            self.gauge('peak_rss_bytes', 'Peak resident set size', process=who).set(rss)
+
+    # All metrics as a JSON-ready dict: name -> {'kind', 'help', 'series': [{'labels': {...}, 'value': ...}]}
+    def snapshot(self):
+        self._derived()
+        with self.lock:
+            return {name: {'kind': family['kind'], 'help': family['help'],
+                           'series': [{'labels': dict(key), 'value': metric.snapshot()} for key, metric in family['series'].items()]}
+                    for name, family in sorted(self.metrics.items())}
+
+    def write_json(self, path):
+        _write(path, json.dumps(self.snapshot(), indent=2))
+
+    # All metrics in the Prometheus text exposition format
+    def to_prometheus(self, prefix='bechdel_'):
+        self._derived()
+        lines = []
+        with self.lock:
+            for name, family in sorted(self.metrics.items()):
+                full = prefix + name
+                lines.append(f"# HELP {full} {family['help']}")
+                lines.append(f"# TYPE {full} {family['kind']}")
+                for key, metric in family['series'].items():
+                    if family['kind'] == 'histogram':
+                        cumulative = 0
+                        for bound, n in zip([str(b) for b in metric.buckets] + ['+Inf'], metric.counts):
+                            cumulative += n
+                            lines.append(f"{full}_bucket{_labels(key + (('le', bound),))} {cumulative}")
+                        lines.append(f"{full}_sum{_labels(key)} {metric.sum}")
+                        lines.append(f"{full}_count{_labels(key)} {metric.count}")
+                    else:
+                        lines.append(f"{full}{_labels(key)} {metric.value}")
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path):
+        _write(path, self.to_prometheus())
+
+
+def _labels(key):
+    if not key:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in key) + '}'
+
+
+def _write(path, text):
+    from Checkpoint import atomic_write
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    atomic_write(path, text)
+
+
+# Function to read the peak resident set size of this process and of its finished child processes, in bytes
+def peak_rss_bytes():
+    if resource is None:
+        return {}
+    scale = 1 if sys.platform == 'darwin' else 1024 # ru_maxrss is in bytes on macOS and KiB on Linux
+    return {'self': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+            'children': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale}
+
+
+# Process-wide registry used by FetchEngine, SentimentPipeline and the scrapers
+METRICS = MetricsRegistry()
+
+
+# Opt-in profiling: stage name -> accumulated profile (pstats.Stats or a pyinstrument session)
+_profiling = {'stages': set(), 'tool': 'cprofile', 'results': {}, 'lock': threading.Lock()}
+
+
+def enable_profiling(stages, tool='cprofile'):
+    _profiling['stages'] = set(stages)
+    _profiling['tool'] = tool
+
+
+def profiled_stages():
+    return set(_profiling['stages']), _profiling['tool']
+
+
+if os.environ.get('BECHDEL_PROFILE'):
+    enable_profiling(os.environ['BECHDEL_PROFILE'].split(','), os.environ.get('BECHDEL_PROFILER', 'cprofile'))
+
+
+# Function to run a block under the profiler when its stage is enabled. Profilers that can't start (e.g. another thread is already being profiled
+# with a Python version that allows only one active profiler) are skipped for that block.
+@contextmanager
+def profile(stage):
+    if stage not in _profiling['stages']:
+        yield
+        return
+    if _profiling['tool'] == 'pyinstrument':
+        from pyinstrument import Profiler
+        profiler = Profiler(async_mode='disabled')
+        try:
+            profiler.start()
+        except RuntimeError:
+            yield
+            return
+        try:
+            yield
+        finally:
+            session = profiler.stop()
+            with _profiling['lock']:
+                previous = _profiling['results'].get(stage)
+                _profiling['results'][stage] = session if previous is None else type(session).combine(previous, session)
+        return
+
+    import cProfile
+    import pstats
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        yield
+        return
+    try:
+        yield
+    finally:
+        profiler.disable()
+        with _profiling['lock']:
+            previous = _profiling['results'].get(stage)
+            if previous is None:
+                _profiling['results'][stage] = pstats.Stats(profiler)
+            else:
+                previous.add(profiler)
+
+
+# Function to time a block as one operation of a stage (recorded in the 'stage_seconds' histogram), profiling it when the stage is enabled
+@contextmanager
+def timed(stage, registry=None):
+    histogram = (registry or METRICS).histogram('stage_seconds', 'Seconds per operation of each pipeline stage', stage=stage)
+    start = time.perf_counter()
+    try:
+        with profile(stage):
+            yield
+    finally:
+        histogram.observe(time.perf_counter() - start)
+
+
+# Function to save the accumulated profiles: <stage>.prof for cProfile (open with pstats or snakeviz), <stage>.html for pyinstrument
+def write_profiles(directory=PROFILE_DIR):
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    with _profiling['lock']:
+        for stage, result in _profiling['results'].items():
+            if hasattr(result, 'dump_stats'):
+                path = os.path.join(directory, f'{stage}.prof')
+                result.dump_stats(path)
+            else:
+                from pyinstrument.renderers import HTMLRenderer
+                path = os.path.join(directory, f'{stage}.html')
+                _write(path, HTMLRenderer().render(result))
+            paths.append(path)
+    return paths
+
+
+# Function to write the registry as <name>.json and <name>.prom, plus any profiles that were collected; returns the paths written
+def export(name, directory=METRICS_DIR, registry=None):
+    registry = registry or METRICS
+    json_path, prom_path = os.path.join(directory, f'{name}.json'), os.path.join(directory, f'{name}.prom')
+    registry.write_json(json_path)
+    registry.write_prometheus(prom_path)
+    return [json_path, prom_path] + write_profiles()
+
+
+# Worker processes: profile every call of a stage in this process and keep <stage>-<pid>.prof up to date (cProfile only)
+_worker_profiler = None
+
+
+@contextmanager
+def profile_worker(stage, stages, directory=PROFILE_DIR):
+    global _worker_profiler
+    if stage not in stages:
+        yield
+        return
+    import cProfile
+    if _worker_profiler is None:
+        _worker_profiler = cProfile.Profile()
+    _worker_profiler.enable()
+    try:
+        yield
+    finally:
+        _worker_profiler.disable()
+        os.makedirs(directory, exist_ok=True)
+        _worker_profiler.dump_stats(os.path.join(directory, f'{stage}-{os.getpid()}.prof'))
@@ -0,0 +1,321 @@
+'''
+Project Pipeline Runner
+    The project used to be a chain of scripts run by hand in the right order (ScrapeNewBechdel.py -> IMDbReviewSentiment.py -> RoundSentiment.py ->
+    AddBinaryRating.py -> tests and plots), each one reading and rewriting whole CSVs. This module runs the same steps as a dependency graph of tasks.
+    Each task declares the artifacts it reads and writes:
+
+        sync ─> combined ─> score ─> scored ─> binary ─> movies ─┬─> tests       ─> hypothesis_report
+                                                                ├─> exploratory ─> exploratory_plots
+                                                                ├─> analysis    ─> analysis_plots
+                                                                ├─> regression  ─> regression_report
+                                                                └─> index       ─> query_index
+
+    - An artifact is either a file (the CSVs, reports and plot manifests, all under './DATA/' and './OUTPUT/'), the versioned dataset table ('movies',
+      ColumnTable.py - only its changed columns are written), or a frame that only lives in memory (path None). Frames produced during a run are handed to
+      the next task directly instead of being written and read back. Sentiment scores are stored unrounded; RoundSentiment.py rounds them for display.
+    - A task is skipped when the content hashes of its inputs and of its source files (in this folder) match the last successful run (kept in
+      './DATA/pipeline_state.json') and its file outputs still exist. In-memory artifacts are hashed by how they were derived, so their consumers are
+      skipped too; if a consumer does have to run, the skipped producer is re-run to rebuild the frame.
+    - Tasks whose inputs are ready run concurrently on a thread pool: the tests, both plot sets and the regression run side by side. The tasks that fan out
+      to worker processes (resampling, plot rendering, cross-validation folds; registered with processes=True) share one process pool of
+      'PROCESS_WORKERS', started before the task threads, instead of each starting a pool sized for every CPU from one of those threads.
+    - The tasks that talk to remote sites (sync and score) are marked external: they only run when forced, e.g. run(force=['sync', 'score']). When an
+      input can't be built without them (say only the dataset table is on disk), the tasks downstream keep their existing outputs.
+
+    Usage:
+        python Pipeline.py                  # bring every output up to date
+        run(targets=['hypothesis_report'])  # only what the hypothesis report needs
+
+    This module requires the libraries of the tasks it runs (pandas, numpy, scipy, matplotlib, seaborn, scikit-learn, and for the external tasks
+    requests and BeautifulSoup).
+'''
+
+import hashlib
+import inspect
+import json
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import nullcontext
+
+import pandas as pd
+from BechdelData import file_hash, load_movies, clean_movies, open_table, TABLE_DIR, VIEW_COLUMNS
+from Checkpoint import atomic_write
+from QueryService import INDEX_DIR
+
+STATE_PATH = './DATA/pipeline_state.json'
+CODE_DIR = os.path.dirname(os.path.abspath(__file__)) # task sources are named relative to this folder
+PROCESS_WORKERS = os.cpu_count() or 1 # worker processes shared by the tasks registered with processes=True
+
+# Artifacts: name -> path of the file holding it (None for frames that only live in memory) and how to load it
+ARTIFACTS = {
+    'combined': {'path': './DATA/bechdel_movies_combined.csv', 'load': pd.read_csv},
+    'scored': {'path': './DATA/bechdel_movies_with_sentiment.csv', 'load': pd.read_csv},
+    'movies': {'path': os.path.join(TABLE_DIR, 'HEAD'), 'load': lambda path: load_movies(clean=False)},
+    'hypothesis_report': {'path': './OUTPUT/hypothesis_results.json', 'load': None},
+    'exploratory_plots': {'path': './OUTPUT/Exploratory/.plots.json', 'load': None},
+    'analysis_plots': {'path': './OUTPUT/Analysis/.plots.json', 'load': None},
+    'regression_report': {'path': './OUTPUT/regression_streaming.json', 'load': None},
+    'query_index': {'path': os.path.join(INDEX_DIR, 'CURRENT'), 'load': None},
+}
+
+# Registry of tasks: name -> dict(func, inputs, outputs, sources, external)
+TASKS = {}
+
+
+# Decorator to register a task. 'func' receives a dict of its input artifacts and returns a dict of its outputs: a frame for in-memory artifacts, a
+# frame or None for file artifacts (None when the task wrote the file itself). 'sources' are the code files whose changes invalidate the task. Tasks
+# registered with processes=True also receive the pipeline's shared process pool, to run their worker-process work on.
+def task(name, inputs=(), outputs=(), sources=(), external=False, processes=False):
+    def register(func):
+        TASKS[name] = {'func': func, 'inputs': list(inputs), 'outputs': list(outputs), 'sources': list(sources), 'external': external,
+                       'processes': processes}
+        return func
+    return register
+
+
+def _producers():
+    return {artifact: name for name, entry in TASKS.items() for artifact in entry['outputs']}
+
+
+# Function to write a frame returned for a file artifact
+def _save(artifact, frame):
+    path = ARTIFACTS[artifact]['path']
+    if artifact == 'movies': # commit to the versioned table; unchanged columns are not rewritten
+        open_table().write_frame(frame.drop(columns=VIEW_COLUMNS), message='pipeline: binary')
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    frame.to_csv(path + '.tmp', index=False)
+    os.replace(path + '.tmp', path)
+
+
+class PipelineRun:
+    '''
+    One run of the task graph: the hashes and in-memory values of the artifacts, and what happened to each task.
+    '''
+
+    def __init__(self, state, force=(), processes=None):
+        self.state = state # task name -> hash of its inputs at its last successful run
+        self.force = set(force)
+        self.processes = processes # process pool shared by the tasks registered with processes=True
+        self.values = {} # artifact -> frame produced or loaded during this run
+        self.hashes = {} # artifact -> content hash (files) or derivation hash (in-memory frames)
+        self.results = {} # task name -> {'status': 'ran' | 'skipped' | 'failed' | 'blocked', 'seconds': ...}
+        self.lock = threading.RLock()
+
+    # Hash of everything a task depends on: its name, its source files and its inputs
+    def task_key(self, name):
+        entry = TASKS[name]
+        digest = hashlib.sha256(name.encode())
+        for source in entry['sources']:
+            path = os.path.join(CODE_DIR, source)
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"Task '{name}' declares the source '{source}', which doesn't exist in {CODE_DIR}")
+            digest.update(file_hash(path).encode())
+        digest.update(inspect.getsource(entry['func']).encode())
+        for artifact in entry['inputs']:
+            digest.update(f'{artifact}={self.hashes.get(artifact)}'.encode())
+        return digest.hexdigest()
+
+    def _outputs_exist(self, name):
+        return all(ARTIFACTS[a]['path'] is None or os.path.exists(ARTIFACTS[a]['path']) for a in TASKS[name]['outputs'])
+
+    def _inputs_missing(self, name):
+        return [artifact for artifact in TASKS[name]['inputs'] if self.hashes.get(artifact) is None]
+
+    def should_skip(self, name, key):
+        if name in self.force:
+            return False
+        if TASKS[name]['external']:
+            return True
+        missing = self._inputs_missing(name)
+        if missing:
+            if self._outputs_exist(name):
+                return True # keep the existing outputs
+            raise FileNotFoundError(f"'{name}' needs {missing}, which can't be built without running the external tasks")
+        return self.state.get(name) == key and self._outputs_exist(name)
+
+    # Record the hashes of a task's outputs after it ran or was skipped (None for outputs that aren't available)
+    def _record_outputs(self, name, key):
+        available = not self._inputs_missing(name)
+        for artifact in TASKS[name]['outputs']:
+            path = ARTIFACTS[artifact]['path']
+            if path is not None:
+                self.hashes[artifact] = file_hash(path) if os.path.exists(path) else None
+            else:
+                self.hashes[artifact] = key if available else None
+
+    # Function to get the value of an input artifact: from memory, from its file, or by re-running its (skipped) producer
+    def value(self, artifact):
+        with self.lock:
+            if artifact not in self.values:
+                spec = ARTIFACTS[artifact]
+                if spec['path'] is None:
+                    self.execute(_producers()[artifact])
+                else:
+                    self.values[artifact] = spec['load'](spec['path']) if spec['load'] else spec['path']
+            return self.values[artifact]
+
+    # Function to run a task's function and store its outputs
+    def execute(self, name):
+        entry = TASKS[name]
+        inputs = {artifact: self.value(artifact) for artifact in entry['inputs']}
+        outputs = (entry['func'](inputs, self.processes) if entry['processes'] else entry['func'](inputs)) or {}
+        with self.lock:
+            for artifact, frame in outputs.items():
+                if frame is not None:
+                    if ARTIFACTS[artifact]['path'] is not None:
+                        _save(artifact, frame)
+                    self.values[artifact] = frame
+
+    # Function to run (or skip) one task once all of its inputs are ready
+    def run_task(self, name):
+        start = time.perf_counter()
+        key = self.task_key(name)
+        if self.should_skip(name, key):
+            status = 'skipped'
+        else:
+            self.execute(name)
+            status = 'ran'
+            with self.lock:
+                self.state[name] = key
+                atomic_write(STATE_PATH, json.dumps(self.state, indent=2, sort_keys=True))
+        self._record_outputs(name, key)
+        return {'status': status, 'seconds': time.perf_counter() - start}
+
+
+# Function to find the tasks needed to build the target artifacts (every artifact by default), in dependency order
+def plan(targets=None):
+    producers = _producers()
+    order, seen = [], set()
+
+    def visit(name):
+        if name in seen:
+            return
+        seen.add(name)
+        for artifact in TASKS[name]['inputs']:
+            if artifact in producers:
+                visit(producers[artifact])
+        order.append(name)
+
+    for artifact in targets or ARTIFACTS:
+        if artifact in producers:
+            visit(producers[artifact])
+    return order
+
+
+def _load_state():
+    try:
+        with open(STATE_PATH) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+# Function to start the process pool shared by the planned tasks (a null context when none of them needs one). Its processes are started right away,
+# while the pipeline has no task threads yet, so they are never forked from a process that is running several threads.
+def _process_pool(tasks, workers):
+    if not any(TASKS[name]['processes'] for name in tasks):
+        return nullcontext()
+    from PlotRegistry import init_worker
+    pool = ProcessPoolExecutor(max_workers=workers, initializer=init_worker) # the plot tasks draw on these processes
+    pool.submit(int).result() # the first task launches the processes (all of them under the 'fork' start method)
+    return pool
+
+
+# Function to run the pipeline for the target artifacts, running independent tasks concurrently on up to 'workers' threads, and their worker-process
+# work on one shared pool of 'process_workers'. Tasks named in 'force' run even if their inputs are unchanged. Returns a dict of task name -> status
+# and seconds.
+def run(targets=None, force=(), workers=4, process_workers=PROCESS_WORKERS):
+    open_table() # imports 'bechdel_movies.csv' into the dataset table on first use
+    tasks = plan(targets)
+    producers = _producers()
+    needs = {name: {producers[a] for a in TASKS[name]['inputs'] if a in producers} & set(tasks) for name in tasks}
+
+    pending = list(tasks)
+    running = {}
+    with _process_pool(tasks, process_workers) as processes, ThreadPoolExecutor(max_workers=workers) as executor:
+        pipeline = PipelineRun(_load_state(), force, processes)
+        while pending or running:
+            for name in list(pending):
+                upstream = [pipeline.results.get(dep, {}).get('status') for dep in needs[name]]
+                if any(status in ('failed', 'blocked') for status in upstream):
+                    pipeline.results[name] = {'status': 'blocked', 'seconds': 0.0}
+                    pending.remove(name)
+                elif all(status in ('ran', 'skipped') for status in upstream):
+                    running[executor.submit(pipeline.run_task, name)] = name
+                    pending.remove(name)
+            if not running:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    pipeline.results[name] = future.result()
+                except Exception as e: # report the failure and block everything downstream of it
+                    pipeline.results[name] = {'status': 'failed', 'seconds': 0.0, 'error': repr(e)}
+    return {name: pipeline.results[name] for name in tasks}
+
+
+# The project's tasks
+
+@task('sync', outputs=['combined'], sources=['ScrapeNewBechdel.py'], external=True)
+def sync(inputs):
+    from ScrapeNewBechdel import sync_dataset
+    sync_dataset()
+    return {'combined': None}
+
+
+@task('score', inputs=['combined'], outputs=['scored'], sources=['IMDbReviewSentiment.py', 'SentimentPipeline.py', 'ReviewExtractor.py', 'RescoreScheduler.py'], external=True)
+def score(inputs):
+    from IMDbReviewSentiment import score_dataset
+    return {'scored': score_dataset(inputs['combined'])}
+
+
+@task('binary', inputs=['scored'], outputs=['movies'], sources=['AddBinaryRating.py', 'BechdelData.py', 'ColumnTable.py'])
+def binary(inputs):
+    from AddBinaryRating import add_binary_rating
+    return {'movies': add_binary_rating(inputs['scored'])}
+
+
+@task('tests', inputs=['movies'], outputs=['hypothesis_report'], sources=['AnalysisRunner.py', 'Resampling.py', 'AggregateCube.py'], processes=True)
+def tests(inputs, processes):
+    from AnalysisRunner import run_hypotheses
+    run_hypotheses(df=clean_movies(inputs['movies']), report_path=ARTIFACTS['hypothesis_report']['path'], executor=processes)
+
+
+@task('exploratory', inputs=['movies'], outputs=['exploratory_plots'], sources=['ExploratoryPlots.py', 'PlotRegistry.py', 'AggregateCube.py', 'SentimentSketch.py'],
+      processes=True)
+def exploratory(inputs, processes):
+    import ExploratoryPlots
+    from PlotRegistry import render_plots
+    render_plots(inputs['movies'], 'exploratory', ExploratoryPlots.output_folder, max_points=ExploratoryPlots.MAX_POINTS, executor=processes)
+
+
+@task('analysis', inputs=['movies'], outputs=['analysis_plots'], sources=['AnalysisPlots.py', 'PlotRegistry.py', 'AggregateCube.py', 'SentimentSketch.py'],
+      processes=True)
+def analysis(inputs, processes):
+    import AnalysisPlots
+    from PlotRegistry import render_plots
+    render_plots(clean_movies(inputs['movies']), 'analysis', AnalysisPlots.output_folder, executor=processes)
+
+
+@task('regression', inputs=['movies'], outputs=['regression_report'], sources=['StreamingLogistic.py'], processes=True)
+def regression(inputs, processes):
+    from StreamingLogistic import run_config
+    run_config('streaming', df=clean_movies(inputs['movies']), report_path=ARTIFACTS['regression_report']['path'], executor=processes)
+
+
+# Builds the query index of the new table version, so QueryService.py only has to swap it in
+@task('index', inputs=['movies'], outputs=['query_index'], sources=['QueryService.py'])
+def index(inputs):
+    from QueryService import build_index
+    build_index()
+
+
+if __name__ == '__main__':
+    results = run()
+    for name, result in results.items():
+        error = f" ({result['error']})" if 'error' in result else ''
+        print(f"{name:<12} {result['status']:<8} {result['seconds']:8.2f} s{error}")
@@ -0,0 +1,223 @@
+'''
+Plot Registry
+    This module renders the figures of ExploratoryPlots.py and AnalysisPlots.py. Instead of drawing every figure one after another (and blocking on
+    plt.show()), each figure is registered with the columns it reads and a spec of its drawing parameters:
+
+        @plot('analysis', 'PassByDecade.png', columns=['decade', 'rating_binary'], aggregates=['pass_rate_by_decade'], title='...')
+        def pass_by_decade(data, shared, spec):
+            shared['pass_rate_by_decade'].plot(kind='bar')
+            plt.title(spec['title'])
+
+    render_plots() then:
+    - skips figures whose inputs haven't changed: a hash of the figure's input columns, its spec and its drawing code is kept in a manifest
+      ('.plots.json') in the output folder, and a figure is only redrawn when that hash changes or the PNG is missing
+    - computes the shared aggregates the remaining figures need (value counts, boxplot statistics, KDE grids, ...) once, in the parent process; counts and
+      pass rates are read from the aggregate cube (AggregateCube.py), and sentiment quantiles, histograms and KDEs from the sentiment sketches
+      (SentimentSketch.py) rather than the rows
+    - only sends the rows of a figure's columns to the workers when the figure draws from them; figures registered with raw=False draw from their
+      aggregates alone, and their columns (or, for review-level sketches, the sketches) only decide when they are redrawn
+    - draws the figures on the non-interactive Agg backend across a pool of worker processes, so it runs headless
+    - optionally downsamples the rows given to scatter-style figures (registered with sample=True) to 'max_points'
+
+    This module requires the pandas, numpy, matplotlib and seaborn libraries.
+'''
+
+import hashlib
+import inspect
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+
+import numpy as np
+import pandas as pd
+from Checkpoint import atomic_write
+from AggregateCube import AggregateCube
+from SentimentSketch import build_sketches, movie_chunks
+
+MANIFEST_NAME = '.plots.json'
+
+# Registry of figures: name -> dict(group, filename, draw, columns, aggregates, sample, raw, style, spec)
+PLOTS = {}
+
+# Registry of shared aggregates: name -> function taking the dataframe, its aggregate cube and its sentiment sketches
+AGGREGATES = {}
+
+
+# Decorator to register a figure. 'draw' is called as draw(data, shared, spec) with the current figure already created at spec['figsize'].
+# With raw=False, 'data' is None: the columns are only hashed and the figure draws from its aggregates.
+def plot(group, filename, columns=(), aggregates=(), sample=False, raw=True, style=None, **spec):
+    def register(draw):
+        PLOTS[draw.__name__] = {
+            'group': group,
+            'filename': filename,
+            'draw': draw,
+            'columns': list(columns),
+            'aggregates': list(aggregates),
+            'sample': sample,
+            'raw': raw,
+            'style': style,
+            'spec': spec,
+        }
+        return draw
+    return register
+
+
+# Decorator to register a shared aggregate
+def aggregate(func):
+    AGGREGATES[func.__name__] = func
+    return func
+
+
+# Shared aggregates, computed at most once per render_plots() call
+
+@aggregate
+def rating_counts(df, cube, sketches):
+    return cube.counts('rating')
+
+
+@aggregate
+def visible_counts(df, cube, sketches):
+    return df['visible'].value_counts().sort_index()
+
+
+@aggregate
+def test_result_counts(df, cube, sketches):
+    counts = cube.counts('rating_binary').reindex([0, 1], fill_value=0)
+    return pd.Series(counts.to_numpy(), index=['Fail', 'Pass'])
+
+
+@aggregate
+def pass_rate_by_decade(df, cube, sketches):
+    return cube.pass_rate('decade')
+
+
+# Boxplot statistics (median, quartiles, whiskers, fliers) of the sentiment per decade, in the format of Axes.bxp
+@aggregate
+def sentiment_boxplot_by_decade(df, cube, sketches):
+    return [sketch.boxplot_stats(f'{decade}s') for decade, sketch in sketches.group('decade').items()]
+
+
+@aggregate
+def count_by_year(df, cube, sketches):
+    return cube.counts('year')
+
+
+# Gaussian KDE of the sentiment of passing and failing movies, on the same grid pandas' plot(kind='kde') uses (widened to a few bandwidths when the
+# scores barely spread); groups with fewer than 2 scores are left out
+@aggregate
+def sentiment_kde_by_result(df, cube, sketches):
+    groups = sketches.group('rating_binary')
+    grids = {}
+    for label, passes in (('Passing', 1), ('Failing', 0)):
+        sketch = groups.get(passes)
+        if sketch is None or sketch.count < 2:
+            continue
+        spread = max(sketch.max - sketch.min, 6 * sketch.bandwidth)
+        x = np.linspace(sketch.min - 0.5 * spread, sketch.max + 0.5 * spread, 1000)
+        grids[label] = (x, sketch.kde(x))
+    return grids
+
+
+# Histogram of all sentiment scores in bins of 0.05, with its KDE scaled to counts (what sns.histplot(kde=True) draws; None for fewer than 2 scores)
+@aggregate
+def sentiment_histogram(df, cube, sketches):
+    sketch = sketches.group()
+    edges, counts = sketch.histogram(merge=10)
+    if sketch.count < 2:
+        return {'edges': edges, 'counts': counts, 'x': None, 'kde': None, 'unit': sketches.unit}
+    x = np.linspace(edges[0], edges[-1], 200)
+    return {'edges': edges, 'counts': counts, 'x': x, 'kde': sketch.kde(x) * sketch.count * (edges[1] - edges[0]), 'unit': sketches.unit}
+
+
+@aggregate
+def correlation_matrix(df, cube, sketches):
+    return df[['year', 'sentiment', 'rating_binary']].astype(np.float64).corr()
+
+
+# Function to hash the inputs of a figure: its input columns, its spec and the source of its drawing function (and, for figures drawn from
+# review-level sketches, the sketches)
+def plot_hash(name, df, max_points=None, sketches=None):
+    entry = PLOTS[name]
+    digest = hashlib.sha256()
+    try:
+        code = inspect.getsource(entry['draw'])
+    except (OSError, TypeError):
+        code = entry['draw'].__code__.co_code.hex()
+    digest.update(json.dumps([name, entry['filename'], entry['style'], entry['spec'], entry['aggregates'], code,
+                              max_points if entry['sample'] else None], sort_keys=True, default=str).encode())
+    for col in sorted(set(entry['columns'])):
+        digest.update(col.encode())
+        digest.update(pd.util.hash_pandas_object(df[col], index=False).to_numpy().tobytes())
+    if sketches is not None and sketches.unit != 'movies' and not entry['raw']:
+        digest.update(sketches.fingerprint().encode())
+    return digest.hexdigest()
+
+
+def _load_manifest(output_folder):
+    try:
+        with open(os.path.join(output_folder, MANIFEST_NAME)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+# Function to set up a process that renders figures (the initializer of the rendering pool, or of a pool shared with other work)
+def init_worker():
+    import matplotlib
+    matplotlib.use('Agg')
+
+
+# Function to draw and save one figure (runs in a worker process)
+def _render(task):
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    draw, data, shared, spec, style, path = task
+    plt.rcdefaults()
+    if style:
+        sns.set(style=style)
+    plt.figure(figsize=spec.get('figsize', (10, 6)))
+    result = draw(data, shared, spec)
+    figure = result if result is not None else plt.gcf() # drawing functions that build their own figure (pairplot, jointplot) return it
+    figure.savefig(path)
+    plt.close('all')
+    return path
+
+
+# Function to render the registered figures of a group (or the named figures) from one dataframe (and its aggregate cube and sentiment sketches, built
+# from df if not given) into output_folder. Figures whose hash matches the manifest are skipped unless force=True. Returns a dict with the rendered and
+# skipped figure names. The figures are drawn on 'executor' when one is given (its processes must have run init_worker), else on a new pool of 'workers'.
+def render_plots(df, group=None, output_folder='./OUTPUT/', names=None, workers=None, max_points=None, force=False, cube=None, sketches=None,
+                 executor=None):
+    os.makedirs(output_folder, exist_ok=True)
+    names = names or [name for name, entry in PLOTS.items() if entry['group'] == group]
+    manifest = _load_manifest(output_folder)
+
+    hashes = {name: plot_hash(name, df, max_points, sketches) for name in names}
+    todo = [name for name in names if force or manifest.get(name) != hashes[name]
+            or not os.path.exists(os.path.join(output_folder, PLOTS[name]['filename']))]
+    skipped = [name for name in names if name not in todo]
+
+    if todo and cube is None:
+        cube = AggregateCube.build(df)
+    if todo and sketches is None:
+        sketches = build_sketches(movie_chunks(df))
+    shared = {}
+    tasks = []
+    for name in todo:
+        entry = PLOTS[name]
+        for agg in entry['aggregates']:
+            if agg not in shared:
+                shared[agg] = AGGREGATES[agg](df, cube, sketches)
+        data = df[entry['columns']] if entry['columns'] and entry['raw'] else None
+        if data is not None and entry['sample'] and max_points and len(data) > max_points:
+            data = data.sample(n=max_points, random_state=0)
+        tasks.append((entry['draw'], data, {agg: shared[agg] for agg in entry['aggregates']}, entry['spec'], entry['style'],
+                      os.path.join(output_folder, entry['filename'])))
+
+    if tasks:
+        with nullcontext(executor) if executor is not None else ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as pool:
+            for name, _ in zip(todo, pool.map(_render, tasks)):
+                manifest[name] = hashes[name]
+                atomic_write(os.path.join(output_folder, MANIFEST_NAME), json.dumps(manifest, indent=2, sort_keys=True))
+    return {'rendered': todo, 'skipped': skipped}
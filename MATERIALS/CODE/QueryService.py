@@ -0,0 +1,425 @@
+'''
+Dataset Query Service
+    Answering "what are the sentiment and rating of tt0111161" or "all passing films from 1995-2005 with sentiment >= 0.5" used to mean loading the whole
+    dataset into pandas and filtering it by a full scan. This module keeps read-only indexes of the versioned dataset table ('./DATA/bechdel_table/',
+    ColumnTable.py) on disk and answers those queries from them:
+
+    - a hash index on imdbid (open addressing; duplicate IMDb IDs return every matching row)
+    - a sorted (year, sentiment) index for range queries: a year range is one binary search, a sentiment range one more per year in it
+    - a trigram index on the case-folded title for substring search, and the case-folded titles in sorted order for prefix search (substrings shorter
+      than a trigram are found by scanning those titles, which are stored as one blob)
+
+    The index of every table version is a directory of .npy files ('./DATA/query_index/v<version>/') that is opened memory-mapped, so opening an index
+    reads almost nothing and the operating system keeps the parts that are used in its page cache. Indexes are built once per table version (the pipeline's
+    'index' task builds them as soon as a new version is committed) and a directory only appears when it is complete.
+
+    MovieIndex.start() watches the table's HEAD in a background thread: when the pipeline (or AddBinaryRating.py, or a rollback) publishes a new version,
+    the index for it is built or opened and swapped in. Queries that are running keep using the index they started with.
+
+    Usage:
+        index = MovieIndex.open()
+        index.get(111161)                                               # list of matching rows (dicts)
+        index.movies(year_min=1995, year_max=2005, sentiment_min=0.5, passing=True)
+        index.search_title('shawshank')                                 # substring; index.search_title('the sh', prefix=True) for prefixes
+
+    When run, this script serves the same queries as JSON over HTTP on localhost (SERVICE_PORT):
+        /movie/tt0111161
+        /movies?year_min=1995&year_max=2005&sentiment_min=0.5&passing=1&limit=100
+        /search?title=shawshank&prefix=0&limit=20
+        /status
+
+    This module requires the numpy and pandas libraries.
+'''
+
+import json
+import os
+import re
+import shutil
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+import numpy as np
+from BechdelData import open_table, TABLE_DIR
+from Checkpoint import atomic_write
+
+INDEX_DIR = './DATA/query_index/'
+KEEP_VERSIONS = 2 # index directories kept on disk (the current one and the one before)
+REFRESH_SECONDS = 2.0
+SERVICE_HOST = '127.0.0.1'
+SERVICE_PORT = 8765
+
+# Columns kept in the index and their dtypes (title is stored separately as UTF-8 bytes plus offsets)
+INDEX_COLUMNS = {'imdbid': np.int64, 'year': np.int16, 'rating': np.int8, 'rating_binary': np.int8, 'sentiment': np.float32, 'id': np.int32}
+
+EMPTY = -1
+GOLDEN = 0x9E3779B97F4A7C15 # multiplier of the imdbid hash (Fibonacci hashing)
+MASK64 = (1 << 64) - 1
+
+
+# Function to normalize a title for searching: case-folded, with runs of whitespace collapsed
+def normalize_title(title):
+    return ' '.join(str(title).casefold().split())
+
+
+# Function to encode every trigram of a string as one int64 (three 21-bit code points)
+def trigrams(text):
+    return {(ord(text[i]) << 42) | (ord(text[i + 1]) << 21) | ord(text[i + 2]) for i in range(len(text) - 2)}
+
+
+def _home_slots(keys, bits):
+    return (keys.astype(np.uint64) * np.uint64(GOLDEN)) >> np.uint64(64 - bits)
+
+
+# Function to build an open-addressing table (linear probing) over unique keys; returns (slot keys, slot entries) with EMPTY in free slots.
+# Keys are placed in rounds: in each round every unplaced key tries its next slot, and the first claimant of each free slot gets it.
+def _hash_table(keys):
+    bits = max(4, int(2 * len(keys) - 1).bit_length()) # at most half full
+    size = 1 << bits
+    slot_keys = np.full(size, EMPTY, dtype=np.int64)
+    slot_entries = np.full(size, EMPTY, dtype=np.int32)
+    home = _home_slots(keys, bits).astype(np.int64)
+    probe = np.zeros(len(keys), dtype=np.int64)
+    pending = np.arange(len(keys))
+    while pending.size:
+        slots = (home[pending] + probe[pending]) & (size - 1)
+        free = slot_entries[slots] == EMPTY
+        claimed, first = np.unique(slots[free], return_index=True)
+        winners = pending[free][first]
+        slot_entries[claimed] = winners
+        slot_keys[claimed] = keys[winners]
+        placed = np.zeros(len(keys), dtype=bool)
+        placed[winners] = True
+        pending = pending[~placed[pending]]
+        probe[pending] += 1
+    return slot_keys, slot_entries
+
+
+# Function to write the index files of a frame into 'directory'
+def _write_index(df, directory):
+    n = len(df)
+    arrays = {}
+    for name, dtype in INDEX_COLUMNS.items():
+        if name in df:
+            arrays[name] = df[name].astype(dtype).to_numpy()
+    if 'rating_binary' not in arrays:
+        arrays['rating_binary'] = (arrays['rating'] == 3).astype(np.int8)
+
+    # titles: UTF-8 bytes plus offsets
+    titles = df['title'].fillna('').astype(str).tolist()
+    encoded = [title.encode('utf-8') for title in titles]
+    offsets = np.zeros(n + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(e) for e in encoded])
+    arrays['title_offsets'] = offsets
+    arrays['title_bytes'] = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+
+    # imdbid hash index: slot -> unique key -> run of rows in imdbid order
+    order = np.argsort(arrays['imdbid'], kind='stable')
+    keys, starts, counts = np.unique(arrays['imdbid'][order], return_index=True, return_counts=True)
+    arrays['imdbid_rows'] = order.astype(np.int32)
+    arrays['key_starts'], arrays['key_counts'] = starts.astype(np.int32), counts.astype(np.int32)
+    arrays['hash_keys'], arrays['hash_entries'] = _hash_table(keys)
+
+    # (year, sentiment) order; missing sentiments sort last within their year
+    order = np.lexsort((arrays['sentiment'], arrays['year']))
+    arrays['ys_rows'] = order.astype(np.int32)
+    arrays['ys_year'] = arrays['year'][order]
+    arrays['ys_sentiment'] = arrays['sentiment'][order]
+
+    # titles in sorted order (prefix search) and the trigram postings (substring search)
+    normalized = [normalize_title(title) for title in titles]
+    order = sorted(range(n), key=normalized.__getitem__)
+    arrays['title_order'] = np.array(order, dtype=np.int32)
+    encoded = [normalized[row].encode('utf-8') for row in order]
+    arrays['sorted_title_offsets'] = np.concatenate([[0], np.cumsum([len(e) for e in encoded])]).astype(np.int64)
+    arrays['sorted_title_bytes'] = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+    postings = {}
+    for row, title in enumerate(normalized):
+        for gram in trigrams(title):
+            postings.setdefault(gram, []).append(row)
+    grams = sorted(postings)
+    arrays['trigram_keys'] = np.array(grams, dtype=np.int64)
+    arrays['trigram_offsets'] = np.concatenate([[0], np.cumsum([len(postings[g]) for g in grams])]).astype(np.int64)
+    arrays['trigram_rows'] = np.array([row for g in grams for row in postings[g]], dtype=np.int32)
+
+    os.makedirs(directory, exist_ok=True)
+    for name, array in arrays.items():
+        np.save(os.path.join(directory, f'{name}.npy'), array)
+    with open(os.path.join(directory, 'meta.json'), 'w') as f:
+        json.dump({'rows': n, 'keys': len(keys), 'columns': [c for c in INDEX_COLUMNS if c in arrays], 'built': time.time()}, f)
+
+
+# Function to build the index of the table's current version (if it isn't built yet) and mark it current; returns its directory
+def build_index(table=None, directory=INDEX_DIR):
+    table = open_table() if table is None else table
+    version = table.version
+    target = os.path.join(directory, f'v{version:05d}')
+    if not os.path.exists(target):
+        columns = [c for c in ['title', *INDEX_COLUMNS] if c in table.columns]
+        tmp = f'{target}.tmp{os.getpid()}'
+        _write_index(table.read(columns, version=version), tmp)
+        try:
+            os.replace(tmp, target) # the directory appears complete or not at all
+        except OSError: # another process built the same version first
+            shutil.rmtree(tmp, ignore_errors=True)
+    atomic_write(os.path.join(directory, 'CURRENT'), os.path.basename(target))
+    _prune(directory, keep={os.path.basename(target)})
+    return target
+
+
+# Function to remove old index directories, keeping the newest KEEP_VERSIONS and 'keep'
+def _prune(directory, keep):
+    built = sorted(name for name in os.listdir(directory) if name.startswith('v') and '.tmp' not in name)
+    for name in built[:-KEEP_VERSIONS]:
+        if name not in keep:
+            shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+
+
+class IndexSnapshot:
+    '''
+    The memory-mapped index of one table version.
+    '''
+
+    def __init__(self, path, version):
+        self.path = path
+        self.version = version
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.arrays = {name[:-4]: np.load(os.path.join(path, name), mmap_mode='r') for name in os.listdir(path) if name.endswith('.npy')}
+        self.columns = self.meta['columns']
+        self.bits = int(len(self.arrays['hash_keys'])).bit_length() - 1
+        self.mask = len(self.arrays['hash_keys']) - 1
+
+    def __len__(self):
+        return self.meta['rows']
+
+    def title(self, row):
+        offsets = self.arrays['title_offsets']
+        return bytes(self.arrays['title_bytes'][offsets[row]:offsets[row + 1]]).decode('utf-8')
+
+    # Function to build the result dicts of some rows, gathering each column once
+    def records(self, rows):
+        rows = np.asarray(rows, dtype=np.int64)
+        offsets = self.arrays['title_offsets']
+        starts, ends = offsets[rows].tolist(), offsets[rows + 1].tolist()
+        blob = self.arrays['title_bytes']
+        columns = {'imdbid': [f'tt{imdbid:07d}' for imdbid in self.arrays['imdbid'][rows].tolist()],
+                   'title': [bytes(blob[start:end]).decode('utf-8') for start, end in zip(starts, ends)]}
+        for name in self.columns:
+            if name != 'imdbid':
+                values = self.arrays[name][rows]
+                if values.dtype == np.float32: # shortest repr of the stored float32 (0.8, not 0.800000011920929); missing scores become None
+                    columns[name] = [None if value != value else float(str(value)) for value in values]
+                else:
+                    columns[name] = values.tolist()
+        return [dict(zip(columns, values)) for values in zip(*columns.values())]
+
+    def rows_for(self, imdbid):
+        keys, entries = self.arrays['hash_keys'], self.arrays['hash_entries']
+        slot = ((imdbid * GOLDEN) & MASK64) >> (64 - self.bits)
+        while True:
+            entry = int(entries[slot])
+            if entry == EMPTY:
+                return []
+            if int(keys[slot]) == imdbid:
+                start = int(self.arrays['key_starts'][entry])
+                return [int(row) for row in self.arrays['imdbid_rows'][start:start + int(self.arrays['key_counts'][entry])]]
+            slot = (slot + 1) & self.mask
+
+    # The i-th normalized title in sorted order
+    def sorted_title(self, i):
+        offsets = self.arrays['sorted_title_offsets']
+        return bytes(self.arrays['sorted_title_bytes'][offsets[i]:offsets[i + 1]]).decode('utf-8')
+
+    # Function to find the rows whose normalized title contains 'query' by scanning the sorted titles' blob (every title, for an empty query)
+    def scan_titles(self, query):
+        offsets, order = self.arrays['sorted_title_offsets'], self.arrays['title_order']
+        if not query:
+            return list(range(len(self)))
+        needle = query.encode('utf-8') # UTF-8 is self-synchronizing, so a byte match is a character match
+        blob = bytes(self.arrays['sorted_title_bytes'])
+        starts = np.fromiter((m.start() for m in re.finditer(b'(?=' + re.escape(needle) + b')', blob)), dtype=np.int64) # overlapping matches
+        titles = np.searchsorted(offsets, starts, side='right') - 1
+        inside = starts + len(needle) <= offsets[titles + 1] # drop matches that run into the next title
+        return np.unique(order[titles[inside]]).tolist()
+
+
+class MovieIndex:
+    '''
+    Read-only queries over the latest dataset version. open() loads (building if needed) the index of the table's current version; start() keeps it current.
+    '''
+
+    def __init__(self, table_dir=TABLE_DIR, directory=INDEX_DIR):
+        self.table = open_table(table_dir)
+        self.directory = directory
+        self.snapshot = None
+        self.refreshed = None
+        self._stop = threading.Event()
+        self._thread = None
+        self.refresh()
+
+    @classmethod
+    def open(cls, table_dir=TABLE_DIR, directory=INDEX_DIR):
+        return cls(table_dir, directory)
+
+    # Function to swap in the index of the table's current version if it changed; returns True when it did
+    def refresh(self):
+        version = self.table.version
+        if self.snapshot is not None and self.snapshot.version == version:
+            return False
+        path = build_index(self.table, self.directory)
+        self.snapshot = IndexSnapshot(path, version) # one reference assignment: running queries keep their snapshot
+        self.refreshed = time.time()
+        return True
+
+    def _watch(self, interval):
+        while not self._stop.wait(interval):
+            try:
+                if self.refresh():
+                    print(f"Query index refreshed to table version {self.snapshot.version}")
+            except (OSError, ValueError) as e: # e.g. a version being written right now; try again on the next tick
+                print(f"Query index refresh failed: {e}")
+
+    # Function to start refreshing the index in a background thread whenever the table's HEAD moves
+    def start(self, interval=REFRESH_SECONDS):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._watch, args=(interval,), daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    # Function to look up the rows of an IMDb ID (an int, '0111161' or 'tt0111161')
+    def get(self, imdbid):
+        snapshot = self.snapshot
+        imdbid = int(str(imdbid).lower().removeprefix('tt'))
+        return snapshot.records(snapshot.rows_for(imdbid))
+
+    # Function to find movies by year range (inclusive), sentiment range (inclusive; movies without a score never match a sentiment bound) and
+    # pass/fail, ordered by year then sentiment
+    def movies(self, year_min=None, year_max=None, sentiment_min=None, sentiment_max=None, passing=None, limit=None):
+        snapshot = self.snapshot
+        years, sentiments, rows = snapshot.arrays['ys_year'], snapshot.arrays['ys_sentiment'], snapshot.arrays['ys_rows']
+        lo = 0 if year_min is None else int(np.searchsorted(years, year_min, 'left'))
+        hi = len(years) if year_max is None else int(np.searchsorted(years, year_max, 'right'))
+
+        if sentiment_min is None and sentiment_max is None:
+            selected = rows[lo:hi]
+        else:
+            smin = np.float32(-np.inf if sentiment_min is None else sentiment_min)
+            smax = np.float32(np.inf if sentiment_max is None else sentiment_max)
+            parts, start = [], lo
+            while start < hi: # one run of rows per year, sorted by sentiment within it
+                end = min(hi, int(np.searchsorted(years, years[start], 'right')))
+                run = sentiments[start:end]
+                parts.append(rows[start + int(np.searchsorted(run, smin, 'left')):start + int(np.searchsorted(run, smax, 'right'))])
+                start = end
+            selected = np.concatenate(parts) if parts else rows[0:0]
+
+        if passing is not None:
+            selected = selected[snapshot.arrays['rating_binary'][selected] == int(bool(passing))]
+        if limit is not None:
+            selected = selected[:limit]
+        return snapshot.records(selected)
+
+    # Function to find movies whose title contains 'text' (or starts with it, with prefix=True), case-insensitively
+    def search_title(self, text, prefix=False, limit=20):
+        snapshot = self.snapshot
+        query = normalize_title(text)
+        if prefix:
+            order = snapshot.arrays['title_order']
+            start = bisect_left(range(len(order)), query, key=snapshot.sorted_title)
+            matches = []
+            for i in range(start, min(len(order), start + limit)):
+                if not snapshot.sorted_title(i).startswith(query):
+                    break
+                matches.append(int(order[i]))
+            return snapshot.records(matches)
+        if len(query) < 3: # too short for a trigram: scan the blob of sorted titles
+            return snapshot.records(snapshot.scan_titles(query)[:limit])
+
+        keys, offsets, postings = snapshot.arrays['trigram_keys'], snapshot.arrays['trigram_offsets'], snapshot.arrays['trigram_rows']
+        lists = []
+        for gram in trigrams(query):
+            i = int(np.searchsorted(keys, gram))
+            if i == len(keys) or int(keys[i]) != gram:
+                return []
+            lists.append(postings[offsets[i]:offsets[i + 1]])
+        lists.sort(key=len)
+        candidates = lists[0]
+        for other in lists[1:]:
+            candidates = np.intersect1d(candidates, other, assume_unique=True)
+        # trigrams can all match without the whole string matching, so check each candidate
+        matches = [int(row) for row in candidates if query in normalize_title(snapshot.title(int(row)))]
+        return snapshot.records(matches[:limit])
+
+    def status(self):
+        snapshot = self.snapshot
+        return {'version': snapshot.version, 'rows': len(snapshot), 'index': snapshot.path, 'built': snapshot.meta['built'], 'refreshed': self.refreshed}
+
+
+class _QueryHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        query = {key: values[-1] for key, values in parse_qs(parts.query).items()}
+        start = time.perf_counter()
+        try:
+            status, body = 200, self._answer(parts.path.rstrip('/'), query)
+        except (ValueError, KeyError) as e:
+            status, body = 400, {'error': str(e)}
+        if status == 200 and body is None:
+            status, body = 404, {'error': f'unknown path {parts.path}'}
+        if isinstance(body, list):
+            body = {'results': body, 'count': len(body)}
+        body['seconds'] = time.perf_counter() - start
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _answer(self, path, query):
+        index = self.server.index
+        number = lambda name, cast=float: cast(query[name]) if name in query else None
+        if path.startswith('/movie/'):
+            return index.get(path.rsplit('/', 1)[1])
+        if path == '/movies':
+            passing = query['passing'].lower() in ('1', 'true', 'pass') if 'passing' in query else None
+            return index.movies(number('year_min', int), number('year_max', int), number('sentiment_min'), number('sentiment_max'), passing,
+                                number('limit', int))
+        if path == '/search':
+            return index.search_title(query['title'], prefix=query.get('prefix', '0').lower() in ('1', 'true'), limit=number('limit', int) or 20)
+        if path == '/status':
+            return index.status()
+        return None
+
+    def log_message(self, format, *args):
+        pass
+
+
+# Function to serve an index over HTTP until interrupted
+def serve(index, host=SERVICE_HOST, port=SERVICE_PORT):
+    server = ThreadingHTTPServer((host, port), _QueryHandler)
+    server.daemon_threads = True
+    server.index = index
+    print(f"Serving table version {index.snapshot.version} ({len(index.snapshot)} rows) on http://{host}:{port}/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    index = MovieIndex.open().start()
+    serve(index)
+    index.stop()
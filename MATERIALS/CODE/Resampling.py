@@ -0,0 +1,183 @@
+'''
+Permutation and Bootstrap Resampling
+    The t-test, Mann-Whitney and Spearman p-values rely on asymptotic approximations that our skewed sentiment scores don't satisfy well. This module
+    computes resampling-based p-values and confidence intervals instead, for mean differences and correlations:
+
+    - permutation_mean_diff / bootstrap_mean_diff: difference in mean between two groups (e.g. sentiment of movies passing vs failing)
+    - permutation_correlation / bootstrap_correlation: Pearson or Spearman correlation between two variables (e.g. year vs sentiment)
+
+    Replicates are never computed one at a time in a Python loop. Each block of replicates is drawn as a NumPy index matrix (one row per replicate) and
+    reduced with vectorized operations; blocks are sized to stay under a memory budget. Every block gets its own random stream spawned from one
+    SeedSequence, so results depend only on the seed - not on the block order or the number of worker processes ('workers' > 1 spreads the blocks over a
+    process pool; pass 'executor' to use an existing pool instead, as Pipeline.py does).
+
+    Bootstrap Spearman correlations don't re-sort every replicate. A replicate is described by how many times it drew each observation, and the average
+    (tie-aware) rank of a value in the replicate is the number of drawn values below it plus (its own count + 1) / 2 - a cumulative sum over the distinct
+    values, sorted once up front. The correlation is then the count-weighted Pearson correlation of those ranks: the mean rank is always (n + 1) / 2 and
+    the variances only need the distinct values, so only the cross term touches every observation. This gives the same replicates as running rankdata
+    on every resampled array, without sorting anything per replicate.
+
+    This module requires the numpy and scipy libraries.
+'''
+
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+
+import numpy as np
+
+MEMORY_BUDGET = 64 * 1024 * 1024 # bytes per index matrix
+
+
+# Function to pick how many replicates go in one block so an (rows x n) int64 index matrix stays under the memory budget
+def block_size(n, memory_budget=MEMORY_BUDGET):
+    return int(max(1, min(10000, memory_budget // (8 * max(n, 1)))))
+
+
+# Function to compute the correlation of x with every row of Y (rows are replicates)
+def _rowwise_corr(X, Y):
+    X = X - X.mean(axis=-1, keepdims=True)
+    Y = Y - Y.mean(axis=-1, keepdims=True)
+    denominator = np.sqrt((X * X).sum(axis=-1) * (Y * Y).sum(axis=-1))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (X * Y).sum(axis=-1) / denominator
+
+
+# Block functions: each draws 'size' replicates with the given random generator and returns one statistic per replicate
+
+def _permute_mean_diff(rng, size, pooled, n_x):
+    idx = rng.permuted(np.tile(np.arange(len(pooled)), (size, 1)), axis=1)
+    sum_x = pooled[idx[:, :n_x]].sum(axis=1)
+    return sum_x / n_x - (pooled.sum() - sum_x) / (len(pooled) - n_x)
+
+
+def _bootstrap_mean_diff(rng, size, x, y):
+    mean_x = x[rng.integers(0, len(x), (size, len(x)))].mean(axis=1)
+    mean_y = y[rng.integers(0, len(y), (size, len(y)))].mean(axis=1)
+    return mean_x - mean_y
+
+
+def _permute_corr(rng, size, x, y):
+    idx = rng.permuted(np.tile(np.arange(len(y)), (size, 1)), axis=1)
+    # permuting y changes neither its mean nor its spread, so only the cross product has to be computed per replicate
+    x, y = x - x.mean(), y - y.mean()
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (y[idx] @ x) / np.sqrt((x @ x) * (y @ y))
+
+
+def _bootstrap_corr(rng, size, x, y, method):
+    idx = rng.integers(0, len(x), (size, len(x)))
+    if method == 'spearman': # ranks have to be recomputed within each resample, from how often each observation was drawn
+        n = len(x)
+        counts = np.bincount((idx + n * np.arange(size)[:, np.newaxis]).ravel(), minlength=size * n).reshape(size, n).astype(np.float64)
+        return _counted_spearman(counts, x, y)
+    return _rowwise_corr(x[idx], y[idx])
+
+
+# Function to compute the average rank of every distinct value of x within each replicate, given how many times each replicate drew each observation.
+# Same as rankdata on the resampled array: the number of drawn values below the value plus (the draws of that value + 1) / 2.
+# Returns (draws per distinct value, rank per distinct value, the distinct value of each observation).
+def _replicate_ranks(counts, x):
+    _, groups = np.unique(x, return_inverse=True) # groups of tied values, in increasing order
+    order = np.argsort(groups, kind='stable')
+    starts = np.flatnonzero(np.r_[True, np.diff(groups[order]) != 0])
+    drawn = np.add.reduceat(counts[:, order], starts, axis=1)
+    return drawn, np.cumsum(drawn, axis=1) - drawn + (drawn + 1) / 2, groups
+
+
+# Function to compute the Spearman correlation of every replicate (one row of draw counts per replicate)
+def _counted_spearman(counts, x, y):
+    n = len(x)
+    drawn_x, ranks_x, groups_x = _replicate_ranks(counts, x)
+    drawn_y, ranks_y, groups_y = _replicate_ranks(counts, y)
+    mean = (n + 1) / 2 # ranks always average (n + 1) / 2
+    var_x = (drawn_x * ranks_x * ranks_x).sum(axis=1) - n * mean * mean
+    var_y = (drawn_y * ranks_y * ranks_y).sum(axis=1) - n * mean * mean
+    cov = np.einsum('ij,ij->i', counts * ranks_x[:, groups_x], ranks_y[:, groups_y]) - n * mean * mean
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return cov / np.sqrt(var_x * var_y)
+
+
+# Function to run one block of replicates from its own seed
+def _run_block(args):
+    func, seed, size, data = args
+    return func(np.random.default_rng(seed), size, *data)
+
+
+# Function to draw n_resamples replicates of a block function, in blocks of at most 'size', optionally across worker processes ('workers' new ones, or
+# the given executor's)
+def resample(func, data, n_resamples, size, seed=0, workers=1, executor=None):
+    n_blocks = -(-n_resamples // size)
+    seeds = np.random.SeedSequence(seed).spawn(n_blocks)
+    sizes = [min(size, n_resamples - i * size) for i in range(n_blocks)]
+    tasks = [(func, s, n, data) for s, n in zip(seeds, sizes)]
+    if executor is not None or workers > 1:
+        with nullcontext(executor) if executor is not None else ProcessPoolExecutor(max_workers=workers) as pool:
+            blocks = list(pool.map(_run_block, tasks))
+    else:
+        blocks = [_run_block(task) for task in tasks]
+    return np.concatenate(blocks)
+
+
+# Function to compute a two-sided permutation p-value: the share of replicates at least as extreme as the observed statistic
+def permutation_p_value(replicates, observed):
+    return (np.count_nonzero(np.abs(replicates) >= abs(observed) - 1e-12) + 1) / (len(replicates) + 1)
+
+
+# Function to compute a percentile confidence interval from bootstrap replicates
+def percentile_ci(replicates, confidence=0.95):
+    alpha = (1 - confidence) / 2
+    low, high = np.nanquantile(replicates, [alpha, 1 - alpha])
+    return float(low), float(high)
+
+
+def _as_array(values):
+    return np.asarray(values, dtype=np.float64)
+
+
+def _correlation(x, y, method):
+    if method == 'spearman':
+        from scipy.stats import rankdata
+        x, y = rankdata(x), rankdata(y)
+    return float(_rowwise_corr(x, y)), x, y
+
+
+# Permutation test of the difference in means between two groups (two-sided)
+def permutation_mean_diff(x, y, n_resamples=10000, seed=0, workers=1, executor=None):
+    start = time.perf_counter()
+    x, y = _as_array(x), _as_array(y)
+    pooled = np.concatenate([x, y])
+    observed = x.mean() - y.mean()
+    replicates = resample(_permute_mean_diff, (pooled, len(x)), n_resamples, block_size(len(pooled)), seed, workers, executor)
+    return {'statistic': float(observed), 'p_value': float(permutation_p_value(replicates, observed)), 'n_resamples': n_resamples,
+            'seconds': time.perf_counter() - start}
+
+
+# Bootstrap confidence interval for the difference in means between two groups
+def bootstrap_mean_diff(x, y, n_resamples=10000, confidence=0.95, seed=0, workers=1, executor=None):
+    start = time.perf_counter()
+    x, y = _as_array(x), _as_array(y)
+    replicates = resample(_bootstrap_mean_diff, (x, y), n_resamples, block_size(len(x) + len(y)), seed, workers, executor)
+    ci_low, ci_high = percentile_ci(replicates, confidence)
+    return {'statistic': float(x.mean() - y.mean()), 'ci_low': ci_low, 'ci_high': ci_high, 'confidence': confidence,
+            'n_resamples': n_resamples, 'seconds': time.perf_counter() - start}
+
+
+# Permutation test of a correlation ('pearson' or 'spearman'; two-sided)
+def permutation_correlation(x, y, method='spearman', n_resamples=10000, seed=0, workers=1, executor=None):
+    start = time.perf_counter()
+    observed, x, y = _correlation(_as_array(x), _as_array(y), method)
+    replicates = resample(_permute_corr, (x, y), n_resamples, block_size(len(x)), seed, workers, executor)
+    return {'statistic': observed, 'p_value': float(permutation_p_value(replicates, observed)), 'method': method,
+            'n_resamples': n_resamples, 'seconds': time.perf_counter() - start}
+
+
+# Bootstrap confidence interval for a correlation ('pearson' or 'spearman')
+def bootstrap_correlation(x, y, method='spearman', n_resamples=10000, confidence=0.95, seed=0, workers=1, executor=None):
+    start = time.perf_counter()
+    x, y = _as_array(x), _as_array(y)
+    observed = _correlation(x, y, method)[0]
+    replicates = resample(_bootstrap_corr, (x, y, method), n_resamples, block_size(2 * len(x)), seed, workers, executor)
+    ci_low, ci_high = percentile_ci(replicates, confidence)
+    return {'statistic': observed, 'ci_low': ci_low, 'ci_high': ci_high, 'confidence': confidence, 'method': method,
+            'n_resamples': n_resamples, 'seconds': time.perf_counter() - start}
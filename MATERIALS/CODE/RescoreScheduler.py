@@ -0,0 +1,203 @@
+'''
+Freshness-Aware Rescoring Scheduler
+    Re-scraping every movie on every run mostly re-downloads reviews of old titles that haven't changed in years. This module keeps track of what was
+    fetched for each movie and decides which movies are worth fetching again:
+
+    - FreshnessTracker keeps, per IMDb ID, when the movie's reviews were last fetched, how many reviews were on the fetched pages, a hash of their
+      content, how many pages that took, and the movie's review churn (new reviews per day, a moving average over the fetches that found new or
+      changed reviews). The state is saved in './DATA/freshness.json'.
+    - plan_refresh() estimates each movie's staleness, the share of its reviews that are probably new since it was last fetched:
+
+          expected new reviews = review rate * days since the last fetch
+          staleness            = expected new / (expected new + reviews seen at the last fetch)
+
+      The review rate is the observed churn once a movie has been fetched twice. Before that it is a prior that halves every 'RELEASE_HALF_LIFE_YEARS'
+      after the release year, starting from 'NEW_RELEASE_RATE' reviews per day for a movie released this year. It is multiplied by 'ADDED_BOOST' for
+      movies added to bechdeltest.com in the last 'ADDED_WINDOW_DAYS' days.
+      Movies that were never fetched are always fetched: they have no score yet, so the budget doesn't apply to them. The budget only limits
+      re-fetching: movies that were fetched before are taken in order of staleness until the per-run request budget is spent (a movie costs as many
+      requests as pages it needed last time).
+
+    Every movie that is not refreshed gets a reason: 'fresh' (staleness below 'MIN_STALENESS') or 'over budget'. The plan, with a count per reason and
+    the most stale skipped movies, is printed and written to './OUTPUT/rescore_plan.json'. Movies that were scored before the tracker existed are seeded
+    from the checkpoint (fetched when the checkpoint was last written, with their review count from the review store).
+
+    IMDbReviewSentiment.py uses the scheduler on every run: it fetches the movies in the plan (every new movie, plus 'REQUEST_BUDGET' requests of
+    re-fetching), and records what it found for each of them.
+
+    This module requires the pandas and numpy libraries.
+'''
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+from Checkpoint import atomic_write
+from ReviewStore import iter_segments
+
+FRESHNESS_PATH = './DATA/freshness.json'
+PLAN_REPORT_PATH = './OUTPUT/rescore_plan.json'
+
+MIN_STALENESS = 0.05 # movies whose expected share of unseen reviews is below this are left alone
+NEW_RELEASE_RATE = 2.0 # prior: new reviews per day for a movie released this year
+RELEASE_HALF_LIFE_YEARS = 1.5 # the prior halves every this many years after release
+FLOOR_RATE = 0.002 # no movie is assumed to get fewer new reviews per day than this (about one every 18 months)
+ADDED_WINDOW_DAYS = 30 # movies added to bechdeltest.com this recently ...
+ADDED_BOOST = 3.0 # ... are assumed to get this many times more reviews
+CHURN_SMOOTHING = 0.5 # weight of the newest observation in the churn moving average
+SECONDS_PER_DAY = 86400.0
+
+
+class FreshnessTracker:
+    '''
+    Per-movie fetch history: last fetch time, review count, content hash, pages and churn. observe() is called for every fetched page (from the fetch
+    threads), finish() once the movie is done, and save() writes the state.
+    '''
+
+    def __init__(self, path=FRESHNESS_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.pages = {} # imdbid -> [pages fetched, reviews seen, content digest] for the movies of the current run
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                self.state = json.load(f)
+        else:
+            self.state = {}
+
+    # Function to record one fetched page of a movie's reviews (all reviews on the page, not only the new ones)
+    def observe(self, imdbid, reviews):
+        with self.lock:
+            pages = self.pages.setdefault(str(imdbid), [0, 0, hashlib.blake2b(digest_size=16)])
+            pages[0] += 1
+            pages[1] += len(reviews)
+            for review in reviews:
+                pages[2].update(review.encode('utf-8'))
+                pages[2].update(b'\0')
+
+    # Function to record that a movie was fetched, with the number of reviews that weren't in the review store yet. Returns the movie's new state.
+    def finish(self, imdbid, new_reviews, now=None):
+        now = time.time() if now is None else now
+        with self.lock:
+            pages, count, digest = self.pages.pop(str(imdbid), [1, 0, hashlib.blake2b(digest_size=16)])
+            content_hash = digest.hexdigest()
+            previous = self.state.get(str(imdbid))
+            churn = None
+            if previous is not None:
+                changed = new_reviews or previous.get('content_hash') not in (None, content_hash) # seeded movies have no hash to compare
+                days = max((now - previous['fetched_at']) / SECONDS_PER_DAY, 1 / 24) # at least an hour, so back-to-back runs don't explode the rate
+                observed = max(new_reviews, 1 if changed else 0) / days
+                churn = observed if previous.get('churn') is None else CHURN_SMOOTHING * observed + (1 - CHURN_SMOOTHING) * previous['churn']
+            self.state[str(imdbid)] = {'fetched_at': now, 'review_count': count, 'content_hash': content_hash, 'pages': pages, 'churn': churn,
+                                       'fetches': (previous or {}).get('fetches', 0) + 1}
+            return self.state[str(imdbid)]
+
+    # Function to forget the pages of a movie whose fetch failed (it keeps its previous state)
+    def discard(self, imdbid):
+        with self.lock:
+            self.pages.pop(str(imdbid), None)
+
+    # Function to add movies that were scored before the tracker existed: fetched when the checkpoint was last written, with the number of reviews the
+    # review store holds for them
+    def seed(self, checkpoint, store):
+        untracked = [imdbid for imdbid in checkpoint.completed if str(imdbid) not in self.state]
+        if not untracked:
+            return 0
+        fetched_at = os.path.getmtime(checkpoint.manifest_path) if os.path.exists(checkpoint.manifest_path) else time.time()
+        counts = pd.Series(dtype=np.int64)
+        for segment in iter_segments(store.directory, ['imdbid']): # one segment at a time
+            counts = counts.add(pd.Series(segment['imdbid']).value_counts(), fill_value=0)
+        with self.lock:
+            for imdbid in untracked:
+                self.state[str(imdbid)] = {'fetched_at': fetched_at, 'review_count': int(counts.get(int(imdbid), 0)), 'content_hash': None, 'pages': 1,
+                                           'churn': None, 'fetches': 0}
+        return len(untracked)
+
+    def save(self):
+        with self.lock:
+            text = json.dumps(self.state)
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        atomic_write(self.path, text)
+
+
+class RefreshPlan:
+    '''
+    The result of plan_refresh(): 'selected' lists the IMDb IDs to fetch, most stale first, and 'movies' has one row per movie with its staleness,
+    estimated cost in requests, and 'reason' ('never fetched' or 'stale' for selected movies, 'fresh' or 'over budget' for skipped ones).
+    '''
+
+    def __init__(self, movies, budget):
+        self.movies = movies
+        self.budget = budget
+        self.selected = movies.index[movies['selected']].tolist()
+
+    def skipped(self):
+        return self.movies.loc[~self.movies['selected']]
+
+    def report(self, top=20):
+        skipped = self.skipped().sort_values('staleness', ascending=False)
+        return {
+            'budget': self.budget,
+            'movies': len(self.movies),
+            'selected': len(self.selected),
+            'requests': int(self.movies.loc[self.movies['selected'], 'cost'].sum()),
+            'refetch_requests': int(self.movies.loc[self.movies['selected'] & ~self.movies['never'], 'cost'].sum()),
+            'reasons': {reason: int(count) for reason, count in self.movies['reason'].value_counts().items()},
+            'most_stale_skipped': [{'imdbid': imdbid, 'reason': row['reason'], 'staleness': round(float(row['staleness']), 4),
+                                    'days_since_fetch': None if pd.isna(row['days']) else round(float(row['days']), 1)}
+                                   for imdbid, row in skipped.head(top).iterrows()],
+        }
+
+    def summary(self):
+        report = self.report()
+        reasons = ', '.join(f"{count} {reason}" for reason, count in report['reasons'].items())
+        return (f"Refreshing {report['selected']} of {report['movies']} movies (~{report['requests']} requests, {report['refetch_requests']} of them "
+                f"re-fetching within a budget of {'unlimited' if self.budget is None else self.budget}): {reasons}")
+
+    # Function to write the report to a JSON file
+    def save(self, path=PLAN_REPORT_PATH):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        atomic_write(path, json.dumps(self.report(), indent=2))
+        return path
+
+
+# Function to estimate new reviews per day for movies without observed churn, from their release year
+def prior_rate(year, now):
+    this_year = pd.Timestamp(now, unit='s').year
+    rate = NEW_RELEASE_RATE * 0.5 ** (np.clip(this_year - year, 0, None) / RELEASE_HALF_LIFE_YEARS)
+    return np.maximum(rate, FLOOR_RATE)
+
+
+# Function to plan which movies of df ('imdbid', 'year' and 'date' - when the movie was added to bechdeltest.com) to fetch this run: every movie that
+# was never fetched, and the most stale of the others within 'budget' requests (None: no limit)
+def plan_refresh(df, tracker, budget=None, now=None, min_staleness=MIN_STALENESS):
+    now = time.time() if now is None else now
+    movies = df.drop_duplicates('imdbid')
+    movies = movies.set_index(movies['imdbid'].astype(str))
+    state = pd.DataFrame.from_dict(tracker.state, orient='index', columns=['fetched_at', 'review_count', 'pages', 'churn']).reindex(movies.index)
+
+    year = pd.to_numeric(movies['year'], errors='coerce').to_numpy(dtype=np.float64)
+    added = pd.to_datetime(movies['date'], errors='coerce') if 'date' in movies else pd.Series(pd.NaT, index=movies.index)
+    added_days = (pd.Timestamp(now, unit='s') - added).dt.total_seconds().to_numpy() / SECONDS_PER_DAY
+
+    churn = state['churn'].to_numpy(dtype=np.float64)
+    rate = np.where(np.isnan(churn), prior_rate(np.nan_to_num(year, nan=1900), now), np.maximum(churn, FLOOR_RATE))
+    rate = rate * np.where(added_days <= ADDED_WINDOW_DAYS, ADDED_BOOST, 1.0) # NaT compares False
+
+    days = (now - state['fetched_at'].to_numpy(dtype=np.float64)) / SECONDS_PER_DAY
+    never = np.isnan(days)
+    expected = rate * np.nan_to_num(days)
+    staleness = np.where(never, 1.0, expected / (expected + np.maximum(state['review_count'].fillna(0).to_numpy(dtype=np.float64), 1)))
+
+    plan = pd.DataFrame({'staleness': staleness, 'days': days, 'rate': rate, 'cost': state['pages'].fillna(1).clip(lower=1).to_numpy(dtype=np.int64),
+                         'never': never}, index=movies.index)
+    plan = plan.sort_values(['never', 'staleness'], ascending=False, kind='stable')
+    stale = ~plan['never'] & (plan['staleness'] >= min_staleness)
+    candidates = plan['never'] | stale
+    spent = plan['cost'].where(stale, 0).cumsum() # the budget is only spent on re-fetching
+    plan['selected'] = plan['never'] | (stale & (spent <= budget if budget is not None else True))
+    plan['reason'] = np.select([plan['selected'] & plan['never'], plan['selected'], ~candidates], ['never fetched', 'stale', 'fresh'], 'over budget')
+    return RefreshPlan(plan, budget)
@@ -0,0 +1,181 @@
+'''
+Persistent HTTP Response Cache
+    This module provides an on-disk cache of HTTP responses that is shared by the scrapers (IMDbReviewSentiment.py and ScrapeNewBechdel.py) through the
+    FetchEngine. Responses are stored in a single SQLite file: each URL maps to an entry holding its ETag/Last-Modified validators and the hash of its body,
+    and bodies are stored once per content hash, zlib-compressed. This way re-running a script after a crash, or after changing the sentiment logic, reads
+    pages from disk instead of downloading thousands of them again.
+
+    - Entries younger than 'ttl' seconds are served straight from disk.
+    - Older entries are revalidated with If-None-Match/If-Modified-Since, so an unchanged page costs a 304 with no body.
+    - When the cache grows past 'max_bytes' the least recently used entries are evicted one by one, and each body is deleted as soon as no entry refers
+      to it any more, so eviction costs a few indexed lookups per entry rather than a scan of the cache.
+
+    This module only uses the Python standard library.
+'''
+
+import hashlib
+import sqlite3
+import threading
+import time
+import zlib
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS bodies (
+    digest TEXT PRIMARY KEY,
+    data BLOB NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    digest TEXT NOT NULL REFERENCES bodies(digest),
+    status INTEGER NOT NULL,
+    content_type TEXT,
+    etag TEXT,
+    last_modified TEXT,
+    fetched_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_accessed ON entries(accessed_at);
+CREATE INDEX IF NOT EXISTS entries_digest ON entries(digest);
+'''
+EVICT_BATCH = 256 # least recently used entries read per query while evicting
+
+
+# Function to turn a URL into the cache key
+def url_key(url):
+    return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+
+class CacheEntry:
+    '''A cached response: the raw body plus the headers needed to rebuild and revalidate it.'''
+
+    def __init__(self, url, body, status, content_type, etag, last_modified, fetched_at):
+        self.url = url
+        self.body = body
+        self.status = status
+        self.content_type = content_type
+        self.etag = etag
+        self.last_modified = last_modified
+        self.fetched_at = fetched_at
+
+    def age(self, now=None):
+        return (now or time.time()) - self.fetched_at
+
+    # Conditional request headers for revalidating this entry
+    def validators(self):
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+class ResponseCache:
+    '''
+    SQLite-backed response cache. A single connection is shared between the fetch threads and guarded by a lock.
+    '''
+
+    def __init__(self, path='./DATA/http_cache.sqlite', ttl=7 * 24 * 3600, max_bytes=512 * 1024 * 1024):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript(SCHEMA)
+        self.total_bytes = self.size()  # running total so eviction doesn't rescan the table on every put
+        self._drop_orphans() # bodies left behind by older versions of the cache; from here on put() and _evict() release bodies as they go
+        self.conn.commit()
+        self.hits = 0 # lookups answered by a fresh entry; the counters are only updated under the lock, since engine threads share the cache
+        self.misses = 0
+        self.revalidated = 0
+
+    # Look up a URL; returns a CacheEntry (fresh or stale) or None, counting a hit when the entry is fresh and a miss when there is none
+    def get(self, url):
+        key = url_key(url)
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT e.url, b.data, e.status, e.content_type, e.etag, e.last_modified, e.fetched_at '
+                'FROM entries e JOIN bodies b ON b.digest = e.digest WHERE e.key = ?', (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            if time.time() - row[6] < self.ttl:
+                self.hits += 1
+            self.conn.execute('UPDATE entries SET accessed_at = ? WHERE key = ?', (time.time(), key))
+            self.conn.commit()
+        return CacheEntry(row[0], zlib.decompress(row[1]), *row[2:])
+
+    def is_fresh(self, entry):
+        return entry.age() < self.ttl
+
+    # Store a response body for a URL, replacing any previous entry
+    def put(self, url, body, status=200, content_type=None, etag=None, last_modified=None):
+        digest = hashlib.sha256(body).hexdigest()
+        key = url_key(url)
+        now = time.time()
+        with self.lock:
+            data = zlib.compress(body, 6)
+            inserted = self.conn.execute('INSERT OR IGNORE INTO bodies (digest, data, size) VALUES (?, ?, ?)',
+                                         (digest, data, len(body))).rowcount
+            self.total_bytes += len(data) if inserted else 0
+            previous = self.conn.execute('SELECT digest FROM entries WHERE key = ?', (key,)).fetchone()
+            self.conn.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                              (key, url, digest, status, content_type, etag, last_modified, now, now))
+            if previous is not None and previous[0] != digest: # the replaced body may not be used by any other URL
+                self._release(previous[0])
+            self._evict()
+            self.conn.commit()
+
+    # Mark an entry as fresh again after the server answered 304 Not Modified
+    def touch(self, url):
+        now = time.time()
+        with self.lock:
+            self.conn.execute('UPDATE entries SET fetched_at = ?, accessed_at = ? WHERE key = ?', (now, now, url_key(url)))
+            self.conn.commit()
+            self.revalidated += 1
+
+    # Total compressed size of the stored bodies
+    def size(self):
+        return self.conn.execute('SELECT COALESCE(SUM(LENGTH(data)), 0) FROM bodies').fetchone()[0]
+
+    # Drop least recently used entries until the cache fits in max_bytes, releasing each one's body as it goes (caller holds the lock)
+    def _evict(self):
+        while self.total_bytes > self.max_bytes:
+            rows = self.conn.execute('SELECT key, digest FROM entries ORDER BY accessed_at LIMIT ?', (EVICT_BATCH,)).fetchall()
+            if not rows:
+                break
+            for key, digest in rows:
+                self.conn.execute('DELETE FROM entries WHERE key = ?', (key,))
+                self._release(digest)
+                if self.total_bytes <= self.max_bytes:
+                    break
+
+    # Delete a body if no entry refers to it any more and take its size off the running total (caller holds the lock)
+    def _release(self, digest):
+        row = self.conn.execute('SELECT LENGTH(data) FROM bodies WHERE digest = ? AND NOT EXISTS (SELECT 1 FROM entries WHERE digest = ?)',
+                                (digest, digest)).fetchone()
+        if row is not None:
+            self.conn.execute('DELETE FROM bodies WHERE digest = ?', (digest,))
+            self.total_bytes -= row[0]
+
+    # Delete every body no longer referenced by any entry and take their sizes off the running total, in one pass (caller holds the lock)
+    def _drop_orphans(self):
+        orphaned = 'NOT EXISTS (SELECT 1 FROM entries WHERE entries.digest = bodies.digest)'
+        self.total_bytes -= self.conn.execute(f'SELECT COALESCE(SUM(LENGTH(data)), 0) FROM bodies WHERE {orphaned}').fetchone()[0]
+        self.conn.execute(f'DELETE FROM bodies WHERE {orphaned}')
+
+    # Remove entries that have not been fetched or revalidated for 'max_age' seconds
+    def purge_expired(self, max_age):
+        with self.lock:
+            self.conn.execute('DELETE FROM entries WHERE fetched_at < ?', (time.time() - max_age,))
+            self._drop_orphans()
+            self.conn.commit()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'revalidated': self.revalidated, 'bytes': self.total_bytes}
+
+    def close(self):
+        self.conn.close()
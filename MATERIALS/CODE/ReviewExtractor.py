@@ -0,0 +1,112 @@
+'''
+IMDb Review Extractors
+    This module pulls the review texts out of an IMDb reviews page. Building a complete BeautifulSoup tree for every page just to find the review divs costs
+    a large share of the CPU time and memory per movie, so the extraction is pluggable:
+    - 'soup':     the original approach, a full BeautifulSoup(html, 'html.parser') tree searched with find_all
+    - 'strainer': BeautifulSoup restricted by a SoupStrainer, so only the review divs are turned into tree nodes
+    - 'stream':   an incremental tokenizer (html.parser.HTMLParser) that never builds a tree and only keeps the text inside review divs
+    All extractors return the same list of strings as the original find_all(...)/get_text() code, plus the continuation key of IMDb's "load more" button
+    (the 'data-key' of div.load-more-data, or None on the last page). BenchmarkExtractors.py checks this on the saved fixture pages in './FIXTURES/imdb/'
+    and times each one.
+
+    The 'stream' extractor only uses the Python standard library; the other two require BeautifulSoup.
+'''
+
+from html.parser import HTMLParser
+
+# Class attribute of the div that holds the text of one review
+REVIEW_CLASS = 'text show-more__control'
+
+# Class attribute of the div that carries the "load more" continuation key
+LOAD_MORE_CLASS = 'load-more-data'
+
+
+# Function to normalize a class attribute the same way BeautifulSoup compares multi-valued attributes
+def _class_string(value):
+    return ' '.join((value or '').split())
+
+
+class _ReviewParser(HTMLParser):
+    '''Tokenizer that records the text inside review divs, tracking div nesting so inner divs don't end a review early.'''
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.reviews = []
+        self.parts = None # text pieces of the review currently open, or None outside a review
+        self.depth = 0 # div nesting depth inside the current review
+        self.next_key = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag != 'div':
+            return
+        if self.parts is not None:
+            self.depth += 1
+            return
+        attrs = dict(attrs)
+        css_class = _class_string(attrs.get('class'))
+        if css_class == REVIEW_CLASS:
+            self.parts = []
+            self.depth = 0
+        elif LOAD_MORE_CLASS in css_class.split() and self.next_key is None:
+            self.next_key = attrs.get('data-key') or None
+
+    def handle_endtag(self, tag):
+        if tag != 'div' or self.parts is None:
+            return
+        if self.depth:
+            self.depth -= 1
+        else:
+            self.reviews.append(''.join(self.parts))
+            self.parts = None
+
+    def handle_data(self, data):
+        if self.parts is not None:
+            self.parts.append(data)
+
+    def close(self):
+        super().close()
+        if self.parts is not None: # unterminated review div at the end of the page
+            self.reviews.append(''.join(self.parts))
+            self.parts = None
+
+
+def extract_stream(html):
+    parser = _ReviewParser()
+    parser.feed(html)
+    parser.close()
+    return parser.reviews, parser.next_key
+
+
+# Function to read the continuation key from a parsed BeautifulSoup tree
+def _soup_next_key(soup):
+    load_more = soup.find('div', class_=LOAD_MORE_CLASS)
+    return (load_more.get('data-key') or None) if load_more is not None else None
+
+
+def extract_soup(html):
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(html, 'html.parser')
+    return [review.get_text() for review in soup.find_all('div', class_=REVIEW_CLASS)], _soup_next_key(soup)
+
+
+def extract_strainer(html):
+    from bs4 import BeautifulSoup, SoupStrainer
+    soup = BeautifulSoup(html, 'html.parser', parse_only=SoupStrainer('div', class_=[REVIEW_CLASS, LOAD_MORE_CLASS]))
+    return [review.get_text() for review in soup.find_all('div', class_=REVIEW_CLASS)], _soup_next_key(soup)
+
+
+EXTRACTORS = {
+    'soup': extract_soup,
+    'strainer': extract_strainer,
+    'stream': extract_stream,
+}
+
+
+# Function to extract the review texts and the continuation key (or None) from a reviews page with the named extractor
+def extract_page(html, method='stream'):
+    return EXTRACTORS[method](html)
+
+
+# Function to extract only the review texts from a reviews page
+def extract_reviews(html, method='stream'):
+    return extract_page(html, method)[0]
@@ -0,0 +1,148 @@
+'''
+Review-Level Sentiment Store
+    Instead of reducing each movie to a single mean compound score, this module keeps every scraped review and its individual VADER scores, so a different
+    aggregation (median, trimmed mean, ...) can be computed without re-scraping IMDb. The store is a directory of compact columnar segments:
+
+    - texts.bin: the raw review texts, UTF-8 encoded and appended one after another
+    - segment-NNNNN.npz: one segment per flush, with the columns imdbid (int64), review_hash (uint64), text_offset (int64), text_length (int32), and
+      neg, neu, pos, compound (float32)
+
+    A review is identified by a 64-bit hash of its IMDb ID and text, so reviews that were already scored are skipped and new ones are folded in
+    incrementally without rescoring the old ones. Movie-level aggregates are computed with vectorized pandas group-bys over the columns.
+
+    This module requires the numpy and pandas libraries.
+'''
+
+import glob
+import hashlib
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+SCORE_COLUMNS = ['neg', 'neu', 'pos', 'compound']
+
+
+# Function to compute the 64-bit hash identifying a review of a given movie
+def review_hash(imdbid, text):
+    return int.from_bytes(hashlib.blake2b(f'{int(imdbid)}:{text}'.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+# Function to list the segment files of a store directory in the order they were written
+def segment_paths(directory):
+    return sorted(glob.glob(os.path.join(directory, 'segment-*.npz')))
+
+
+# Function to read the segments of a store directory one at a time (only the requested columns), without loading the whole store into memory
+def iter_segments(directory, columns=None):
+    for path in segment_paths(directory):
+        with np.load(path) as segment:
+            yield {name: segment[name] for name in (columns or segment.files)}
+
+
+# Function to compute the trimmed mean of each group, dropping floor(proportion * n) values from each end of a group of n (same as
+# scipy.stats.trim_mean, vectorized over all groups at once). Groups that would be trimmed away entirely fall back to the plain mean.
+def grouped_trimmed_mean(frame, by, column, proportion=0.1):
+    grouped = frame.groupby(by)[column]
+    ranks = grouped.rank(method='first') - 1 # 0-based position in the sorted group
+    sizes = grouped.transform('size')
+    cut = np.floor(proportion * sizes)
+    kept = frame[(ranks >= cut) & (ranks < sizes - cut)]
+    return kept.groupby(by)[column].mean().reindex(grouped.mean().index).fillna(grouped.mean())
+
+
+class ReviewStore:
+    '''
+    Append-only columnar store of scored reviews. Call add() for each movie and flush() to write the buffered reviews as a new segment.
+    '''
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.texts_path = os.path.join(directory, 'texts.bin')
+        self.lock = threading.Lock()
+        self.segments = list(iter_segments(directory))
+        self.known = set()
+        for segment in self.segments:
+            self.known.update(segment['review_hash'].tolist())
+        self.buffer = [] # (imdbid, hash, text, scores) tuples waiting for the next flush
+        self._frame = None # cached concatenation of all segments
+        self._compounds = None # imdbid -> compound scores of its flushed reviews, built on the first compounds() call
+
+    def __len__(self):
+        return len(self.known)
+
+    # Return only the reviews of a movie that are not in the store yet (safe to call from fetch threads)
+    def new_reviews(self, imdbid, reviews):
+        with self.lock:
+            return [review for review in reviews if review_hash(imdbid, review) not in self.known]
+
+    # Buffer the reviews of one movie with their (neg, neu, pos, compound) scores
+    def add(self, imdbid, reviews, scores):
+        with self.lock:
+            for text, score in zip(reviews, scores):
+                h = review_hash(imdbid, text)
+                if h not in self.known:
+                    self.known.add(h)
+                    self.buffer.append((int(imdbid), h, text, score))
+
+    # Write the buffered reviews as one new segment; texts are appended to texts.bin
+    def flush(self):
+        with self.lock:
+            if not self.buffer:
+                return
+            encoded = [text.encode('utf-8') for _, _, text, _ in self.buffer]
+            with open(self.texts_path, 'ab') as f:
+                start = f.tell()
+                f.write(b''.join(encoded))
+            lengths = np.array([len(e) for e in encoded], dtype=np.int32)
+            scores = np.array([score for _, _, _, score in self.buffer], dtype=np.float32).reshape(-1, 4)
+            segment = {
+                'imdbid': np.array([row[0] for row in self.buffer], dtype=np.int64),
+                'review_hash': np.array([row[1] for row in self.buffer], dtype=np.uint64),
+                'text_offset': start + np.concatenate(([0], np.cumsum(lengths[:-1], dtype=np.int64))),
+                'text_length': lengths,
+                **{name: scores[:, i] for i, name in enumerate(SCORE_COLUMNS)},
+            }
+            path = os.path.join(self.directory, f'segment-{len(self.segments):05d}.npz')
+            np.savez(path + '.tmp.npz', **segment)
+            os.replace(path + '.tmp.npz', path)
+            self.segments.append(segment)
+            self.buffer = []
+            self._frame = None
+            if self._compounds is not None: # fold the new segment into the per-movie index instead of rebuilding it
+                for imdbid, compounds in pd.Series(segment['compound']).groupby(segment['imdbid']):
+                    self._compounds[imdbid] = np.concatenate([self._compounds.get(imdbid, np.empty(0, np.float32)), compounds.to_numpy()])
+
+    # All flushed reviews as one DataFrame (without the texts)
+    def frame(self):
+        if self._frame is None:
+            if self.segments:
+                self._frame = pd.DataFrame({name: np.concatenate([s[name] for s in self.segments]) for name in self.segments[0]})
+            else:
+                self._frame = pd.DataFrame({name: pd.Series(dtype=np.float32) for name in ['imdbid'] + SCORE_COLUMNS})
+        return self._frame
+
+    # Compound scores of the flushed reviews of one movie (safe to call from the scoring loop while other movies are added)
+    def compounds(self, imdbid):
+        with self.lock:
+            if self._compounds is None:
+                frame = self.frame()
+                self._compounds = {imdbid: group.to_numpy() for imdbid, group in frame['compound'].groupby(frame['imdbid'])}
+            return self._compounds.get(int(imdbid), np.empty(0, np.float32))
+
+    # Read back the text of a review from its offset and length
+    def text(self, offset, length):
+        with open(self.texts_path, 'rb') as f:
+            f.seek(offset)
+            return f.read(length).decode('utf-8')
+
+    # Movie-level aggregates of one score column; 'how' is 'mean', 'median', 'std', 'count' or 'trimmed_mean'
+    def aggregate(self, how='mean', column='compound', imdbids=None, trim=0.1):
+        reviews = self.frame()
+        if imdbids is not None:
+            reviews = reviews[reviews['imdbid'].isin([int(i) for i in imdbids])]
+        if how == 'trimmed_mean':
+            return grouped_trimmed_mean(reviews, 'imdbid', column, trim)
+        return reviews.groupby('imdbid')[column].agg(how)
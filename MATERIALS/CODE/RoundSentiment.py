@@ -1,22 +1,25 @@
 '''
 Round Sentiment Scores in Bechdel Dataset
   Running this script will result in loading a dataset of movies including sentiment scores from IMDb reviews. For clean presentation, each sentiment score is rounded to 2
-  decimal places. Additionally, the updated dataset is saved to a new CSV file, 'bechdel_movies_with_sentiment.csv'. You can also choose to print the first few rows of the new
-  dataset to confirm that the proper changes were made.
+  decimal places. You can also choose to print the first few rows of the dataset to confirm that the proper changes were made.
+
+  Rounding is a view applied when the data is presented: the stored scores keep their full precision, so nothing in the dataset is rewritten and the analyses
+  run on the unrounded values. Use round_sentiment() on any frame before printing or exporting it.
 
   This script only requires the pandas library.
 '''
 
-import pandas as pd
+from BechdelData import load_movies
+
 
-# Load the dataset that contains the sentiment scores and movie data
-df = pd.read_csv('./DATA/bechdel_movies_with_sentiment.csv')
+# Function to round the sentiment column to two decimal places for display (returns a copy; the input frame is unchanged)
+def round_sentiment(df, decimals=2):
+    return df.assign(sentiment=df['sentiment'].round(decimals))
 
-# Round the sentiment column to two decimal places
-df['sentiment'] = df['sentiment'].round(2)
 
-# Save the updated dataframe to a new CSV file - overwrite the old file
-df.to_csv('./DATA/bechdel_movies_with_sentiment.csv', index=False)
+if __name__ == '__main__':
+    # Load the dataset that contains the sentiment scores and movie data
+    df = load_movies(clean=False)
 
-# Optional: Preview the first few rows to confirm changes
-print(df.head())
+    # Optional: Preview the first few rows, rounded
+    print(round_sentiment(df).head())
@@ -1,105 +1,181 @@
 '''
 IMDb Bechdel Test Movies Scraper and Dataset Merger
-    The purpose of this script is to scrape newer data from the Bechdel test website, checking for movies that were added after the most recent date in a preexisting dataset, 
-    efficiently combining the new and old datasets into a more robust dataset. It can scrape up to 3 pages of new movies, checks the API for detailed information, then updating
-    the new dataset after removing any multiples.
-
-    To run this code, you need to have 'bechdel_movies_2023_FEB.csv' in the proper directory, as well as the pandas, requests, BeautifulSoup, re, and timeit libraries.
+    The purpose of this script is to scrape newer data from the Bechdel test website and merge the movies that were added since the last run into the combined
+    dataset. It runs as an incremental sync driven by a persisted high-water mark ('./DATA/sync_watermark.json', holding the largest Bechdel 'id' and 'date'
+    already merged):
+    - the 'sort/added' listing is paginated newest-first; the API details of each page's IMDb IDs are fetched concurrently, and pagination stops at the
+      first page with a movie at or below the watermark (or when a page cap is hit),
+    - the movies above the watermark are kept: movies that are new to the dataset, and movies already in it that were added again or edited on
+      bechdeltest.com,
+    - they are upserted into 'bechdel_movies_combined.csv' keyed on 'imdbid': new rows are appended to the file, and the file is only rewritten when an
+      existing movie changed.
+    On the first run the watermark is derived from the combined dataset (or from 'bechdel_movies_2023_FEB.csv' if the combined dataset doesn't exist yet).
+
+    All requests go through the shared FetchEngine and its on-disk response cache ('./DATA/http_cache.sqlite'), so API details that were already downloaded
+    are not requested again when the script is re-run. The 'sort/added' listing pages always bypass the cache because they change as movies are added.
+
+    Request latencies, bytes, cache hit rates and the time per API call are recorded with Metrics.py and written to './OUTPUT/metrics/sync.json' and
+    '.prom' at the end of the run.
+
+    To run this code, you need to have 'bechdel_movies_combined.csv' or 'bechdel_movies_2023_FEB.csv' in the proper directory, as well as the pandas, requests,
+    re, and timeit libraries.
 '''
 
 # Import libraries
-import pandas as pd
-import requests
-from bs4 import BeautifulSoup
+import json
+import os
 import re
+import pandas as pd
 from timeit import default_timer as timer
+from FetchEngine import FetchEngine
+from ResponseCache import ResponseCache
+from Metrics import timed, export
+
+COMBINED_PATH = './DATA/bechdel_movies_combined.csv'
+SEED_PATH = './DATA/bechdel_movies_2023_FEB.csv'
+WATERMARK_PATH = './DATA/sync_watermark.json'
+COLUMNS = ['title', 'year', 'rating', 'dubious', 'imdbid', 'id', 'submitterid', 'date', 'visible']
+MAX_PAGES = 500 # safety cap on listing pages per sync
+
+# Shared engine and response cache (the cache file is also used by IMDbReviewSentiment.py), created by get_engine on first use so importing this
+# module doesn't open the cache
+engine = None
+
+
+# Function to get the shared engine, creating it on first use
+def get_engine():
+    global engine
+    if engine is None:
+        engine = FetchEngine(max_in_flight=5, rate=5.0, cache=ResponseCache('./DATA/http_cache.sqlite'))
+    return engine
 
-# Load the existing dataset
-old_movies_df = pd.read_csv('./DATA/bechdel_movies_2023_FEB.csv')
-
-# Convert the 'date' column to datetime format in the existing dataset
-old_movies_df['date'] = pd.to_datetime(old_movies_df['date'])
-
-# Find the latest date in the existing dataset to filter new movies
-latest_old_date = old_movies_df['date'].max()
-print(f"The latest date in the old dataset: {latest_old_date}")
-
-# Status code check to make sure the Bechdel test website is accessible
-response = requests.get('https://bechdeltest.com/?page=0', timeout=10)
-if response.status_code == 200:
-    print('Hi! How can I help you? :)')
-else:
-    print(f'Sorry but {response.status_code} occurred')
-
-# List to store IMDb IDs of newly added movies
-new_movie_imdbid = []
-
-# Loop over pages of the Bechdel test website (update to scrape 3 pages as required)
-for i in range(3):
-    url = f'https://bechdeltest.com/sort/added?page={i}'
-    response = requests.get(url)
-    html_content = response.text
-    
-    # Extract IMDb IDs from the HTML page content using regex
-    regex_pattern = r'title/tt(\d+)/'
-    matches = re.findall(regex_pattern, html_content)
-
-    # Add each IMDb ID to the list
-    for imdbid in matches:
-        new_movie_imdbid.append(imdbid)
-        if imdbid == '2371399':  # If specific IMDb ID is reached, stop the loop
-            break
 
-    if imdbid == '2371399':
-        break
+# Function to load the watermark, deriving it from the dataset the first time
+def load_watermark(movies_df):
+    if os.path.exists(WATERMARK_PATH):
+        with open(WATERMARK_PATH) as f:
+            return json.load(f)
+    return {'max_id': int(movies_df['id'].max()), 'max_date': str(pd.to_datetime(movies_df['date']).max())}
 
-print(new_movie_imdbid) # IMDb Movie IDs scraped
 
-# Check the number of newly added movies
-print(f"Number of newly added movies in the list: {len(new_movie_imdbid)}")
+def save_watermark(watermark):
+    tmp_path = WATERMARK_PATH + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(watermark, f)
+    os.replace(tmp_path, WATERMARK_PATH)
 
-# Initialize list to store movie information about the new movies
-new_movies_info = []
 
-# Scrape data for each IMDb ID
-start = timer() # measure scraping time
-for count, imdbid in enumerate(new_movie_imdbid, start=1): # loop over each ID to get information
+# Function to list the IMDb IDs on one page of the 'sort/added' listing (newest first); the listing always bypasses the cache
+def listing_imdbids(page):
+    url = f'https://bechdeltest.com/sort/added?page={page}'
+    response = get_engine().get(url, use_cache=False)
+
+    # Extract IMDb IDs from the HTML page content using regex, de-duplicated while keeping page order
+    return list(dict.fromkeys(re.findall(r'title/tt(\d+)/', response.text)))
+
+
+# Function to fetch the API details for one IMDb ID
+def fetch_movie(imdbid):
     url = f'http://bechdeltest.com/api/v1/getMovieByImdbId?imdbid={imdbid}'
-    
-    # Send API request to fetch movie data
-    try:
-        response = requests.get(url)
-        response.raise_for_status()
-        movie_info = response.json()
-        
-        # Add movie only if it was uploaded after the latest date in the old dataset
-        movie_date = pd.to_datetime(movie_info.get('date'))
-        if movie_info.get('title') and movie_date > latest_old_date:
-            new_movies_info.append(movie_info)
-        
-    except requests.exceptions.HTTPError as error: # print error message if API request fails
-        print(f"HTTP Error ({error}): {url}")
-        continue 
-    
-    print(f"Scraped movie {count}/{len(new_movie_imdbid)}: {imdbid}") # Print progress after each movie is processed
-
-# Convert list of new movies to DataFrame
-new_movies_df = pd.DataFrame(new_movies_info)
-
-# Save the scraped data into CSV
-new_movies_df.to_csv('./DATA/new_movies.csv', index=False)
-
-# Reindex columns to match old dataset before merging
-new_movies_df = new_movies_df.reindex(columns=['title', 'year', 'rating', 'dubious', 'imdbid', 'id', 'submitterid', 'date', 'visible'])
-
-# Merge the new dataset with the old one
-combined_df = pd.concat([old_movies_df, new_movies_df], ignore_index=True)
-
-# Remove duplicate entries
-combined_df.drop_duplicates(inplace=True)
-
-# Save the final combined dataset as CSV
-combined_df.to_csv('./DATA/bechdel_movies_combined.csv', index=False)
-
-# Print time taken for entire process
-print(f'It took {timer() - start} seconds to scrape all the information and combine the datasets.')
+    with timed('api'):
+        return get_engine().get(url).json() # served from the cache when this movie was already fetched
+
+
+# Function to check whether an API record is at or below the watermark, i.e. was merged by an earlier sync. A record with an older 'date' than the
+# watermark counts as well; an equal date doesn't, because several movies can be added in the same second.
+def below_watermark(movie_info, watermark):
+    if movie_info.get('id') is not None and int(movie_info['id']) <= watermark['max_id']:
+        return True
+    return pd.to_datetime(movie_info.get('date'), errors='coerce') < pd.to_datetime(watermark['max_date']) # NaT compares False
+
+
+# Function to walk the 'sort/added' listing newest-first, fetching the API details of each page concurrently, and collect the movies above the
+# watermark. Stops after the first page with a movie at or below the watermark: everything after it was merged by an earlier sync.
+def scrape_new_movies(watermark, max_pages=MAX_PAGES):
+    new_movies_info = []
+    seen = set()
+    for page in range(max_pages):
+        imdbids = [imdbid for imdbid in listing_imdbids(page) if imdbid not in seen]
+        if not imdbids: # ran past the last page
+            break
+        seen.update(imdbids)
+
+        crossed = False
+        for imdbid, movie_info, error in get_engine().map(fetch_movie, imdbids):
+            if error is not None: # print error message if API request fails
+                print(f"Error ({error}) fetching IMDb ID {imdbid}")
+            elif movie_info.get('title'):
+                if below_watermark(movie_info, watermark):
+                    crossed = True
+                else:
+                    new_movies_info.append(movie_info)
+        print(f"Listing page {page}: {len(new_movies_info)} movies above the watermark so far")
+        if crossed:
+            break
+    return new_movies_info
+
+
+# Function to upsert movies into the combined CSV keyed on imdbid: append new movies, and rewrite the file only if movies already in it were added again
+# or edited on bechdeltest.com
+def upsert_movies(new_movies_df, existing_imdbids):
+    new_movies_df = new_movies_df.reindex(columns=COLUMNS)
+    is_update = new_movies_df['imdbid'].astype(int).isin(existing_imdbids)
+
+    appended = new_movies_df[~is_update]
+    appended.to_csv(COMBINED_PATH, mode='a', header=False, index=False)
+
+    updated = new_movies_df[is_update]
+    if len(updated):
+        combined_df = pd.read_csv(COMBINED_PATH).set_index('imdbid')
+        combined_df.update(updated.astype({'imdbid': int}).set_index('imdbid'))
+        combined_df.reset_index()[COLUMNS].to_csv(COMBINED_PATH + '.tmp', index=False)
+        os.replace(COMBINED_PATH + '.tmp', COMBINED_PATH)
+    return len(appended), len(updated)
+
+
+# Function to run one incremental sync of the combined dataset; returns the number of appended and updated movies
+def sync_dataset():
+    # Start from the combined dataset, seeding it from the February 2023 dataset on the very first run
+    if not os.path.exists(COMBINED_PATH):
+        pd.read_csv(SEED_PATH).reindex(columns=COLUMNS).to_csv(COMBINED_PATH, index=False)
+    existing_df = pd.read_csv(COMBINED_PATH, usecols=['imdbid', 'id', 'date'])
+    existing_imdbids = set(existing_df['imdbid'].astype(int))
+
+    watermark = load_watermark(existing_df)
+    print(f"Watermark: Bechdel id {watermark['max_id']}, added {watermark['max_date']}")
+
+    start = timer() # measure sync time
+    new_movies_info = scrape_new_movies(watermark)
+    print(f"Number of movies above the watermark in the listing: {len(new_movies_info)}")
+
+    appended, updated = 0, 0
+    if new_movies_info:
+        new_movies_df = pd.DataFrame(new_movies_info)
+        new_movies_df.to_csv('./DATA/new_movies.csv', index=False) # Save the scraped data into CSV
+
+        appended, updated = upsert_movies(new_movies_df, existing_imdbids)
+        print(f"Appended {appended} new movies and updated {updated} existing movies")
+
+        # Advance the watermark only after the dataset was written
+        watermark = {'max_id': max(watermark['max_id'], int(new_movies_df['id'].astype(int).max())),
+                     'max_date': str(max(pd.to_datetime(watermark['max_date']), pd.to_datetime(new_movies_df['date']).max()))}
+        save_watermark(watermark)
+    else:
+        print('Dataset is already up to date')
+
+    # Print time taken for entire process
+    print(f'It took {timer() - start} seconds to sync the dataset.')
+    if get_engine().cache is not None:
+        print(f'Response cache: {get_engine().cache.stats()}')
+    return appended, updated
+
+
+# Function to sync the dataset and export the run's metrics (the 'sync' command of bechdel.py)
+def main():
+    with get_engine():
+        sync_dataset()
+    print(f"Metrics written to {', '.join(export('sync'))}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,253 @@
+'''
+Two-Stage Sentiment Pipeline
+    VADER scoring is CPU-bound pure Python, so running it on the same thread that collects finished downloads makes the scoring serialize behind the GIL
+    with the network threads. This module splits the work into two stages connected by a bounded queue:
+    - Stage 1 (I/O): the FetchEngine's worker threads download and extract reviews and push the raw review text into the queue.
+    - Stage 2 (CPU): a ProcessPoolExecutor of VADER workers scores the reviews in chunks. Each worker process creates its scorer (FastVader.py) once,
+      when it starts, and reuses it - with its token table and cache of scored reviews - for every chunk.
+    Throughput therefore scales with the number of cores, and the pipeline reports per-stage throughput when it finishes. Queue depth, chunks in flight,
+    pages fetched, reviews scored and the scoring time of every chunk are also recorded in the Metrics.py registry; when the 'score' stage is profiled,
+    every worker process writes its own cProfile file.
+
+    With a ReviewBudget, movies with more than one page of reviews are paginated adaptively: once a page has been scored, the next page is requested
+    only if the confidence interval of the movie's mean compound score is still too wide, so network cost follows information gain. Continuation pages
+    share the engine's window of 'max_in_flight' requests with the first pages, so pagination never puts more requests in flight than the engine allows.
+
+    The workers load the vendored VADER lexicon ('./DATA/vader_lexicon.pkl', see FastVader.py), so they don't need nltk.
+'''
+
+import math
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from Metrics import METRICS, profile_worker, profiled_stages
+
+_DONE = object() # end-of-stream marker for the queue
+_analyzer = None # per-process VADER scorer, created by _init_worker
+_profiled = set() # stages profiled in this worker process
+
+
+# Runs once in every worker process
+def _init_worker(profiled=()):
+    global _analyzer, _profiled
+    from FastVader import FastVader
+    _analyzer = FastVader()
+    _profiled = set(profiled)
+
+
+# Score a chunk of [(imdbid, [review, ...]), ...]; returns ([[(neg, neu, pos, compound), ...] per movie], seconds spent scoring)
+def _score_chunk(chunk):
+    start = time.perf_counter()
+    scored = []
+    with profile_worker('score', _profiled):
+        for _, reviews in chunk:
+            polarity = _analyzer.score_many(reviews)
+            scored.append([(p['neg'], p['neu'], p['pos'], p['compound']) for p in polarity])
+    return scored, time.perf_counter() - start
+
+
+class StageStats:
+    '''Counters for one pipeline stage.'''
+
+    def __init__(self, name, unit):
+        self.name = name
+        self.unit = unit
+        self.count = 0
+        self.busy = 0.0 # seconds of work done (summed over workers)
+        self.started = None
+        self.finished = None
+        self.lock = threading.Lock() # counters are updated from several threads
+
+    def add(self, count=1, busy=0.0):
+        with self.lock:
+            self.count += count
+            self.busy += busy
+
+    def throughput(self):
+        elapsed = (self.finished or time.perf_counter()) - (self.started or time.perf_counter())
+        return self.count / elapsed if elapsed > 0 else 0.0
+
+    def report(self):
+        return f"{self.name}: {self.count} {self.unit} at {self.throughput():.1f} {self.unit}/s (busy {self.busy:.1f}s)"
+
+
+class ReviewBudget:
+    '''
+    Per-movie budget for IMDb's "load more" pagination. After each page is scored, another page is fetched only while fewer than 'max_reviews' reviews are
+    in hand and the 95% confidence interval of the mean compound score is wider than +/- 'half_width' (always fetching until 'min_reviews' are in hand).
+    Movies whose reviews agree with each other stop after one page; only the ones where more reviews would change the answer cost extra requests.
+    The reviews in hand are the movie's stored reviews plus the ones scored in this run, so a rescored movie is judged on its whole review set.
+    '''
+
+    def __init__(self, max_reviews=150, min_reviews=20, half_width=0.15, z=1.96):
+        self.max_reviews = max_reviews
+        self.min_reviews = min_reviews
+        self.half_width = half_width
+        self.z = z
+
+    # Function to compute the half-width of the confidence interval of the mean
+    def interval(self, compounds):
+        n = len(compounds)
+        if n < 2:
+            return float('inf')
+        mean = sum(compounds) / n
+        variance = sum((c - mean) ** 2 for c in compounds) / (n - 1)
+        return self.z * math.sqrt(variance / n)
+
+    def wants_more(self, compounds):
+        if len(compounds) >= self.max_reviews:
+            return False
+        return len(compounds) < self.min_reviews or self.interval(compounds) > self.half_width
+
+
+class SentimentPipeline:
+    '''
+    Fetch review pages with 'fetch(imdbid, key)' on the engine's I/O threads and score them on a pool of processes. 'fetch' returns (reviews, next_key),
+    where next_key is the continuation key of the next page (or None); with a ReviewBudget, further pages are fetched after scoring for as long as the
+    budget wants more reviews. Without a budget only the first page is used. 'stored(imdbid)' returns the compound scores already kept for a movie (e.g.
+    ReviewStore.compounds); when 'fetch' only returns reviews that aren't stored yet, the budget then still sees the movie's full review set, and a page
+    with no new reviews is skipped over rather than ending the movie.
+
+    run() yields (imdbid, reviews, scores, error) as movies finish, where scores holds one (neg, neu, pos, compound) tuple per review; reviews and scores
+    are None when the movie had no reviews to score or failed to download.
+    '''
+
+    def __init__(self, engine, fetch, workers=None, chunk_size=200, queue_size=500, budget=None, stored=None):
+        self.engine = engine
+        self.fetch = fetch
+        self.budget = budget
+        self.stored = stored
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size # reviews per chunk sent to a worker process
+        self.queue = queue.Queue(maxsize=queue_size) # bounded, so downloads pause while the scorers catch up
+        self.movies = {} # imdbid -> ([reviews], [scores]) of movies that are still being paginated
+        self.slots = threading.BoundedSemaphore(engine.max_in_flight) # requests in flight, first and continuation pages together
+        self.fetch_stats = StageStats('fetch', 'pages')
+        self.score_stats = StageStats('score', 'reviews')
+
+    # Function to fetch one page while holding one of the 'max_in_flight' request slots
+    def _fetch_page(self, imdbid, *key):
+        with self.slots:
+            return self.fetch(imdbid, *key)
+
+    # Stage 1: runs on a background thread, pushing (imdbid, page, error, is_continuation) into the queue
+    def _produce(self, imdbids):
+        self.fetch_stats.started = time.perf_counter()
+        try:
+            for imdbid, page, error in self.engine.map(self._fetch_page, imdbids):
+                self.fetch_stats.add()
+                METRICS.counter('pages_fetched_total', 'Review pages fetched', kind='first').inc()
+                self.queue.put((imdbid, page, error, False))
+        finally:
+            self.queue.put(_DONE)
+
+    # Continuation pages are requested from a separate thread pool, within the same request slots, and join the same queue
+    def _fetch_next(self, imdbid, key):
+        try:
+            page, error = self._fetch_page(imdbid, key), None
+        except Exception as e:
+            page, error = None, e
+        self.fetch_stats.add()
+        METRICS.counter('pages_fetched_total', 'Review pages fetched', kind='continuation').inc()
+        self.queue.put((imdbid, page, error, True))
+
+    # Collect the results of finished chunks; yields finished movies and returns the movies that need another page
+    def _harvest(self, futures, chunks):
+        continuations = []
+        for future in futures:
+            scored, busy = future.result()
+            self.score_stats.add(0, busy)
+            METRICS.histogram('stage_seconds', 'Seconds per operation of each pipeline stage', stage='score').observe(busy)
+            for (imdbid, reviews, next_key), scores in zip(chunks.pop(future), scored):
+                self.score_stats.add(len(reviews))
+                METRICS.counter('reviews_scored_total', 'Reviews scored by VADER').inc(len(reviews))
+                all_reviews, all_scores = self.movies.setdefault(imdbid, ([], []))
+                all_reviews.extend(reviews)
+                all_scores.extend(scores)
+                if next_key and self._wants_more(imdbid, all_scores):
+                    continuations.append((imdbid, next_key))
+                else:
+                    del self.movies[imdbid]
+                    yield imdbid, all_reviews, all_scores, None
+        return continuations
+
+    # Function to decide whether a movie needs another page, from its stored compounds and the ones scored in this run
+    def _wants_more(self, imdbid, scores):
+        if self.budget is None:
+            return False
+        stored = self.stored(imdbid) if self.stored is not None else ()
+        return self.budget.wants_more([*stored, *(score[3] for score in scores)])
+
+    # Yield whatever a movie has collected so far (used when a page comes back empty or fails)
+    def _finish(self, imdbid, error):
+        if imdbid in self.movies:
+            reviews, scores = self.movies.pop(imdbid)
+            return imdbid, reviews, scores, None
+        return imdbid, None, None, error
+
+    def run(self, imdbids):
+        producer = threading.Thread(target=self._produce, args=(imdbids,), daemon=True)
+        producer.start()
+        self.score_stats.started = time.perf_counter()
+
+        profiled = profiled_stages()[0] & {'score'} if profiled_stages()[1] == 'cprofile' else set()
+        queue_depth = METRICS.gauge('pipeline_queue_depth', 'Fetched pages waiting to be scored')
+        in_flight = METRICS.gauge('pipeline_chunks_in_flight', 'Chunks submitted to the scoring processes and not yet finished')
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker, initargs=(profiled,)) as executor, \
+                ThreadPoolExecutor(max_workers=self.engine.max_in_flight) as followups:
+            pending = set()
+            chunks = {} # future -> the chunk it is scoring
+            chunk, chunk_reviews, done = [], 0, False
+            outstanding = 0 # continuation pages requested but not yet received
+            while not done or outstanding or chunk or pending:
+                queue_depth.set(self.queue.qsize())
+                in_flight.set(len(pending))
+                item = None
+                if not done or outstanding:
+                    try:
+                        item = self.queue.get(timeout=0.05)
+                    except queue.Empty:
+                        item = None
+                    if item is _DONE:
+                        done = True
+                    elif item is not None:
+                        imdbid, page, error, is_continuation = item
+                        outstanding -= is_continuation
+                        if error is not None and is_continuation:
+                            print(f"Error fetching more reviews for IMDb ID {imdbid}: {error}")
+                        reviews, next_key = page if page is not None else (None, None)
+                        if error is None and not reviews and next_key and self._wants_more(imdbid, self.movies.get(imdbid, ([], []))[1]):
+                            followups.submit(self._fetch_next, imdbid, next_key) # nothing new on this page, but the budget wants more
+                            outstanding += 1
+                        elif error is not None or not reviews:
+                            yield self._finish(imdbid, error) # nothing (more) to score
+                        else:
+                            chunk.append((imdbid, reviews, next_key))
+                            chunk_reviews += len(reviews)
+
+                # Send a chunk when it is full, or when the queue has gone quiet / ended, so workers never idle waiting for a full chunk
+                if chunk and (chunk_reviews >= self.chunk_size or item is None or done):
+                    future = executor.submit(_score_chunk, [(imdbid, reviews) for imdbid, reviews, _ in chunk])
+                    pending.add(future)
+                    chunks[future] = chunk
+                    chunk, chunk_reviews = [], 0
+
+                # Keep at most two chunks per worker outstanding; wait for one to finish when the pool is saturated
+                if len(pending) >= 2 * self.workers or (done and not outstanding and not chunk and pending):
+                    finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                else:
+                    finished = {future for future in pending if future.done()}
+                    pending -= finished
+                continuations = yield from self._harvest(finished, chunks)
+                for imdbid, next_key in continuations:
+                    followups.submit(self._fetch_next, imdbid, next_key)
+                    outstanding += 1
+
+        self.score_stats.finished = self.fetch_stats.finished = time.perf_counter()
+        self.fetch_stats.busy = self.fetch_stats.finished - self.fetch_stats.started
+        producer.join()
+
+    def report(self):
+        return '\n'.join([self.fetch_stats.report(), self.score_stats.report() + f" on {self.workers} processes"])
@@ -0,0 +1,374 @@
+'''
+Sentiment Sketches
+    The sentiment boxplot by decade and the sentiment histograms and KDEs used to need every sentiment score in memory, sorted again for every group. That
+    is fine with one score per movie, but not with review-level data (one score per review, millions of rows). This module summarizes the scores of each
+    (decade, rating_binary) cell with a DistributionSketch whose size doesn't depend on the number of scores:
+
+    - a KLL quantile sketch (QuantileSketch) that keeps at most about 2 * 'SKETCH_K' values. The error shrinks as 1 / k; with k = 400 every percentile
+      it returns is within 1% of rank of the exact one (0.4-0.7% at worst, measured on a million scores split into up to 50 merged chunks)
+    - a histogram with 'HIST_BINS' fixed bins over [-1, 1], the range of VADER compound scores
+    - the exact count, sum, sum of squares, min and max
+
+    Sketches are mergeable: merging the sketches of two sets of scores gives the sketch of their union. A SketchSet is built in one pass over chunked
+    input (build_sketches): each chunk is sketched in a worker process and the chunk sketches are merged in the parent as they come back, so memory does
+    not grow with the input. The sketch of a decade or of the passing/failing movies is a merge of cells (SketchSet.group).
+
+    There are two sources. movie_chunks() splits the movie dataset (one mean score per movie). review_chunks() streams the review store (ReviewStore.py)
+    one segment at a time (one compound score per review). The movie sketches are saved to './DATA/cache/sentiment_sketches.pkl' with a hash of each
+    movie's row: like the aggregate cube (AggregateCube.py), load_sketches() folds newly merged movies into the saved sketches and only rebuilds them when a
+    stored movie changed or was removed. The review sketches are saved to './DATA/cache/review_sketches.pkl' with the list of segments they cover, and
+    load_review_sketches() only sketches the segments written since.
+
+    AnalysisPlots.py and ExploratoryPlots.py draw the boxplot (boxplot_stats), the KDE curves and the sentiment histogram from the sketches. The KDEs are
+    Gaussian KDEs over the histogram bins with Scott's bandwidth (binned KDE), so they differ from a KDE of the raw scores by less than a bin width. The
+    bandwidth is at least one bin wide, so a group whose scores are all equal still gets a curve; groups with fewer than 2 scores get none.
+
+    Usage (from the MATERIALS folder):
+        python CODE/SentimentSketch.py          # sketch the review store and print the quartiles of the review scores per decade
+
+    This module requires the numpy and pandas libraries.
+'''
+
+import hashlib
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from BechdelData import load_movies, decade_of, CACHE_DIR
+from AggregateCube import row_hashes
+from ReviewStore import segment_paths
+
+SKETCH_PATH = os.path.join(CACHE_DIR, 'sentiment_sketches.pkl')
+REVIEW_SKETCH_PATH = os.path.join(CACHE_DIR, 'review_sketches.pkl')
+REVIEW_STORE_DIR = './DATA/review_store'
+
+SKETCH_K = 400 # size parameter of the quantile sketches (rank error shrinks as 1 / k)
+HIST_BINS = 200 # fixed histogram bins over HIST_RANGE
+HIST_RANGE = (-1.0, 1.0)
+HIST_WIDTH = (HIST_RANGE[1] - HIST_RANGE[0]) / HIST_BINS # width of one bin, also the smallest KDE bandwidth
+CHUNK_ROWS = 100_000 # rows per chunk when sketching the movie dataset
+
+# Cells of a SketchSet
+KEYS = ['decade', 'rating_binary']
+
+
+class QuantileSketch:
+    '''
+    KLL quantile sketch. Every value kept at level h stands for 2**h of the inserted values. When a level holds more values than its capacity, it is
+    sorted and every other value, starting at a random offset, moves up a level.
+    '''
+
+    def __init__(self, k=SKETCH_K, seed=0):
+        self.k = k
+        self.n = 0
+        self.levels = [np.empty(0)]
+        self.rng = np.random.default_rng(seed)
+
+    # Capacity of level h: k for the top level, 2/3 of the level above it below that (at least 2)
+    def _capacity(self, h):
+        return max(2, int(np.ceil(self.k * (2 / 3) ** (len(self.levels) - 1 - h))))
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if len(values):
+            self.n += len(values)
+            self.levels[0] = np.concatenate([self.levels[0], values])
+            self._compress()
+        return self
+
+    # Function to fold another sketch into this one
+    def merge(self, other):
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+        for h, items in enumerate(other.levels):
+            self.levels[h] = np.concatenate([self.levels[h], items])
+        self.n += other.n
+        self._compress()
+        return self
+
+    def _compress(self):
+        h = 0
+        while h < len(self.levels):
+            if len(self.levels[h]) <= self._capacity(h):
+                h += 1
+                continue
+            grown = h + 1 == len(self.levels)
+            if grown:
+                self.levels.append(np.empty(0))
+            items = np.sort(self.levels[h])
+            odd = len(items) % 2 # with an odd number of values the smallest one stays behind
+            self.levels[h + 1] = np.concatenate([self.levels[h + 1], items[odd + int(self.rng.integers(2))::2]])
+            self.levels[h] = items[:odd]
+            h = 0 if grown else h + 1 # a new level shrinks the capacities of the levels below it
+
+    # Function to return the kept values (sorted) and the number of inserted values each one stands for
+    def weighted_values(self):
+        values = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(items), 2.0 ** h) for h, items in enumerate(self.levels)])
+        order = np.argsort(values, kind='stable')
+        return values[order], weights[order]
+
+    # Function to estimate the q-quantiles (q in [0, 1], a number or an array). While nothing has been compacted the sketch holds every value, and the
+    # quantiles are exact (interpolated like np.quantile and plt.boxplot).
+    def quantile(self, q):
+        if len(self.levels) == 1:
+            return np.quantile(self.levels[0], q) if self.n else np.full(np.shape(q), np.nan)
+        values, weights = self.weighted_values()
+        cumulative = np.cumsum(weights)
+        index = np.searchsorted(cumulative, np.asarray(q, dtype=np.float64) * cumulative[-1], side='left')
+        return values[np.minimum(index, len(values) - 1)]
+
+
+# Function to compute a Gaussian KDE of weighted points on a grid (Scott's bandwidth from the weighted spread unless one is given)
+def weighted_kde(points, weights, grid, bandwidth=None):
+    points = np.asarray(points, dtype=np.float64)
+    weights = np.asarray(weights, dtype=np.float64)
+    total = weights.sum()
+    if bandwidth is None:
+        mean = np.average(points, weights=weights)
+        bandwidth = np.sqrt(np.average((points - mean) ** 2, weights=weights) * total / (total - 1)) * total ** (-1 / 5)
+    z = (np.asarray(grid, dtype=np.float64)[:, None] - points[None, :]) / bandwidth
+    return (np.exp(-0.5 * z * z) @ weights) / (total * bandwidth * np.sqrt(2 * np.pi))
+
+
+class DistributionSketch:
+    '''
+    Constant-size summary of a set of sentiment scores: exact moments, a KLL quantile sketch and a fixed-bin histogram.
+    '''
+
+    def __init__(self, k=SKETCH_K, seed=0):
+        self.count = 0
+        self.sum = 0.0
+        self.sumsq = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+        self.quantiles = QuantileSketch(k, seed)
+        self.hist = np.zeros(HIST_BINS, dtype=np.int64)
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if not len(values):
+            return self
+        self.count += len(values)
+        self.sum += float(values.sum())
+        self.sumsq += float((values * values).sum())
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        self.quantiles.update(values)
+        bins = np.clip(((values - HIST_RANGE[0]) / HIST_WIDTH).astype(np.int64), 0, HIST_BINS - 1) # 1.0 goes in the last bin
+        self.hist += np.bincount(bins, minlength=HIST_BINS)
+        return self
+
+    # Function to fold another sketch into this one
+    def merge(self, other):
+        self.count += other.count
+        self.sum += other.sum
+        self.sumsq += other.sumsq
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.quantiles.merge(other.quantiles)
+        self.hist += other.hist
+        return self
+
+    @property
+    def mean(self):
+        return self.sum / self.count if self.count else np.nan
+
+    @property
+    def std(self):
+        if self.count < 2:
+            return np.nan
+        return float(np.sqrt(max(0.0, (self.sumsq - self.sum * self.mean) / (self.count - 1))))
+
+    # Function to estimate the q-quantiles; 0 and 1 give the exact min and max
+    def quantile(self, q):
+        q = np.asarray(q, dtype=np.float64)
+        estimate = np.clip(self.quantiles.quantile(q), self.min, self.max)
+        return np.where(q <= 0, self.min, np.where(q >= 1, self.max, estimate))
+
+    # Function to compute what plt.boxplot draws (median, quartiles, whiskers at 'whis' times the IQR, fliers) in the format of Axes.bxp.
+    # Whiskers end at the most extreme kept value inside the fences, and the fliers are the kept values outside them (a sample of the outliers).
+    def boxplot_stats(self, label=None, whis=1.5):
+        q1, median, q3 = self.quantile([0.25, 0.5, 0.75])
+        low, high = q1 - whis * (q3 - q1), q3 + whis * (q3 - q1)
+        values = np.concatenate([[self.min], self.quantiles.weighted_values()[0], [self.max]])
+        inside = values[(values >= low) & (values <= high)]
+        whislo = min(inside.min(), q1) if len(inside) else q1 # like plt.boxplot, a whisker never ends inside the box
+        whishi = max(inside.max(), q3) if len(inside) else q3
+        return {'label': label, 'med': median, 'q1': q1, 'q3': q3, 'whislo': whislo, 'whishi': whishi, 'mean': self.mean,
+                'fliers': np.unique(values[(values < whislo) | (values > whishi)])}
+
+    # Function to return the histogram (edges, counts) with every 'merge' fixed bins combined and the empty bins at either end dropped
+    def histogram(self, merge=1):
+        counts = self.hist.reshape(-1, merge).sum(axis=1)
+        edges = np.linspace(HIST_RANGE[0], HIST_RANGE[1], len(counts) + 1)
+        filled = np.flatnonzero(counts)
+        if not len(filled):
+            return edges[:1], counts[:0]
+        return edges[filled[0]:filled[-1] + 2], counts[filled[0]:filled[-1] + 1]
+
+    # Scott's bandwidth from the exact spread, but never narrower than a histogram bin (identical scores, or a single score, have no spread)
+    @property
+    def bandwidth(self):
+        return float(np.fmax(self.std * self.count ** (-1 / 5), HIST_WIDTH)) if self.count else np.nan
+
+    # Function to compute the density of the scores on a grid: a Gaussian KDE over the histogram bins (callers skip sketches with fewer than 2 scores)
+    def kde(self, grid):
+        edges = np.linspace(HIST_RANGE[0], HIST_RANGE[1], HIST_BINS + 1)
+        return weighted_kde((edges[:-1] + edges[1:]) / 2, self.hist, grid, bandwidth=self.bandwidth)
+
+
+class SketchSet:
+    '''
+    One DistributionSketch per (decade, rating_binary) cell. 'unit' says what was counted ('movies' or 'reviews').
+    '''
+
+    def __init__(self, cells=None, k=SKETCH_K, unit='movies'):
+        self.cells = cells if cells is not None else {} # (decade, rating_binary) -> DistributionSketch
+        self.k = k
+        self.unit = unit
+
+    # Function to sketch a frame with 'year', 'rating' and 'sentiment' columns
+    @classmethod
+    def build(cls, frame, k=SKETCH_K, unit='movies'):
+        keyed = pd.DataFrame({'decade': decade_of(frame['year'].to_numpy()), 'rating_binary': (frame['rating'].to_numpy() == 3).astype(np.int8),
+                              'sentiment': frame['sentiment'].to_numpy(dtype=np.float64)})
+        cells = {}
+        for (decade, passes), scores in keyed.groupby(KEYS)['sentiment']:
+            cells[(int(decade), int(passes))] = DistributionSketch(k).update(scores.to_numpy())
+        return cls(cells, k, unit)
+
+    # Function to fold another sketch set into this one
+    def merge(self, other):
+        for key, sketch in other.cells.items():
+            if key in self.cells:
+                self.cells[key].merge(sketch)
+            else:
+                self.cells[key] = sketch
+        return self
+
+    # Function to merge the cells by 'decade' or 'rating_binary' (None: a single sketch of every score); returns {group: DistributionSketch}
+    def group(self, by=None):
+        groups = {}
+        for key in sorted(self.cells):
+            group = key[KEYS.index(by)] if by else None
+            groups.setdefault(group, DistributionSketch(self.k)).merge(self.cells[key])
+        return groups if by else groups.get(None, DistributionSketch(self.k))
+
+    # Function to fingerprint the sketches (changes whenever a score is added), so plots drawn from them know when to redraw
+    def fingerprint(self):
+        digest = hashlib.sha256(self.unit.encode())
+        for key in sorted(self.cells):
+            sketch = self.cells[key]
+            digest.update(repr((key, sketch.count, sketch.sum, sketch.sumsq, sketch.min, sketch.max)).encode())
+            digest.update(sketch.hist.tobytes())
+        return digest.hexdigest()
+
+
+# Function to sketch one chunk (runs in a worker process)
+def sketch_chunk(task):
+    frame, k, unit = task
+    return SketchSet.build(frame, k, unit)
+
+
+# Function to sketch chunked input in one pass. Chunks are sketched on 'workers' processes (1: in this process) with at most two chunks per worker in
+# flight, and merged in the order they were read, so the result doesn't depend on which worker finishes first.
+def build_sketches(chunks, workers=1, k=SKETCH_K, unit='movies'):
+    sketches = SketchSet(k=k, unit=unit)
+    if workers == 1:
+        for chunk in chunks:
+            sketches.merge(sketch_chunk((chunk, k, unit)))
+        return sketches
+    workers = workers or os.cpu_count()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(executor.submit(sketch_chunk, (chunk, k, unit)))
+            if len(pending) >= 2 * workers:
+                sketches.merge(pending.popleft().result())
+        while pending:
+            sketches.merge(pending.popleft().result())
+    return sketches
+
+
+# Function to split the movie dataset into chunks of 'rows' movies
+def movie_chunks(df, rows=CHUNK_ROWS):
+    frame = df[['year', 'rating', 'sentiment']]
+    for start in range(0, len(frame), rows):
+        yield frame.iloc[start:start + rows]
+
+
+# Function to read review store segments one at a time as chunks of (year, rating, sentiment = compound score of the review); reviews of movies that
+# aren't in 'movies' are skipped
+def review_chunks(movies, paths):
+    lookup = movies.drop_duplicates('imdbid').set_index('imdbid')[['year', 'rating']]
+    for path in paths:
+        with np.load(path) as segment:
+            imdbids, compound = segment['imdbid'], segment['compound']
+        found = lookup.reindex(imdbids)
+        known = found['year'].notna().to_numpy()
+        yield pd.DataFrame({'year': found['year'].to_numpy()[known].astype(np.int16), 'rating': found['rating'].to_numpy()[known].astype(np.int8),
+                            'sentiment': compound[known]})
+
+
+def _save(state, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    pd.to_pickle(state, path + '.tmp')
+    os.replace(path + '.tmp', path)
+
+
+# Function to load the sketches of a dataset's movie scores (every movie of the Bechdel dataset by default), updating the saved sketches with new movies
+def load_sketches(df=None, path=SKETCH_PATH, workers=1):
+    if df is None:
+        df = load_movies(clean=False)
+    hashes = row_hashes(df)
+
+    saved = pd.read_pickle(path) if os.path.exists(path) else None
+    if saved is not None and hashes.index.is_unique:
+        old = saved['hashes']
+        known = hashes.index.isin(old.index)
+        if known.sum() == len(old) and (hashes[known].reindex(old.index) == old).all():
+            sketches = saved['sketches']
+            if known.all():
+                return sketches # nothing changed
+            sketches.merge(build_sketches(movie_chunks(df.loc[~known]), workers))
+            _save({'sketches': sketches, 'hashes': hashes}, path)
+            return sketches
+
+    sketches = build_sketches(movie_chunks(df), workers) # first build, or stored movies changed
+    _save({'sketches': sketches, 'hashes': hashes}, path)
+    return sketches
+
+
+# Function to load the sketches of the review-level scores in the review store, sketching only the segments written since the last call.
+# The sketches are rebuilt when the year or rating of a movie changed.
+def load_review_sketches(movies=None, store_dir=REVIEW_STORE_DIR, path=REVIEW_SKETCH_PATH, workers=None):
+    if movies is None:
+        movies = load_movies(clean=False)
+    movies_hash = hashlib.sha256(pd.util.hash_pandas_object(movies[['imdbid', 'year', 'rating']], index=False).to_numpy().tobytes()).hexdigest()
+    paths = [os.path.basename(p) for p in segment_paths(store_dir)]
+
+    saved = pd.read_pickle(path) if os.path.exists(path) else None
+    if saved is not None and saved['movies'] == movies_hash and paths[:len(saved['segments'])] == saved['segments']:
+        sketches, done = saved['sketches'], saved['segments']
+        if len(done) == len(paths):
+            return sketches # no new segments
+    else:
+        sketches, done = SketchSet(unit='reviews'), []
+
+    new = [os.path.join(store_dir, name) for name in paths[len(done):]]
+    sketches.merge(build_sketches(review_chunks(movies, new), workers, unit='reviews'))
+    _save({'sketches': sketches, 'movies': movies_hash, 'segments': paths}, path)
+    return sketches
+
+
+if __name__ == '__main__':
+    sketches = load_review_sketches()
+    print(f"{'decade':<8} {'reviews':>10} {'q1':>8} {'median':>8} {'q3':>8}")
+    for decade, sketch in sketches.group('decade').items():
+        q1, median, q3 = sketch.quantile([0.25, 0.5, 0.75])
+        print(f"{decade}s{'':<3} {sketch.count:>10} {q1:>8.3f} {median:>8.3f} {q3:>8.3f}")
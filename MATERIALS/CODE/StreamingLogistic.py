@@ -0,0 +1,258 @@
+'''
+Scalable Logistic Regression
+    This module trains the "does this movie pass the Bechdel test" classifier in named configurations ('MODEL_CONFIGS'). The original LogisticRegression.py
+    model - scikit-learn's LogisticRegression on the sentiment score with one 80/20 split - is the 'baseline' configuration. The other configurations train
+    without ever holding the whole training set in memory:
+
+    - the rows are streamed in mini-batches into a StandardScaler (first pass) and an SGDClassifier with logistic loss (partial_fit, several epochs)
+    - 'streaming' uses movie-level rows with extra features: year, decade, and the per-movie review count and review score distribution (mean, std, min,
+      max, share of positive/negative reviews). The review statistics are accumulated one review store segment at a time (ReviewStore.py).
+    - 'reviews' uses one row per stored review (its neg/neu/pos/compound scores and the movie's year), read segment by segment from the review store.
+      Folds are assigned by movie, so reviews of the same movie never end up in both the training and the test fold.
+
+    Streaming configurations are evaluated with k-fold cross-validation, one fold per worker process. Every fold reports its fit time, the peak memory
+    allocated while fitting and evaluating (tracemalloc), accuracy, log loss, Brier score, and calibration: the expected calibration error and the
+    observed pass rate per bin of predicted probability.
+
+    When run, the configuration named by 'MODEL_CONFIG' is trained and the report is written to './OUTPUT/regression_<config>.json'.
+
+    This module requires the numpy, pandas and scikit-learn libraries.
+'''
+
+import json
+import os
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+
+import numpy as np
+import pandas as pd
+from BechdelData import load_movies
+from ReviewStore import iter_segments, segment_paths, SCORE_COLUMNS
+
+REVIEW_STORE_DIR = './DATA/review_store'
+REPORT_DIR = './OUTPUT/'
+MODEL_CONFIG = 'streaming'
+CALIBRATION_BINS = 10
+
+# Per-movie statistics of the review compound scores
+REVIEW_STAT_COLUMNS = ['review_count', 'review_mean', 'review_std', 'review_min', 'review_max', 'review_positive', 'review_negative']
+
+# Named training configurations
+MODEL_CONFIGS = {
+    # The original LogisticRegression.py model: in-memory LogisticRegression, sentiment only, one 80/20 split
+    'baseline': {'level': 'movie', 'features': ['sentiment'], 'solver': 'batch', 'test_size': 0.2, 'random_state': 42},
+    # Movie-level rows with year/decade and review distribution features, streamed into SGD with 5-fold CV
+    'streaming': {'level': 'movie', 'features': ['sentiment', 'year', 'decade'] + REVIEW_STAT_COLUMNS, 'solver': 'sgd', 'folds': 5,
+                  'batch_size': 256, 'epochs': 10, 'alpha': 1e-4, 'random_state': 42},
+    # One row per stored review, streamed segment by segment into SGD with 5-fold CV grouped by movie
+    'reviews': {'level': 'review', 'features': SCORE_COLUMNS + ['year'], 'solver': 'sgd', 'folds': 5, 'batch_size': 4096, 'epochs': 2,
+                'alpha': 1e-4, 'random_state': 42},
+}
+
+
+# Function to accumulate per-movie statistics of the review compound scores, one store segment at a time
+def review_stats(store_dir=REVIEW_STORE_DIR):
+    partials = []
+    for segment in iter_segments(store_dir, ['imdbid', 'compound']):
+        compound = segment['compound'].astype(np.float64)
+        frame = pd.DataFrame({'imdbid': segment['imdbid'], 'sum': compound, 'sumsq': compound * compound, 'min': compound, 'max': compound,
+                              'positive': compound >= 0.05, 'negative': compound <= -0.05})
+        grouped = frame.groupby('imdbid')
+        partials.append(grouped.agg({'sum': 'sum', 'sumsq': 'sum', 'min': 'min', 'max': 'max', 'positive': 'sum', 'negative': 'sum'})
+                        .assign(count=grouped.size()))
+    if not partials:
+        return pd.DataFrame(columns=REVIEW_STAT_COLUMNS, dtype=np.float64)
+
+    totals = pd.concat(partials).groupby(level=0).agg({'count': 'sum', 'sum': 'sum', 'sumsq': 'sum', 'min': 'min', 'max': 'max',
+                                                        'positive': 'sum', 'negative': 'sum'})
+    n = totals['count']
+    mean = totals['sum'] / n
+    return pd.DataFrame({
+        'review_count': n,
+        'review_mean': mean,
+        'review_std': np.sqrt(((totals['sumsq'] - totals['sum'] * mean) / (n - 1).where(n > 1)).clip(lower=0)).fillna(0),
+        'review_min': totals['min'],
+        'review_max': totals['max'],
+        'review_positive': totals['positive'] / n,
+        'review_negative': totals['negative'] / n,
+    })
+
+
+# Function to build the movie-level feature matrix and labels; movies without stored reviews get a review count of 0 and their sentiment score
+def movie_features(df, features, store_dir=REVIEW_STORE_DIR):
+    frame = df.set_index('imdbid')[['sentiment', 'year', 'decade', 'rating_binary']].astype(np.float64)
+    if any(col in REVIEW_STAT_COLUMNS for col in features):
+        frame = frame.join(review_stats(store_dir))
+        frame[['review_count', 'review_std', 'review_positive', 'review_negative']] = \
+            frame[['review_count', 'review_std', 'review_positive', 'review_negative']].fillna(0)
+        for col in ['review_mean', 'review_min', 'review_max']:
+            frame[col] = frame[col].fillna(frame['sentiment'])
+    frame = frame.replace([np.inf, -np.inf], np.nan).dropna(subset=features)
+    return frame[features].to_numpy(dtype=np.float64), frame['rating_binary'].to_numpy(dtype=np.int8)
+
+
+# Function to stream movie-level mini-batches of one side of a fold (train=True: every fold but 'fold'), in a shuffled order
+def _movie_batches(data, config, fold, train, rng=None):
+    X, y, folds = data
+    rows = np.flatnonzero((folds != fold) if train else (folds == fold))
+    if rng is not None:
+        rows = rng.permutation(rows)
+    for start in range(0, len(rows), config['batch_size']):
+        batch = rows[start:start + config['batch_size']]
+        yield X[batch], y[batch]
+
+
+# Function to assign each movie to a fold deterministically from its IMDb ID
+def _movie_fold(imdbids, k):
+    return (imdbids.astype(np.uint64) * np.uint64(2654435761) % np.uint64(2 ** 32)) % np.uint64(k)
+
+
+# Function to stream review-level mini-batches of one side of a fold from the review store, one segment at a time
+def _review_batches(data, config, fold, train, rng=None):
+    store_dir, movies = data
+    features = config['features']
+    for segment in iter_segments(store_dir, ['imdbid'] + SCORE_COLUMNS):
+        joined = movies.reindex(segment['imdbid']) # label and year of each review's movie (NaN for movies not in the dataset)
+        keep = joined['rating_binary'].notna().to_numpy()
+        in_fold = _movie_fold(segment['imdbid'], config['folds']) == fold
+        keep &= ~in_fold if train else in_fold
+        columns = {**{name: segment[name] for name in SCORE_COLUMNS}, 'year': joined['year'].to_numpy()}
+        X = np.column_stack([columns[name] for name in features]).astype(np.float64)[keep]
+        y = joined['rating_binary'].to_numpy()[keep].astype(np.int8)
+        rows = rng.permutation(len(y)) if rng is not None else np.arange(len(y))
+        for start in range(0, len(rows), config['batch_size']):
+            batch = rows[start:start + config['batch_size']]
+            yield X[batch], y[batch]
+
+
+BATCH_SOURCES = {'movie': _movie_batches, 'review': _review_batches}
+
+
+# Function to score predicted pass probabilities: accuracy, log loss, Brier score and calibration per probability bin
+def evaluate(y, prob):
+    from sklearn.metrics import log_loss
+    y = np.asarray(y, dtype=np.float64)
+    bins = np.minimum((prob * CALIBRATION_BINS).astype(int), CALIBRATION_BINS - 1)
+    count = np.bincount(bins, minlength=CALIBRATION_BINS)
+    predicted = np.bincount(bins, weights=prob, minlength=CALIBRATION_BINS)
+    observed = np.bincount(bins, weights=y, minlength=CALIBRATION_BINS)
+    filled = count > 0
+    return {
+        'rows': int(len(y)),
+        'accuracy': float(np.mean((prob >= 0.5) == y)),
+        'log_loss': float(log_loss(y, prob, labels=[0, 1])),
+        'brier': float(np.mean((prob - y) ** 2)),
+        'ece': float(np.abs(predicted - observed)[filled].sum() / len(y)),
+        'calibration': [{'bin': int(b), 'count': int(count[b]), 'mean_predicted': float(predicted[b] / count[b]),
+                         'observed_pass_rate': float(observed[b] / count[b])} for b in np.flatnonzero(filled)],
+    }
+
+
+# Function to fit and evaluate one cross-validation fold with mini-batch SGD (runs in a worker process)
+def _run_fold(task):
+    from sklearn.linear_model import SGDClassifier
+    from sklearn.preprocessing import StandardScaler
+    config, data, fold = task
+    batches = BATCH_SOURCES[config['level']]
+    rng = np.random.default_rng([config['random_state'], fold])
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    scaler = StandardScaler()
+    for X, _ in batches(data, config, fold, train=True):
+        if len(X):
+            scaler.partial_fit(X)
+    model = SGDClassifier(loss='log_loss', alpha=config['alpha'], random_state=config['random_state'])
+    for _ in range(config['epochs']):
+        for X, y in batches(data, config, fold, train=True, rng=rng):
+            if len(y):
+                model.partial_fit(scaler.transform(X), y, classes=[0, 1])
+    fit_seconds = time.perf_counter() - start
+
+    labels, probs = [], []
+    for X, y in batches(data, config, fold, train=False):
+        if len(y):
+            labels.append(y)
+            probs.append(model.predict_proba(scaler.transform(X))[:, 1])
+    if not labels:
+        raise ValueError(f"Fold {fold} has no rows to evaluate; the review store holds too few reviews of movies in the dataset")
+    metrics = evaluate(np.concatenate(labels), np.concatenate(probs))
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'fold': fold, 'fit_seconds': fit_seconds, 'peak_mib': peak / 2 ** 20, **metrics}
+
+
+# Function to train the original in-memory model on one train/test split
+def _run_batch(config, df):
+    from sklearn.model_selection import train_test_split
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.metrics import classification_report
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    X = df[config['features']]
+    y = df['rating_binary']
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=config['test_size'], random_state=config['random_state'])
+
+    # Remove rows with NaN or infinite values in the training data
+    X_train = X_train.replace([np.inf, -np.inf], np.nan).dropna()
+    y_train = y_train[X_train.index]
+
+    model = LogisticRegression()
+    model.fit(X_train, y_train)
+    fit_seconds = time.perf_counter() - start
+
+    y_pred = model.predict(X_test)
+    metrics = evaluate(y_test.to_numpy(), model.predict_proba(X_test)[:, 1])
+    metrics['accuracy'] = float(np.mean(y_pred == y_test.to_numpy()))
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'fit_seconds': fit_seconds, 'peak_mib': peak / 2 ** 20, **metrics, 'classification_report': classification_report(y_test, y_pred)}
+
+
+# Function to train a configuration (by name or as a dict) and return its report; streaming configurations run one CV fold per worker process (of a new
+# pool of 'workers', or of 'executor' when given)
+def run_config(config=MODEL_CONFIG, df=None, store_dir=REVIEW_STORE_DIR, workers=None, report_path=None, executor=None):
+    name = config if isinstance(config, str) else 'custom'
+    config = MODEL_CONFIGS[config] if isinstance(config, str) else config
+    start = time.perf_counter()
+    df = df if df is not None else load_movies()
+
+    if config['solver'] == 'batch':
+        report = {'config': name, **config, **_run_batch(config, df)}
+    else:
+        k = config['folds']
+        if config['level'] == 'movie':
+            X, y = movie_features(df, config['features'], store_dir)
+            data = (X, y, np.random.default_rng(config['random_state']).permutation(len(y)) % k)
+        else:
+            if not segment_paths(store_dir): # e.g. a fresh checkout: the review store isn't committed
+                raise FileNotFoundError(f"The review store '{store_dir}' has no reviews; run 'python CODE/bechdel.py score' (from the MATERIALS folder) "
+                                        f"to fill it before training the '{name}' configuration")
+            data = (store_dir, df.drop_duplicates('imdbid').set_index('imdbid')[['rating_binary', 'year']].astype(np.float64))
+        with nullcontext(executor) if executor is not None else ProcessPoolExecutor(max_workers=workers) as pool:
+            folds = list(pool.map(_run_fold, [(config, data, fold) for fold in range(k)]))
+        summary = {metric: float(np.mean([f[metric] for f in folds])) for metric in ['accuracy', 'log_loss', 'brier', 'ece', 'fit_seconds']}
+        summary['peak_mib'] = max(f['peak_mib'] for f in folds)
+        report = {'config': name, **config, **summary, 'folds': folds}
+    report['total_seconds'] = time.perf_counter() - start
+
+    if report_path:
+        os.makedirs(os.path.dirname(report_path), exist_ok=True)
+        with open(report_path, 'w') as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+# Function to run one model configuration and print its report (the 'regress' command of bechdel.py)
+def main(config=MODEL_CONFIG):
+    report = run_config(config, report_path=os.path.join(REPORT_DIR, f'regression_{config}.json'))
+    print(f"Configuration '{config}': accuracy {report['accuracy']:.3f}, log loss {report['log_loss']:.3f}, Brier {report['brier']:.3f}, "
+          f"ECE {report['ece']:.3f}")
+    print(f"Fit time {report['fit_seconds']:.2f} s per fold, peak memory {report['peak_mib']:.1f} MiB, total {report['total_seconds']:.2f} s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+'''
+Bechdel Command Line
+    One entry point for the stages of the project. Every command runs the main() of the script that implements it:
+
+        sync      pull new movies from bechdeltest.com into the dataset (ScrapeNewBechdel.py)
+        score     scrape the IMDb reviews and score their sentiment (IMDbReviewSentiment.py); --budget caps the requests of the run
+        tests     run the hypothesis tests (AnalysisRunner.py); --names runs a subset
+        plots     render the exploratory and analysis plots (ExploratoryPlots.py, AnalysisPlots.py); --group renders one group, --force every plot
+        regress   fit and evaluate a regression configuration (StreamingLogistic.py); --config picks the configuration
+        import    import './DATA/bechdel_movies.csv' into the dataset table as a new version (BechdelData.py)
+        export    write the dataset table's current version to './DATA/bechdel_movies.csv' (BechdelData.py)
+        lexicon   vendor NLTK's VADER lexicon into './DATA/vader_lexicon.pkl' (FastVader.py)
+        startup   measure the startup time of every command and compare it with its budget
+
+    Only the standard library is imported at the top of this script. A command imports the modules it needs when it runs, so 'tests' never loads
+    matplotlib and 'sync' never loads scipy, and those modules import scipy, matplotlib and seaborn only inside the tests and plots that use them.
+    Reviews are scored with the vendored lexicon, so nothing is downloaded. Plots are rendered with the non-interactive Agg backend, which skips
+    matplotlib's search for a GUI toolkit.
+
+    Startup time is the time from launching the interpreter until a command's modules are imported and it starts working, and it's paid on every run.
+    Every command has a startup budget in seconds ('budget' in its registration). Each run measures how long its imports took and
+    prints a warning on stderr when they were over budget. 'startup' launches every command with --startup-only (import, then exit) in a fresh
+    interpreter 'repeats' times. It reports the fastest wall time, writes './OUTPUT/benchmarks/startup.json' and exits with status 1 when a command is over
+    its budget.
+
+    Adding a command is a registration; the listed modules are imported (and timed) before the function is called with them:
+
+        @command('name', 'What the command does', modules=['SomeScript'], budget=1.0)
+        def name(args, modules):
+            modules['SomeScript'].main()
+
+    Usage (from the MATERIALS folder):
+        python CODE/bechdel.py tests --names sentiment_ttest year_ttest
+        python CODE/bechdel.py plots --group analysis
+        python CODE/bechdel.py startup --repeats 5
+
+    Each command requires the libraries of the scripts it runs; this script itself only needs the standard library.
+'''
+
+import argparse
+import importlib
+import json
+import os
+import subprocess
+import sys
+import time
+
+from Checkpoint import atomic_write
+
+STARTUP_REPORT_PATH = './OUTPUT/benchmarks/startup.json'
+STARTUP_REPEATS = 3 # fresh interpreters per command; the fastest one is reported
+PLOT_GROUPS = {'exploratory': 'ExploratoryPlots', 'analysis': 'AnalysisPlots'}
+
+# Registry of commands: name -> {'func', 'help', 'modules', 'budget', 'arguments'}
+COMMANDS = {}
+
+
+# Decorator to register a command. 'modules' is a list of module names, or a function of the parsed arguments returning one; 'arguments' is a list of
+# (flags, keyword arguments) pairs for argparse; 'budget' is the startup budget in seconds (None: not measured).
+def command(name, help, modules=(), budget=None, arguments=()):
+    def register(func):
+        COMMANDS[name] = {'func': func, 'help': help, 'modules': modules, 'budget': budget, 'arguments': arguments}
+        return func
+    return register
+
+
+# Function to list the modules a command imports for the given arguments
+def command_modules(spec, args):
+    modules = spec['modules']
+    return list(modules(args) if callable(modules) else modules)
+
+
+@command('sync', 'Pull new movies from bechdeltest.com into the dataset', modules=['ScrapeNewBechdel'], budget=1.0)
+def sync(args, modules):
+    modules['ScrapeNewBechdel'].main()
+
+
+@command('score', 'Scrape the IMDb reviews and score their sentiment', modules=['IMDbReviewSentiment'], budget=1.0,
+         arguments=[(['--budget'], {'type': int, 'default': None, 'help': 'requests to spend on the most stale movies (default: REQUEST_BUDGET)'})])
+def score(args, modules):
+    sentiment = modules['IMDbReviewSentiment']
+    sentiment.main(args.budget if args.budget is not None else sentiment.REQUEST_BUDGET)
+
+
+@command('tests', 'Run the hypothesis tests', modules=['AnalysisRunner'], budget=1.5,
+         arguments=[(['--names'], {'nargs': '+', 'help': 'tests to run (default: all)'})])
+def tests(args, modules):
+    runner = modules['AnalysisRunner']
+    unknown = sorted(set(args.names or ()) - set(runner.HYPOTHESES))
+    if unknown:
+        raise SystemExit(f"Unknown tests: {', '.join(unknown)} (available: {', '.join(runner.HYPOTHESES)})")
+    runner.main(args.names)
+
+
+@command('plots', 'Render the exploratory and analysis plots', budget=2.5,
+         modules=lambda args: list(PLOT_GROUPS.values()) if args.group == 'all' else [PLOT_GROUPS[args.group]],
+         arguments=[(['--group'], {'choices': [*PLOT_GROUPS, 'all'], 'default': 'all', 'help': 'plot group to render (default: all)'}),
+                    (['--force'], {'action': 'store_true', 'help': 'render every plot, even unchanged ones'})])
+def plots(args, modules):
+    for module in modules.values():
+        module.main(force=args.force)
+
+
+@command('regress', 'Fit and evaluate a regression configuration', modules=['StreamingLogistic'], budget=1.0,
+         arguments=[(['--config'], {'default': None, 'help': 'model configuration (default: MODEL_CONFIG)'})])
+def regress(args, modules):
+    logistic = modules['StreamingLogistic']
+    config = args.config or logistic.MODEL_CONFIG
+    if config not in logistic.MODEL_CONFIGS:
+        raise SystemExit(f"Unknown configuration '{config}' (available: {', '.join(logistic.MODEL_CONFIGS)})")
+    logistic.main(config)
+
+
+@command('import', "Import './DATA/bechdel_movies.csv' into the dataset table as a new version", modules=['BechdelData'])
+def import_csv(args, modules):
+    data = modules['BechdelData']
+    version = data.import_movies()
+    print(f"Imported {data.DATA_PATH} into {data.TABLE_DIR}; the table is at version {version}")
+
+
+@command('export', "Write the dataset table's current version to './DATA/bechdel_movies.csv'", modules=['BechdelData'])
+def export_csv(args, modules):
+    data = modules['BechdelData']
+    version = data.export_movies()
+    print(f"Exported version {version} of {data.TABLE_DIR} to {data.DATA_PATH}")
+
+
+@command('lexicon', "Vendor NLTK's VADER lexicon into './DATA/vader_lexicon.pkl'", modules=['FastVader'],
+         arguments=[(['--path'], {'default': None, 'help': 'where to write the lexicon (default: LEXICON_PATH)'})])
+def lexicon(args, modules):
+    vader = modules['FastVader']
+    path = vader.vendor_lexicon(args.path or vader.LEXICON_PATH)
+    resources = vader.load_lexicon(path)
+    print(f"Wrote {len(resources['lexicon'])} lexicon entries (nltk {resources['nltk_version']}) to {path}")
+
+
+@command('startup', 'Measure the startup time of every command against its budget',
+         arguments=[(['--commands'], {'nargs': '+', 'help': 'commands to measure (default: every command with a budget)'}),
+                    (['--repeats'], {'type': int, 'default': STARTUP_REPEATS, 'help': 'fresh interpreters per command'})])
+def startup(args, modules):
+    names = args.commands or [name for name, spec in COMMANDS.items() if spec['budget'] is not None]
+    results = {}
+    for name in names:
+        walls, imports = [], []
+        for _ in range(args.repeats):
+            start = time.perf_counter()
+            completed = subprocess.run([sys.executable, os.path.abspath(__file__), '--startup-only', name], capture_output=True, text=True)
+            walls.append(time.perf_counter() - start)
+            if completed.returncode != 0:
+                results[name] = {'error': (completed.stderr.strip().splitlines() or [f'exit status {completed.returncode}'])[-1]}
+                break
+            imports.append(json.loads(completed.stdout.strip().splitlines()[-1])['import_seconds'])
+        else:
+            budget = COMMANDS[name]['budget']
+            results[name] = {'wall_seconds': min(walls), 'import_seconds': min(imports), 'budget_seconds': budget,
+                             'over_budget': budget is not None and min(walls) > budget}
+
+    print(f"{'command':<10} {'startup':>9} {'imports':>9} {'budget':>8}")
+    for name, result in results.items():
+        if 'error' in result:
+            print(f"{name:<10} failed: {result['error']}")
+            continue
+        budget = f"{result['budget_seconds']:.2f} s" if result['budget_seconds'] is not None else '-'
+        flag = '  OVER BUDGET' if result['over_budget'] else ''
+        print(f"{name:<10} {result['wall_seconds']:7.3f} s {result['import_seconds']:7.3f} s {budget:>8}{flag}")
+
+    os.makedirs(os.path.dirname(STARTUP_REPORT_PATH), exist_ok=True)
+    atomic_write(STARTUP_REPORT_PATH, json.dumps({'python': sys.version.split()[0], 'repeats': args.repeats, 'commands': results}, indent=2))
+    print(f"Report written to {STARTUP_REPORT_PATH}")
+    if any('error' in result or result['over_budget'] for result in results.values()):
+        sys.exit(1)
+
+
+# Function to build the argument parser from the registered commands
+def build_parser():
+    parser = argparse.ArgumentParser(prog='bechdel', description='Bechdel test and IMDb sentiment pipeline')
+    parser.add_argument('--startup-only', action='store_true', help=argparse.SUPPRESS) # import the command's modules, report the time and exit
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    for name, spec in COMMANDS.items():
+        subparser = subparsers.add_parser(name, help=spec['help'], description=spec['help'])
+        for flags, kwargs in spec['arguments']:
+            subparser.add_argument(*flags, **kwargs)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    spec = COMMANDS[args.command]
+    os.environ.setdefault('MPLBACKEND', 'Agg') # plots are only ever saved to files
+
+    start = time.perf_counter()
+    modules = {name: importlib.import_module(name) for name in command_modules(spec, args)}
+    import_seconds = time.perf_counter() - start
+    if args.startup_only:
+        print(json.dumps({'command': args.command, 'import_seconds': import_seconds}))
+        return
+    if spec['budget'] is not None and import_seconds > spec['budget']:
+        print(f"warning: '{args.command}' took {import_seconds:.2f} s to import its modules (budget {spec['budget']:.2f} s)", file=sys.stderr)
+    spec['func'](args, modules)
+
+
+if __name__ == '__main__':
+    main()